@@ -3,10 +3,11 @@ import sys
 import pandas as pd
 import os
 from utils.create_geo_matrix import create_geo_matrix
-from utils.fastnumpyio import load as fastio_load 
-from utils.transformations import global_2_compass
+from utils.SN_Curve import miner_sums
 from utils.setup_custom_logger import setup_custom_logger
 from utils.read_structural_report import read_utilization_and_store_geometries
+from utils.worker_context import init_worker, get_shared_data
+from utils.IO_handler import load_dataframe, store_dataframe, list_dataframes
 from multiprocessing import Pool
 from utils.DB_turbine_name_funcs import return_turbine_name_from_path, sort_paths_according_to_turbine_names
 
@@ -18,22 +19,35 @@ For any other elevations - this script captures it
 When running this script, please be aware of the booleans deciding (1) to pre-process structural reports, and (2) if the code should be run multiprocessed
 '''
 
-def find_above_below_closest_elevations(df, member_elevations):
-    """Takes in a dataframe with information about points at a certain elevation on a turbine, along with information about the elevations of members / nodes from simulation
-    It calculates and returns the member that the different points are closest to wrt. elevation, both closest to above, closest to below, and the closest in absolute value
+_markov_matrices = dict() # path as key, (modification time, memory mapped markov matrix) as values, opened once per process
+
+def find_above_below_closest_members(elevations, member_elevations):
+    """Takes in the elevations of points on a turbine, along with the elevations of members / nodes from simulation
+    It calculates and returns the member that the different points are closest to wrt. elevation, both closest to above, closest to below, and the closest in absolute value.
+    The members bracketing each point are found by np.searchsorted on the sorted member elevations, so all points are handled at once
 
     Args:
-        df (pd.DataFrame): Dataframe with information about elevations
-        member_elevations (np.ndarray): numpy array containing floats representing the elevations of the member nodes in mLAT
+        elevations (np.ndarray): (n_points,) numpy array containing floats representing the elevations of the points in mLAT
+        member_elevations (np.ndarray): (n_members,) numpy array containing floats representing the elevations of the member nodes in mLAT
 
     Returns:
-        3 x df: containing elevation of closest members above, closest members below, and the closest members per absolute value
+        3 x np.ndarray: (n_points,) indices in member_elevations of the closest members above (or at the same elevation), closest members below, and the closest members per absolute value.
+                        Points without a member above or below get index 0, and members at the same elevation resolve to the first of them in member_elevations
     """
-    df['dist_to_members'] = df.apply(lambda row: member_elevations - row['elevation'], axis=1)
-    df['idx_elevation_above'] = df.apply(lambda row: np.ma.MaskedArray(row['dist_to_members'], row['dist_to_members'] < 0.0).argmin(), axis=1)
-    df['idx_elevation_below'] = df.apply(lambda row: np.ma.MaskedArray(row['dist_to_members'], row['dist_to_members'] >= 0.0).argmax(), axis=1)
-    df['idx_elevation_closest'] = df.apply(lambda row: np.abs(row['dist_to_members']).argmin(), axis=1)
-    return member_elevations[df['idx_elevation_above']],  member_elevations[df['idx_elevation_below']], member_elevations[df['idx_elevation_closest']]
+    n_members = len(member_elevations)
+    order = np.argsort(member_elevations, kind = 'stable') # stable so that equal elevations keep their order in member_elevations
+    sorted_elevations = member_elevations[order]
+    
+    # Position of the lowest member at or above each point, in the sorted elevations
+    pos_above = np.searchsorted(sorted_elevations, elevations, side = 'left')
+    idx_above = np.where(pos_above < n_members, order[np.minimum(pos_above, n_members - 1)], 0)
+    
+    # The highest member below each point is the one before, moved to the first member at that elevation
+    pos_below = np.searchsorted(sorted_elevations, sorted_elevations[np.maximum(pos_above - 1, 0)], side = 'left')
+    idx_below = np.where(pos_above > 0, order[pos_below], 0)
+    
+    idx_closest = np.abs(member_elevations[None, :] - elevations[:, None]).argmin(axis = 1)
+    return idx_above, idx_below, idx_closest
 
 def return_worst_elevation(df):
     # This selects only elevations based on in_place utilization
@@ -90,6 +104,51 @@ def handle_DFFs(DFFs, n_elevations):
     
     return DFFs
 
+def create_cluster_context(cluster, member_path, DEM_data_path, member_markov_path):
+    """Reads the member data shared by all turbines in a cluster, so that it is read once per cluster instead of once per turbine.
+    The context only holds the paths of the markov matrices, which are memory mapped by each process that uses them, see get_markov_matrix.
+    The context is small when sent to the worker processes, and the pages of the matrices are shared by the workers through the OS page cache
+
+    Args:
+        cluster (str): cluster name
+        member_path (str): r-string path of location of the member info file, ready to be formatted for the cluster
+        DEM_data_path (str): r-string path to the total DEM sums, ready to be formatted for the cluster
+        member_markov_path (str): r-string path of the markov matrices, ready to be formatted for the cluster and member no.
+
+    Returns:
+        dict: member_2_elevation_map, elevation_2_member_map, member_elevations (n_members,) and member_DEM_sums (n_members, n_sectors) in the order of the DEM sums file, 
+              and markov_paths with member elevation as key and path to the (n_sectors, n_cycles, 2) markov matrix as values
+    """
+    member_geometry = pd.read_excel(member_path.format(cluster))
+    df_DEM_members_xlsx = load_dataframe(DEM_data_path.format(cluster, cluster))
+    
+    member_2_elevation_map = {k: v for k, v in zip(member_geometry[f'member_id'], member_geometry['elevation'])}
+    elevation_2_member_map = {k: v for k, v in zip(member_geometry['elevation'], member_geometry[f'member_id'])}
+    
+    # Paths of the pre calculated markov matrices of the member elevations. The files of fastnumpyio.save are plain .npy files and can be memory mapped
+    markov_paths = {member_2_elevation_map[mbr]: member_markov_path.format(cluster, mbr) for mbr in member_2_elevation_map.keys()}
+    
+    return dict(member_2_elevation_map = member_2_elevation_map,
+                elevation_2_member_map = elevation_2_member_map,
+                member_elevations      = np.array([float(key) for key in (df_DEM_members_xlsx['mLat'].values)]),
+                member_DEM_sums        = df_DEM_members_xlsx.iloc[:, 1:].to_numpy(dtype = float), # 1: is used since first column contains the member mLat values
+                markov_paths           = markov_paths)
+
+def get_markov_matrix(path):
+    """Memory maps a markov matrix in the current process, once per process and again only if the file has changed.
+    Memory maps are not sent to the worker processes, since a pickled memory map carries a copy of all its data
+
+    Args:
+        path (str): path to the .npy markov matrix
+
+    Returns:
+        np.memmap: read only (n_sectors, n_cycles, 2) markov matrix
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if path not in _markov_matrices or _markov_matrices[path][0] != mtime:
+        _markov_matrices[path] = (mtime, np.load(path, mmap_mode = 'r'))
+    return _markov_matrices[path][1]
+
 def calculate_utilization_single_turbine(structural_report_geo_path, 
                                          member_path,
                                          DEM_data_path,
@@ -108,9 +167,12 @@ def calculate_utilization_single_turbine(structural_report_geo_path,
         member_markov_path (str): r-string path of the markov matrices for the relevant cluster, ready to be formatted for correct cluster and member no.
         logger (logger): logger
         DFFs (list): list of DFFs per point. If not given, handle_DFFs will format DFFs to be a list of floats = 3.0
+        
+    The member data of the turbine's cluster is taken from the cluster contexts published to the process by calculate_utilization_all_turbines, see utils.worker_context. 
+    If the cluster has no published context, e.g. when a single turbine is calculated, it is read here with create_cluster_context
 
     Returns:
-        None: None. But stores two Excel files; one for utils for all elevations, and one for util info of the worst elevation
+        None: None. But stores two tables, see utils.IO_handler.store_dataframe; one for utils for all elevations, and one for util info of the worst elevation
     """
 
     sectors = [float(i) for i in range(0,359,15)]
@@ -119,22 +181,22 @@ def calculate_utilization_single_turbine(structural_report_geo_path,
     wohler_exp = 5.0
     
     # Load geometries of interest 
-    geometries_of_interest_df = pd.read_excel(structural_report_geo_path)
+    geometries_of_interest_df = load_dataframe(structural_report_geo_path)
     turbine_name = geometries_of_interest_df.iloc[0]['turbine_name']
     cluster = geometries_of_interest_df.iloc[0]['cluster']
     logger.info(f'Interpolating DEM and calculating utilization for {cluster} turbine {turbine_name}')
         
-    member_geometry = pd.read_excel(member_path.format(cluster))
-    df_DEM_members_xlsx = pd.read_excel(DEM_data_path.format(cluster, cluster))
-    
-    member_2_elevation_map = {k: v for k, v in zip(member_geometry[f'member_id'], member_geometry['elevation'])}
-    elevation_2_member_map = {k: v for k, v in zip(member_geometry['elevation'], member_geometry[f'member_id'])}
+    cluster_context = get_shared_data().get('cluster_contexts', dict()).get(cluster)
+    if cluster_context is None:
+        cluster_context = create_cluster_context(cluster, member_path, DEM_data_path, member_markov_path)
+    elevation_2_member_map = cluster_context['elevation_2_member_map']
+    markov_paths           = cluster_context['markov_paths']
     
     # Create geometries with pre-calculated A, I, Z, alpha etc
     geometries_of_interest = create_geo_matrix(geometries_of_interest_df, sectors)
     
     # Calculate the DEM of all member elevations, to be used for interpolation
-    member_elevations = np.array([float(key) for key in (df_DEM_members_xlsx['mLat'].values)])
+    member_elevations = cluster_context['member_elevations']
     
     df = pd.DataFrame(pd.DataFrame(geometries_of_interest)).T
     
@@ -144,65 +206,79 @@ def calculate_utilization_single_turbine(structural_report_geo_path,
     
     DFFs = handle_DFFs(DFFs, df.shape[0])
     
+    # Point properties as (n_points,) arrays, in the order of the rows in df
+    n_points   = df.shape[0]
+    points     = np.arange(n_points)
+    elevations = df['elevation'].to_numpy(dtype = float)
+    lifetime   = df['lifetime'].to_numpy(dtype = float)
+    Nref       = df['Nref'].to_numpy(dtype = float)
+    Z          = df['Z'].to_numpy(dtype = float)
+    scf        = df['scf'].to_numpy(dtype = float)
+    gritblast  = df['gritblast'].to_numpy(dtype = float)
+    alpha      = df['alpha'].to_numpy(dtype = float)
+    
     # Find the geo properties, closest member elevations and DEM values, and interpolate 
-    df['curve'] = df.apply(lambda row: row['sn_curve'].SN.name, axis=1)
-    above, below, close = find_above_below_closest_elevations(df,member_elevations)
-    df['elevation_above'] = above
-    df['elevation_below'] = below
-    df['elevation_closest'] = close
-    df['member_closest'] = df.apply(lambda row:  elevation_2_member_map[row['elevation_closest']], axis = 1)
-    df['above_DEM_sums'] = df.apply(lambda row: np.array(df_DEM_members_xlsx.iloc[row['idx_elevation_above']][1:]), axis=1) # 1: is used since first column contains the member mLat values
-    df['below_DEM_sums'] = df.apply(lambda row: np.array(df_DEM_members_xlsx.iloc[row['idx_elevation_below']][1:]), axis=1)
-    df['DEM_elevation_above'] = df.apply(lambda row: ((row['lifetime'] / row['Nref'] * row['above_DEM_sums'])**(1 / wohler_exp)), axis=1) #((T_lifetime / N_equivalent * df['above_DEM_sums'])**(1 / wohler_exp))
-    df['DEM_elevation_below'] = df.apply(lambda row: ((row['lifetime'] / row['Nref'] * row['below_DEM_sums'])**(1 / wohler_exp)), axis=1) #((T_lifetime / N_equivalent * df['below_DEM_sums'])**(1 / wohler_exp))
-    df['DEM_elevation_closest'] = df.apply(lambda row: row['DEM_elevation_above'] if (row['elevation_closest'] > row['elevation']) else row['DEM_elevation_below'], axis=1)
-    df['DEM_interpolated'] = df['DEM_elevation_below'] + (df['DEM_elevation_above'] - df['DEM_elevation_below']) * ( (df['elevation'] - df['elevation_below']) / (df['elevation_above'] - df['elevation_below']) )
+    df['curve'] = [sn_curve.SN.name for sn_curve in df['sn_curve']]
+    idx_above, idx_below, idx_closest = find_above_below_closest_members(elevations, member_elevations)
+    elevation_above   = member_elevations[idx_above]
+    elevation_below   = member_elevations[idx_below]
+    elevation_closest = member_elevations[idx_closest]
+    df['elevation_closest'] = elevation_closest
+    df['member_closest'] = [elevation_2_member_map[elevation] for elevation in elevation_closest]
+    
+    # DEMs of the members above and below all points, as (n_points, n_sectors) matrices
+    member_DEM_sums = cluster_context['member_DEM_sums']
+    DEM_elevation_above = ((lifetime / Nref)[:, None] * member_DEM_sums[idx_above])**(1 / wohler_exp) #((T_lifetime / N_equivalent * above_DEM_sums)**(1 / wohler_exp))
+    DEM_elevation_below = ((lifetime / Nref)[:, None] * member_DEM_sums[idx_below])**(1 / wohler_exp) #((T_lifetime / N_equivalent * below_DEM_sums)**(1 / wohler_exp))
+    DEM_elevation_closest = np.where((elevation_closest > elevations)[:, None], DEM_elevation_above, DEM_elevation_below)
+    DEM_interpolated = DEM_elevation_below + (DEM_elevation_above - DEM_elevation_below) * ( (elevations - elevation_below) / (elevation_above - elevation_below) )[:, None]
     
     # Choose DEM at the closest sector to the SCF orientation. If omnidirectional => choose the largest DEM at the reference elevation
-    df['closest_sector_idx'] = df.apply(lambda row: row['DEM_interpolated'].argmax() if row['orientation'] == None else np.absolute(sectors - row['orientation']).argmin(), axis=1)
-    df['ref_orientation'] = df.apply(lambda row: global_2_compass(sectors[row['closest_sector_idx']]), axis=1)
+    omnidirectional = np.array([orientation is None for orientation in df['orientation']], dtype = bool)
+    orientations    = np.array([np.nan if orientation is None else orientation for orientation in df['orientation']], dtype = float)
+    closest_sector_idx = np.where(omnidirectional, DEM_interpolated.argmax(axis = 1), np.absolute(np.array(sectors)[None, :] - orientations[:, None]).argmin(axis = 1))
+    df['closest_sector_idx'] = closest_sector_idx
     
     # Find the corresponding DEM at hotspot, and the DEM scaling factor relative to the closest elevation + sector
-    df['DEM_hs_MPa'] = df.apply(lambda row: row['DEM_interpolated'][row['closest_sector_idx']] / 1e6, axis=1)  
-    df['DEM_scaling_factor'] = df.apply(lambda row: row['DEM_interpolated'][row['closest_sector_idx']] / row['DEM_elevation_closest'][row['closest_sector_idx']], axis=1)   
+    DEM_hs = DEM_interpolated[points, closest_sector_idx]
+    DEM_scaling_factor = DEM_hs / DEM_elevation_closest[points, closest_sector_idx]
+    df['DEM_hs_MPa'] = DEM_hs / 1e6
+    df['DEM_scaling_factor'] = DEM_scaling_factor
     
-    # Gather pre calculated markov matrices from member elevations')
-    markov_matrices = {}
-    for mbr in member_2_elevation_map.keys():
-        path = member_markov_path.format(cluster, mbr)
-        member_elevation = member_2_elevation_map[mbr]
-        # print(f'Loading matrix for {cluster} member {mbr} @ {member_elevation} mLat')
-        markov_matrices[member_elevation] = np.array(fastio_load(path))
+    # Store the equivalent nominal and hotspot stress range 
+    Seq    = DEM_hs / 1e6 / Z
+    Seq_hs = Seq * scf * gritblast
+    df['Seq'] = Seq
+    df['Seq_hs'] = Seq_hs
     
     # Calculate utilization for all other elevations
-    
-    # choose closest sector as reference markov matrix
-    logger.info('Collecting markov reference for closest elevations at worst sector')
-    df['markov_reference'] = df.apply(lambda row: markov_matrices[row['elevation_closest']][row['closest_sector_idx']], axis=1)
-    
-    # NOTE sorting could be beneficial to avoid rounding errors, but takes a lot of time and has not been shown to give any other result than unsorted
-    #df['markov_reference'] = df.apply(lambda row: row['markov_reference'][ row['markov_reference'][:, 0].argsort() ], axis=1) # sort according to ascending moment ranges
-
-    # Scale reference markov for hotspot: moment ranges scaled according to the DEM_scf / DEM_elevation_closest factor
-    df['markov_hotspot'] = df.apply(lambda row: np.hstack( (row['markov_reference'][:, [0]] * row['DEM_scaling_factor'], row['markov_reference'][:, [1]])), axis=1)
-    
     logger.info('Calculating stress ranges and damage')
-    # Calculate stress
-    df['stress_ranges_scaled'] = df.apply(lambda row: row['markov_hotspot'][:, [0]] / row['Z'] * row['scf'] * row['gritblast'] * row['alpha'], axis=1)
-    
-    # Store the equivalent nominal and hotspot stress range 
-    df['Seq'] = df['DEM_hs_MPa'] / df['Z']
-    df['Seq_hs'] = df['Seq'] * df['scf'] * df['gritblast']
     
     # Create stress cycles made out of stress in MPa and counts over entire lifetime, 
     # Exception is if validation type is "Equivalent", in which we skip the markov matrix scaling and calculate stress directly from DEM as per reports
-    df['stress_cycles_MPa_lifetime'] = df.apply(lambda row: 
-        np.hstack( (row['stress_ranges_scaled'] / 1e6, row['markov_reference'][:, [1]] * row['lifetime'])) if row['ValType'].lower() != 'equivalent' 
-        else np.array([[row['Seq_hs'] * row['alpha'], row['Nref']]]), axis=1)
+    stress_cycles_MPa_lifetime = [np.array([[Seq_hs[point_idx] * alpha[point_idx], Nref[point_idx]]]) for point_idx in points]
+    markov_points = np.array([val_type.lower() != 'equivalent' for val_type in df['ValType']], dtype = bool)
+    
+    # The points sharing the closest member are scaled at once, as (n_points_member_i, n_cycles) matrices
+    for member_idx in np.unique(idx_closest[markov_points]):
+        points_member_i = points[markov_points & (idx_closest == member_idx)]
+        
+        # choose closest sector as reference markov matrix
+        markov_reference = get_markov_matrix(markov_paths[member_elevations[member_idx]])[closest_sector_idx[points_member_i]] # (n_points_member_i, n_cycles, 2)
+        
+        # NOTE sorting could be beneficial to avoid rounding errors, but takes a lot of time and has not been shown to give any other result than unsorted
+        
+        # Scale reference markov for hotspot: moment ranges scaled according to the DEM_scf / DEM_elevation_closest factor, and calculate stress
+        moment_ranges_hotspot = markov_reference[:, :, 0] * DEM_scaling_factor[points_member_i, None]
+        stress_ranges_scaled  = moment_ranges_hotspot / Z[points_member_i, None] * scf[points_member_i, None] * gritblast[points_member_i, None] * alpha[points_member_i, None]
+        counts_lifetime       = markov_reference[:, :, 1] * lifetime[points_member_i, None]
+        
+        for row_idx, point_idx in enumerate(points_member_i):
+            stress_cycles_MPa_lifetime[point_idx] = np.column_stack((stress_ranges_scaled[row_idx] / 1e6, counts_lifetime[row_idx]))
     
-    # Calculate utilization through miner sum, without DFF, as DFF is stored to be applied and possibly changedlater
-    df['rule_miner_sum_no_DFF'] = df.apply(lambda row: row['sn_curve'].miner_sum(row['stress_cycles_MPa_lifetime']), axis=1)
-    df['rule_DFF'] = df.apply(lambda row: DFFs[row.name], axis=1)
+    # Calculate utilization through miner sum, without DFF, as DFF is stored to be applied and possibly changedlater. Rows with the same SN curve are summed at once
+    df['rule_miner_sum_no_DFF'] = miner_sums(list(df['sn_curve']), stress_cycles_MPa_lifetime)
+    df['rule_DFF'] = [DFFs[point_name] for point_name in df.index]
     
     df = df[['elevation', 'in_out', 'description', 'D', 't', 
              'curve', 'DEM_hs_MPa', 'Seq', 'scf', 'gritblast',
@@ -215,12 +291,12 @@ def calculate_utilization_single_turbine(structural_report_geo_path,
         os.makedirs(result_path)
     
     df_path = os.path.join(result_path, "util_rule_vs_report.xlsx") 
-    df.to_excel(df_path, index = False)
+    _ = store_dataframe(df, df_path)
     pd.options.display.max_rows = 100 # Print more rows
     
     df_res = return_worst_elevation(df)
     df_res_path = os.path.join(result_path, "util_worst_elevation_comparison.xlsx")
-    df_res.to_excel(df_res_path, index = False)
+    _ = store_dataframe(df_res, df_res_path)
     
     return None
 
@@ -250,7 +326,7 @@ def preprocess_structure_reports(preprocess_reports, structure_file_paths, prepr
     else: 
         # we do not want to pre-process reports -> find all files matching 
         try:
-            preprosessed_structure_file_contents_paths = [os.path.join(path, name) for path, subdirs, files in os.walk(preprocessed_dir) for name in files if 'utils_and_geos_from_structure_report' in name]
+            preprosessed_structure_file_contents_paths = list_dataframes(preprocessed_dir, 'utils_and_geos_from_structure_report')
             logger.info(f'Option to load previously preprocessed and stored structural reports chosen. Found {len(preprosessed_structure_file_contents_paths)} files and returned their paths')
         except:
             logger.info('Error retrieving already preprocessed structural reports - please ensure that the script has been run at least once with preprocess_reports = True so the files exists. EXITING')
@@ -268,6 +344,7 @@ def calculate_utilization_all_turbines( preprosessed_structure_file_contents_pat
                                         DFFs = [], 
                                         multiprocess_turbines = True):
     """Sets up the large scale processing of calculate_utilization_single_turbine(). See arg definitions there.
+    The member data of each cluster is read once, see create_cluster_context, and published to the worker processes instead of being read by every turbine
 
     Args:
         multiprocess_turbines (bool, optional): switch for multiprocessing or not. Defaults to True.
@@ -285,14 +362,20 @@ def calculate_utilization_all_turbines( preprosessed_structure_file_contents_pat
              DFFs
             ) for i in range(len(preprosessed_structure_file_contents_paths))]
     
+    # The preprocessed reports are stored as <result_output_dir>/<cluster>/<turbine>/utils_and_geos_from_structure_report.<format>
+    clusters = sorted({os.path.normpath(filename).split(os.path.sep)[-3] for filename in preprosessed_structure_file_contents_paths})
+    logger.info(f'Reading member geometries, DEM sums and markov matrices of clusters {clusters}')
+    shared = {'cluster_contexts': {cluster: create_cluster_context(cluster, member_geo_path, DEM_data_path, member_markov_path) for cluster in clusters}}
+    
     # Call the utilization calculation for all turbines, multiprocessed or singlethreaded
     if multiprocess_turbines:
         logger.info(f'Calculating utilization for all turbines multiprocessed')
         n_cpus_in_mp = int(os.cpu_count())
-        with Pool(n_cpus_in_mp) as p:
+        with Pool(n_cpus_in_mp, initializer = init_worker, initargs = (shared,)) as p:
             _ = p.starmap(calculate_utilization_single_turbine, args)
     
     else:
+        _ = init_worker(shared)
         for i, filename in enumerate(preprosessed_structure_file_contents_paths):
             logger.info(f'[{i+1}/{len(preprosessed_structure_file_contents_paths)}] Calculating utilization for {os.path.normpath(filename).split(os.path.sep)[-2]}')
             _ = calculate_utilization_single_turbine(*args[i])
@@ -0,0 +1,54 @@
+from utils.extract_and_preprocess_data import extract_and_preprocess_data
+from utils.setup_custom_logger import setup_custom_logger
+from utils.simulation_cache import cache_store_path, convert_DLC_to_cache_store, is_cache_store_valid
+import os
+
+'''
+One-time conversion of the vendor simulation results into one compressed HDF5 store per cluster and DLC
+
+Run this once before main.py, get_moment_time_series etc. After conversion the case calculations read every case from the stores
+in output/simulation_cache instead of parsing the Bladed tree again. A store is only rebuilt if the vendor files it was made from have changed.
+To be run from the baseline_methods parent dir!
+'''
+
+def convert_simulation_results_cluster_i(cluster, logger, DLC_IDs = ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'], verify_hashes = False):
+    """Converts all DLCs of a cluster into cache stores, skipping those that are already converted and up to date
+
+    Args:
+        cluster (str): cluster name
+        logger (logger): logger
+        DLC_IDs (list, optional): list of str with DLC names. Defaults to ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'].
+        verify_hashes (bool, optional): switch to compare the content hashes of all source files of existing stores, also those with an unchanged modification time. Defaults to False.
+
+    Returns:
+        None: None
+    """
+    data_path             = os.path.join(os.getcwd(), 'data')
+    DLC_file_path         = os.path.join(data_path, f'Doc-0081164-HAL-X-13MW-DGB-A-OWF-Detailed DLC List-Fatigue Support Structure Load Assessment_Rev7.0.xlsx')
+    simulation_result_dir = os.path.join(data_path, f'Doc-0089427-HAL-X-13MW DB-A OWF-ILA3_{cluster}-model_fatigue_timeseries_all_elevations')
+    cache_dir             = os.path.join(os.getcwd(), 'output', 'simulation_cache')
+
+    for DLC in DLC_IDs:
+        df, _, n_cases, n_timesteps = extract_and_preprocess_data(DLC_file_path, DLC, cluster, simulation_result_dir)
+        store_path = cache_store_path(cache_dir, cluster, DLC)
+
+        if is_cache_store_valid(store_path, list(df.results_files), verify_hashes = verify_hashes, logger = logger):
+            logger.info(f'{cluster} {DLC} is already converted to {store_path}')
+            continue
+
+        logger.info(f'Converting {cluster} {DLC} with {n_cases} cases of {n_timesteps} timesteps')
+        _ = convert_DLC_to_cache_store(list(df.results_files), list(df.descr_files), store_path, logger = logger)
+        logger.info(f'Stored {cluster} {DLC} in {store_path}')
+
+    return None
+
+def convert_all_DBA_simulation_results(clusters = ['JLN', 'JLO', 'JLP']):
+    logger = setup_custom_logger('simulation_cache')
+    for cluster in clusters:
+        _ = convert_simulation_results_cluster_i(cluster, logger)
+    logger.info(f'Converted simulation results for clusters {clusters}')
+    return None
+
+if __name__ == '__main__':
+
+    _ = convert_all_DBA_simulation_results(clusters = ['JLN', 'JLO', 'JLP'])
@@ -1,15 +1,14 @@
-from utils.IO_handler import load_table
-from utils.fastnumpyio import load as fastio_load 
+from utils.IO_handler import load_table, load_dataframe, store_dataframe, list_dataframes
+from utils.cycle_store import create_cycle_index, locate_cycles, iterate_member_cycles
 from utils.setup_custom_logger import setup_custom_logger
 from utils.create_geo_matrix import create_geo_matrix
 from utils.create_fatigue_lookup_table import create_fatigue_table_DLC_i
+from utils.DLC_catalog import get_DLC_cases
 from utils.setup_custom_logger import setup_custom_logger
 import numpy as np
 import pandas as pd 
 import sys
 import os
-from multiprocessing import Pool
-from parse_markov_matrices import get_files_in_dir_matching_identifier_natsorted
 from utils.DB_turbine_name_funcs import return_turbine_name_from_path, return_cluster_name_from_path
 
 
@@ -17,112 +16,147 @@ from utils.DB_turbine_name_funcs import return_turbine_name_from_path, return_cl
 Script for calculating and creating the fatigue damage lookup table of a turbine's elevation with lowest structural fatigue lifetime
 '''
 
-def calculate_unweighted_damage_case_i(moment_cycles_closest_member_case_i_path, DEM_scaling_factor_from_closest_member, cross_section, DFF = 3.0):
-    """A slightly rewritten version of utils.calculate_damage_case_i. Uses the markov matrices (rainflow counting matrices) of the nearest member where time series were available per DLC case.
-    Scales the moment ranges according to the DEM interpolation factor, and uses cross sectional properties to calculate the corresponding damage.
+def calculate_unweighted_damages(moment_cycles, DEM_scaling_factor_from_closest_member, cross_section, DFF = 3.0):
+    """Vectorized version of calculate_unweighted_damage_case_i, for any number of DLC cases at once. 
+    Gives the same damage as calling calculate_unweighted_damage_case_i on each case
 
     Args:
-        moment_cycles_closest_member_case_i_path (str): r-string path to the markov matrix of the closest member, for case i
+        moment_cycles (np.ndarray): (..., n_sectors, n_cycles, 2) markov matrices of the closest member, e.g. (n_cases, n_sectors, n_cycles, 2) as read from the cycle store of the DLC
         DEM_scaling_factor_from_closest_member (float): the scaling factor from linearly interpolating DEM of the closest members to the current point
         cross_section (dict): cross sectional properties as loaded and pre-calculated previously
         DFF (float, optional): the design fatigue factor, giving safety margins > 1.0. Defaults to 3.0.
 
     Returns:
-        np.ndarray: linearly accumulated fatigue damage for each sector for the current DLC case i
+        np.ndarray: (..., n_sectors) linearly accumulated fatigue damage for each sector of each case
     """
-    
-    # a slightly rewritten version of utils.calculate_damage_case_i
-    # input: path to closest member's markov matrices for a case, and the corresponding scaling factor to be applied on the moment ranges
-    
-    # moment_cycles: (n_sectors, n_cycles, 2) array of all moment_cycles for all sectors of a given elevation's cross-section
-    moment_cycles = np.array(fastio_load(moment_cycles_closest_member_case_i_path))
-
     # nominal stress range for all sectors, corresponding to all n_cycles cycles
-    moment_ranges = moment_cycles[:, :, 0] * DEM_scaling_factor_from_closest_member# reduced to shape (n_sectors, n_cycles)
+    moment_ranges = moment_cycles[..., 0] * DEM_scaling_factor_from_closest_member # reduced to shape (..., n_sectors, n_cycles)
     nominal_stress_ranges = moment_ranges / cross_section['Z'] 
     
-    # Adjust the stress according the stress concentration factors for certain angles
-    scf_per_sector = np.repeat(np.array([cross_section['scf_per_point']]).T, nominal_stress_ranges.shape[1], axis=1)
-    stress_ranges  = (nominal_stress_ranges * scf_per_sector) * cross_section['gritblast'] # elementwise multiplication row wise of stress concentration factors in the relevant sectors
+    # Adjust the stress according the stress concentration factors for certain angles, broadcast along the cycles
+    scf_per_sector = np.asarray(cross_section['scf_per_point'])[:, None]
+    stress_ranges  = (nominal_stress_ranges * scf_per_sector) * cross_section['gritblast']
     stress_ranges *= cross_section['alpha']  # elementwise thickness scaling
     
     # Put together the stress cycles in MPa for use in the miner summation
-    stress_cycles = np.dstack( (stress_ranges * 1e-6, moment_cycles[:, :, 1])) # stack ranges with the cycles placed along third axis / in _D_epth => _D_stack
+    stress_cycles = np.stack((stress_ranges * 1e-6, moment_cycles[..., 1]), axis = -1)
     
-    n_sectors = stress_ranges.shape[0]
-    damage = np.zeros(n_sectors)
-    for sector_idx in range(n_sectors):
-        damage[sector_idx] = cross_section['sn_curve'].miner_sum(stress_cycles[sector_idx]) * DFF
-        
-    return damage # (n_sectors, ) shaped array
+    return cross_section['sn_curve'].miner_sum_batched(stress_cycles) * DFF # miner sums of all cases and sectors at once
 
-def calculate_damage_from_DEM_scale(sectors, cluster, turbine_name, res_base_dir, DLC_file_path, logger, multiprocess_cases = True):
-    """Calculates the damage of the worst section on a turbine by using DEM scaling to the section's nearest member where moment time series are available. 
+def calculate_unweighted_damage_case_i(moment_cycles, DEM_scaling_factor_from_closest_member, cross_section, DFF = 3.0):
+    """A slightly rewritten version of utils.calculate_damage_case_i. Uses the markov matrices (rainflow counting matrices) of the nearest member where time series were available per DLC case.
+    Scales the moment ranges according to the DEM interpolation factor, and uses cross sectional properties to calculate the corresponding damage.
+
+    Args:
+        moment_cycles (np.ndarray): (n_sectors, n_cycles, 2) markov matrix of the closest member for case i, as read from the cycle store of the DLC
+        DEM_scaling_factor_from_closest_member (float): the scaling factor from linearly interpolating DEM of the closest members to the current point
+        cross_section (dict): cross sectional properties as loaded and pre-calculated previously
+        DFF (float, optional): the design fatigue factor, giving safety margins > 1.0. Defaults to 3.0.
+
+    Returns:
+        np.ndarray: linearly accumulated fatigue damage for each sector for the current DLC case i
+    """
+    return calculate_unweighted_damages(moment_cycles, DEM_scaling_factor_from_closest_member, cross_section, DFF) # (n_sectors, ) shaped array
+
+def find_worst_elevation(sectors, cluster, turbine_name, res_base_dir):
+    """Finds the elevation with the highest utilization on a turbine, and how its damage is scaled from the nearest member where moment time series are available
 
     Args:
         sectors (list): list of floats representing points on the turbine cross section, given in angles in the turbine's Global frame as defined in design reports
         cluster (str): cluster name as defined by design load iteration 3
         turbine_name (str): turbine name according to DBA convention
         res_base_dir (str): r-string path to location of results
-        DLC_file_path (str): r-string path to location of the definition of different DLC cases
-        logger (logger): logger
-        multiprocess_cases (bool, optional): selector for multiprocessing cases or not. Defaults to True.
 
     Returns:
-        pandas.DataFrame: the overall fatigue table used in the final RULe method for updating 10-min damage according to observed weather
+        dict: cross_section with pre-calculated A, I, Z, alpha etc, member_closest, DEM_scaling_factor and DFF of the worst elevation
     """
-    # we must backtrack the final DEM calculations to 10-min scenarios for each DLC, unweighted
-
-    logger.info(f'Calculating DEM-scaled damage for {cluster} turbine {turbine_name}')
-    n_cpus_in_mp = int(os.cpu_count()) # Adjustable to be <= than ncpus if needed
-    if multiprocess_cases:
-        logger.info(f'Multiprocessing with {n_cpus_in_mp} out of {os.cpu_count()} cores')
-    
     # Create geometries with pre-calculated A, I, Z, alpha etc
-    geometries_of_interest_df = pd.read_excel(os.path.join(res_base_dir, cluster, turbine_name, 'utils_and_geos_from_structure_report.xlsx'))
+    geometries_of_interest_df = load_dataframe(os.path.join(res_base_dir, cluster, turbine_name, 'utils_and_geos_from_structure_report'))
     geometries_of_interest_cross_sections = create_geo_matrix(geometries_of_interest_df, sectors)
-    util_df = pd.read_excel(os.path.join(res_base_dir, cluster, turbine_name, 'util_rule_vs_report.xlsx'))
+    util_df = load_dataframe(os.path.join(res_base_dir, cluster, turbine_name, 'util_rule_vs_report'))
     
     util_df['rule_utilization'] = util_df['rule_miner_sum_no_DFF'] * util_df['rule_DFF'] * 100.0
     idx_for_worst_elevation = util_df['rule_utilization'].argmax()
-    
-    cross_section_at_worst_elevation = geometries_of_interest_cross_sections[idx_for_worst_elevation] 
     worst_elevation_df = util_df.iloc[ idx_for_worst_elevation ]
-    closest_member_no  = worst_elevation_df['member_closest']
-    DEM_scaling_factor = worst_elevation_df['DEM_scaling_factor']
-            
-    out_dfs = []
+    
+    return dict(cross_section      = geometries_of_interest_cross_sections[idx_for_worst_elevation],
+                member_closest     = worst_elevation_df['member_closest'],
+                DEM_scaling_factor = worst_elevation_df['DEM_scaling_factor'],
+                DFF                = worst_elevation_df['rule_DFF'])
+
+def calculate_damage_from_DEM_scale_cluster_i(sectors, cluster, turbine_names, res_base_dir, DLC_file_path, logger, cycle_index = None, chunk_size = 256):
+    """Calculates the fatigue tables of the worst sections on several turbines of a cluster by using DEM scaling to the sections' nearest members where moment time series are available.
+    The turbines are grouped by their closest member, so that the cycles of each member are read once per DLC for all turbines in the group, in chunks of cases to keep the memory constant,
+    and the damages of all cases in a chunk are calculated in one vectorized pass per turbine
+
+    Args:
+        sectors (list): list of floats representing points on the turbine cross section, given in angles in the turbine's Global frame as defined in design reports
+        cluster (str): cluster name as defined by design load iteration 3
+        turbine_names (list): turbine names according to DBA convention, all in the cluster
+        res_base_dir (str): r-string path to location of results
+        DLC_file_path (str): r-string path to location of the definition of different DLC cases
+        logger (logger): logger
+        cycle_index (dict, optional): lookup table of the cluster's cycle stores, see utils.cycle_store.create_cycle_index. Defaults to None, which creates it from the cluster's markov dir.
+        chunk_size (int, optional): number of cases read from the cycle stores at a time. Defaults to 256.
+
+    Returns:
+        dict: turbine name as key, overall fatigue table (pandas.DataFrame) used in the final RULe method for updating 10-min damage according to observed weather as values
+    """
+    # we must backtrack the final DEM calculations to 10-min scenarios for each DLC, unweighted
+    worst_elevations = {turbine_name: find_worst_elevation(sectors, cluster, turbine_name, res_base_dir) for turbine_name in turbine_names}
+    turbines_per_member = dict()
+    for turbine_name, worst_elevation in worst_elevations.items():
+        turbines_per_member.setdefault(worst_elevation['member_closest'], []).append(turbine_name)
+    logger.info(f'Calculating DEM-scaled damage for {len(turbine_names)} {cluster} turbines, sharing {len(turbines_per_member)} closest members')
+    
+    cycle_index = cycle_index if cycle_index is not None else create_cycle_index(os.path.join(res_base_dir, cluster, 'markov'))
+    out_dfs = {turbine_name: [] for turbine_name in turbine_names}
     DLC_IDs = ['DLC12', 'DLC24a',  'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b']
     for DLC_idx, DLC in enumerate(DLC_IDs):
-        # Calculate unweighted, 10-min damage from the scaled ranges for the worst elevation for every individual DLC
-        DLC_file_df = pd.read_excel(DLC_file_path, sheet_name = DLC)
+        # Calculate unweighted, 10-min damage from the scaled ranges for the worst elevations for every individual DLC
+        DLC_file_df = get_DLC_cases(DLC_file_path, DLC) # parsed once for all turbines
         n_cases = DLC_file_df.shape[0]
         
-        paths_to_markov_cycles_closest_member = get_files_in_dir_matching_identifier_natsorted(cycle_storage_dir = os.path.join(res_base_dir, cluster, 'markov'), id_tup = (f"DB_{cluster}_{DLC}", f"cycles_member{closest_member_no}"))
-        DFF = worst_elevation_df['rule_DFF']
-        
-        args = [(paths_to_markov_cycles_closest_member[case_i], 
-                 DEM_scaling_factor, 
-                 cross_section_at_worst_elevation, 
-                 DFF
-                 ) for case_i in range(n_cases)]
-        
-        damages_per_case_DLC_i = np.zeros( (n_cases, len(sectors)) )
-        
         logger.info(f'[DLC {DLC_idx+1} / {len(DLC_IDs)}] Scaling and calculating for DLC {DLC} with {n_cases} cases')
-        if multiprocess_cases:
-            with Pool(n_cpus_in_mp) as pool:
-                damages_per_case_DLC_i = np.array( pool.starmap(calculate_unweighted_damage_case_i, args) )
-        else:
-            for case_i in range(n_cases):
-                damages_per_case_DLC_i[case_i, :] = calculate_unweighted_damage_case_i(*args[case_i])
-                
-        out_dfs.append(create_fatigue_table_DLC_i(damages_per_case_DLC_i, DLC, DLC_file_df))
+        for closest_member_no, member_turbine_names in turbines_per_member.items():
+            location = locate_cycles(cycle_index, cluster, DLC, closest_member_no)
+            damages_DLC_i = {turbine_name: np.zeros( (n_cases, len(sectors)) ) for turbine_name in member_turbine_names}
+            for cases, markov_cycles_closest_member in iterate_member_cycles(location['store_path'], closest_member_no, chunk_size, location['member_idx']): # (n_cases_in_chunk, n_sectors, n_cycles, 2)
+                for turbine_name in member_turbine_names:
+                    worst_elevation = worst_elevations[turbine_name]
+                    damages_DLC_i[turbine_name][cases] = calculate_unweighted_damages(markov_cycles_closest_member, 
+                                                                                      worst_elevation['DEM_scaling_factor'], 
+                                                                                      worst_elevation['cross_section'], 
+                                                                                      worst_elevation['DFF'])
+            
+            for turbine_name in member_turbine_names:
+                out_dfs[turbine_name].append(create_fatigue_table_DLC_i(damages_DLC_i[turbine_name], DLC, DLC_file_df))
         logger.info(f'[DLC {DLC_idx+1} / {len(DLC_IDs)}] Scaled and calculated DLC {DLC} with {n_cases} cases')
     
-    overall_fatigue_table = pd.concat(out_dfs, axis = 0)
-    overall_fatigue_table.reset_index(inplace = True) # concating different dataframes distorts the index 
-    return overall_fatigue_table 
+    overall_fatigue_tables = dict()
+    for turbine_name in turbine_names:
+        overall_fatigue_table = pd.concat(out_dfs[turbine_name], axis = 0)
+        overall_fatigue_table.reset_index(inplace = True) # concating different dataframes distorts the index 
+        overall_fatigue_tables[turbine_name] = overall_fatigue_table
+    return overall_fatigue_tables
+
+def calculate_damage_from_DEM_scale(sectors, cluster, turbine_name, res_base_dir, DLC_file_path, logger, cycle_index = None):
+    """Calculates the damage of the worst section on a turbine by using DEM scaling to the section's nearest member where moment time series are available. 
+    See calculate_damage_from_DEM_scale_cluster_i for calculating several turbines of a cluster at once
+
+    Args:
+        sectors (list): list of floats representing points on the turbine cross section, given in angles in the turbine's Global frame as defined in design reports
+        cluster (str): cluster name as defined by design load iteration 3
+        turbine_name (str): turbine name according to DBA convention
+        res_base_dir (str): r-string path to location of results
+        DLC_file_path (str): r-string path to location of the definition of different DLC cases
+        logger (logger): logger
+        cycle_index (dict, optional): lookup table of the cluster's cycle stores, see utils.cycle_store.create_cycle_index. Defaults to None, which creates it from the cluster's markov dir.
+
+    Returns:
+        pandas.DataFrame: the overall fatigue table used in the final RULe method for updating 10-min damage according to observed weather
+    """
+    return calculate_damage_from_DEM_scale_cluster_i(sectors, cluster, [turbine_name], res_base_dir, DLC_file_path, logger, cycle_index)[turbine_name]
 
 if __name__ == '__main__':
     
@@ -130,26 +164,32 @@ if __name__ == '__main__':
     logger.info('Initiating damage calculation and fatigue lookup table creation + storage')
     sectors  = [float(i) for i in range(0, 359, 15)]
     res_base_dir = os.path.join(os.getcwd(), "output", "all_turbines")
-    paths_to_worst_elevation_comparisons = [os.path.join(path, name) for path, subdirs, files in os.walk(res_base_dir) for name in files if 'worst_elevation_comparison' in name]
+    paths_to_worst_elevation_comparisons = list_dataframes(res_base_dir, 'util_worst_elevation_comparison')
     
     # Final input to calculations
     turbine_names = [return_turbine_name_from_path(path) for path in paths_to_worst_elevation_comparisons]
     clusters = [return_cluster_name_from_path(path) for path in paths_to_worst_elevation_comparisons]
     DLC_file_path = os.path.join(os.getcwd(), "data", "Doc-0081164-HAL-X-13MW-DGB-A-OWF-Detailed DLC List-Fatigue Support Structure Load Assessment_Rev7.0.xlsx")
+    cycle_indices = {cluster: create_cycle_index(os.path.join(res_base_dir, cluster, 'markov')) for cluster in set(clusters)} # cycle store lookups shared by all turbines of a cluster
+    
+    turbine_names_per_cluster = dict()
+    for cluster, turbine_name in zip(clusters, turbine_names):
+        turbine_names_per_cluster.setdefault(cluster, []).append(turbine_name)
     
-    for turbine_i, (cluster, turbine_name) in enumerate(zip(clusters, turbine_names)):
-        logger.info(f'[Turbine {turbine_i+1} / {len(turbine_names)} - {cluster} {turbine_name}] Calculating fatigue table')
-        overall_fatigue_table = calculate_damage_from_DEM_scale(sectors            = sectors, 
-                                                                cluster            = cluster, 
-                                                                turbine_name       = turbine_name, 
-                                                                res_base_dir       = res_base_dir,
-                                                                DLC_file_path      = DLC_file_path, 
-                                                                logger             = logger, 
-                                                                multiprocess_cases = True)
+    for cluster_i, (cluster, cluster_turbine_names) in enumerate(turbine_names_per_cluster.items()):
+        logger.info(f'[Cluster {cluster_i+1} / {len(turbine_names_per_cluster)} - {cluster}] Calculating fatigue tables of {len(cluster_turbine_names)} turbines')
+        overall_fatigue_tables = calculate_damage_from_DEM_scale_cluster_i(sectors       = sectors, 
+                                                                           cluster       = cluster, 
+                                                                           turbine_names = cluster_turbine_names, 
+                                                                           res_base_dir  = res_base_dir,
+                                                                           DLC_file_path = DLC_file_path, 
+                                                                           logger        = logger, 
+                                                                           cycle_index   = cycle_indices[cluster])
         
-        overall_fatigue_table_path = os.path.join(res_base_dir, cluster, turbine_name, 'lookup_table.xlsx')
-        overall_fatigue_table.to_excel(overall_fatigue_table_path, index = False)
-        overall_fatigue_table.to_json(overall_fatigue_table_path.replace('.xlsx', '.json'), double_precision = 15, force_ascii = True, indent = 4)
-        logger.info(f'[Turbine {turbine_i+1} / {len(turbine_names)} - {cluster} {turbine_name}] Stored fatigue lookup table xlsx and json')
+        for turbine_name, overall_fatigue_table in overall_fatigue_tables.items():
+            overall_fatigue_table_path = os.path.join(res_base_dir, cluster, turbine_name, 'lookup_table.xlsx')
+            _ = store_dataframe(overall_fatigue_table, overall_fatigue_table_path, export_excel = True) # final table, always exported
+            overall_fatigue_table.to_json(overall_fatigue_table_path.replace('.xlsx', '.json'), double_precision = 15, force_ascii = True, indent = 4)
+            logger.info(f'[{cluster} {turbine_name}] Stored fatigue lookup table xlsx and json')
     
     logger.info(f'Stored overall lookuptables for all {len(turbine_names)} turbine_names, in their respective folders')
\ No newline at end of file
@@ -3,6 +3,7 @@ import os
 import pandas as pd 
 import sys
 from utils.DB_turbine_name_funcs import sort_paths_according_to_turbine_names
+from utils.IO_handler import load_dataframe, list_dataframes
 
 '''
 Script used for inspecting the various lifetimes and utilizations across all turbines
@@ -10,12 +11,12 @@ Script used for inspecting the various lifetimes and utilizations across all tur
 
 def get_top_five_utilizations(result_output_dir, member_geo_path):
     
-    info_from_reports_paths = [os.path.join(path, name) for path, subdirs, files in os.walk(result_output_dir) for name in files if 'geos_from_structure_report' in name]
+    info_from_reports_paths = list_dataframes(result_output_dir, 'utils_and_geos_from_structure_report')
     pd.options.display.max_rows = 500 # Print more rows
     
     res_dict = {'JLN': pd.DataFrame(), 'JLO': pd.DataFrame(), 'JLP': pd.DataFrame()}
     for path in info_from_reports_paths:
-        df = pd.read_excel(path)
+        df = load_dataframe(path)
         df = df[ df['Dd_tot'] != '-']
         df['Dd_tot'] = pd.to_numeric( df['Dd_tot'] )
         df = df.sort_values('Dd_tot', ascending=False)
@@ -68,7 +69,7 @@ if __name__ == '__main__':
 
     member_geo_path     = os.path.join(os.getcwd(), "data", "{}_member_geos.xlsx") # format for cluster
     result_output_dir   = os.path.join(os.getcwd(), "output", "all_turbines")
-    info_from_reports_paths = sort_paths_according_to_turbine_names([os.path.join(path, name) for path, subdirs, files in os.walk(result_output_dir) for name in files if 'geos_from_structure_report' in name])
+    info_from_reports_paths = sort_paths_according_to_turbine_names(list_dataframes(result_output_dir, 'utils_and_geos_from_structure_report'))
     pd.options.display.max_rows = 500 # Print more rows
     
     inspect_dtot = True
@@ -78,7 +79,7 @@ if __name__ == '__main__':
         
         res_dict = {'JLN': pd.DataFrame(), 'JLO': pd.DataFrame(), 'JLP': pd.DataFrame()}
         for path in info_from_reports_paths:
-            df = pd.read_excel(path)
+            df = load_dataframe(path)
             df = df[ df['Dd_tot'] != '-']
             df['Dd_tot'] = pd.to_numeric( df['Dd_tot'] )
             df = df.sort_values('Dd_tot', ascending=False)
@@ -120,7 +121,7 @@ if __name__ == '__main__':
         
         res_dict = {'JLN': pd.DataFrame(), 'JLO': pd.DataFrame(), 'JLP': pd.DataFrame()}
         for path in info_from_reports_paths:
-            df = pd.read_excel(path)
+            df = load_dataframe(path)
             df = df[ df['in_place_utilization'] != '-']
             df['in_place_utilization'] = pd.to_numeric( df['in_place_utilization'] )
             df = df.sort_values('in_place_utilization', ascending = False)
@@ -28,6 +28,10 @@ def read_any_filetype(file):
         df = pd.read_excel(file)
     elif file.endswith('.hdf'):
         df = pd.read_hdf(file)           
+    elif file.endswith('.parquet'):
+        df = pd.read_parquet(file)
+    elif file.endswith('.pkl'):
+        df = pd.read_pickle(file)
     elif file.endswith('.sql'):
         df = pd.read_sql(file)
     else:
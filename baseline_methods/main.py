@@ -1,13 +1,16 @@
 from utils.extract_and_preprocess_data import extract_and_preprocess_data
 from utils.setup_custom_logger import setup_custom_logger
 from utils.IO_handler import store_table
-from utils.create_geo_matrix import create_geo_matrix
-from utils.rainflow_methods import get_range_and_count_qats
-from utils.calculate_damage_case_i import calculate_damage_case_i
-from utils.calculate_DEM_case_i import calculate_DEM_case_i
+from utils.create_geo_matrix import create_geo_matrix, create_geo_arrays
+from utils.rainflow_methods import get_range_and_count_multi_sector
+from utils.calculate_DEM_and_damage_case_i import calculate_DEM_and_damage_case_i, damage_sums, WOHLER_EXPONENT
+from utils.worker_context import init_worker, get_shared_data
+from utils.cycle_store import cycle_store_path, create_cycle_store_header, create_cycle_store, is_cycle_store_valid, read_cycle_store
+from utils.checkpoint import checkpoint_path, case_signature, settings_signature, read_checkpoint, start_checkpoint, append_to_checkpoint
 import numpy as np
 import pandas as pd
 from multiprocessing import Pool
+import argparse
 import os
 
 '''
@@ -47,53 +50,146 @@ def check_and_retrieve_output_dirs(cluster):
 
     return dirs[0], dirs[-1]
 
-def calc_unweighted_values(args, n_cases, output_table = [], multiprocess = True, calc_func = calculate_DEM_case_i,):
-    """Calculates DEM or damage based on the calc func, without weighting it according to case probabilities
+def calculate_case_task(task):
+    """Calculates DEM and damage of a single case, used as the task of the worker processes. 
+    The geometries and settings of the case's DLC are looked up in the data published to the worker, see utils.worker_context
 
     Args:
-        args (tuple): tuple of arguments to the Pool.starmap
-        n_cases (int): number of cases
-        output_table (list, optional): Defaults to [].
-        multiprocess (bool, optional): Defaults to True.
-        calc_func (func, optional): calculation function of DEM or damage. Defaults to calculate_DEM_case_i.
+        task (tuple): (DLC_idx, case_i, binary file, description file, cache store) of the case
+
+    Returns:
+        tuple: (DLC_idx, case_i, (DEM_sum, damage)) so that the result can be placed in the table of its DLC when the tasks are completed out of order
+    """
+    DLC_idx, case_i, binary_file_i, description_file_i, cache_store = task
+    shared   = get_shared_data()
+    settings = shared['DLCs'][DLC_idx]
+    return DLC_idx, case_i, calculate_DEM_and_damage_case_i(binary_file_i, 
+                                                            description_file_i, 
+                                                            settings['sectors'], 
+                                                            shared['geometries'][settings['cluster']], 
+                                                            settings['rainflow_func'], 
+                                                            settings['DEM_correction_factor'], 
+                                                            settings['store_cycles'], 
+                                                            settings['cycle_storage_path'], 
+                                                            cache_store = cache_store, 
+                                                            case_i = case_i, 
+                                                            calc_DEM = settings['DEM'], 
+                                                            calc_damage = settings['damage'], 
+                                                            n_rainflow_bins = settings['n_rainflow_bins'])
+
+def get_shared_calculation_data(DLC_calculations):
+    """Collects the data that is shared by all cases of the given DLC calculations, to be published once to every worker process
+
+    Args:
+        DLC_calculations (list): dicts describing the DLC calculations, see prepare_DLC_calculations_cluster_i
 
     Returns:
-        np.ndarray: of size n_cases, n_geometries, n_sectors. contains damage or internal DEM sum for each of the combinations
+        dict: geometry arrays per cluster and the settings of each DLC calculation, in the same order as DLC_calculations
     """
+    return dict(geometries = {calc['settings']['cluster']: calc['geo_arrays'] for calc in DLC_calculations}, 
+                DLCs       = [calc['settings'] for calc in DLC_calculations])
+
+def calc_unweighted_values(DLC_calculations, multiprocess = True, n_workers = None, chunksize = None):
+    """Calculates DEM and damage of all cases of all the given DLC calculations, without weighting it according to case probabilities. 
+    All cases of all DLCs (and clusters) are scheduled at once on a single pool of worker processes, and the tables of a DLC are yielded as soon as all its cases are finished.
+    The geometries and settings are published once to each worker when it starts, so a task only carries the case index and file paths.
+    Cases that are already completed according to the checkpoints are not calculated again, and every finished case is appended to the checkpoint of its DLC.
+    The cases are ordered by their cost, largest series first, so that the short series of the small DLCs fill the idle cores at the end
+
+    Args:
+        DLC_calculations (list): dicts describing the DLC calculations, see prepare_DLC_calculations_cluster_i
+        multiprocess (bool, optional): Defaults to True.
+        n_workers (int, optional): number of worker processes. Defaults to None, which uses all available CPUs.
+        chunksize (int, optional): number of cases sent to a worker at a time. Defaults to None, which gives about 4 chunks per worker.
+
+    Yields:
+        dict, np.ndarray: the DLC calculation and its table of size n_cases, 2, n_geometries, n_sectors. contains internal DEM sum (index 0 along axis 1) and damage (index 1 along axis 1) for each of the combinations
+    """
+    tables    = [np.zeros((calc['n_cases'], 2, calc['n_geometries'], calc['n_sectors'])) for calc in DLC_calculations] # pre-allocate output matrices of all DLCs
+    remaining = [calc['n_cases'] for calc in DLC_calculations]
+    
+    for DLC_idx, calc in enumerate(DLC_calculations):
+        for case_i, (_, DEM_sum, damage) in calc.get('completed', dict()).items(): # results of earlier, interrupted runs
+            tables[DLC_idx][case_i] = (DEM_sum, damage)
+            remaining[DLC_idx] -= 1
     
+    tasks = [(DLC_idx, case_i, calc['results_files'][case_i], calc['descr_files'][case_i], calc['cache_stores'][case_i]) for DLC_idx, calc in enumerate(DLC_calculations) for case_i in range(calc['n_cases']) if case_i not in calc.get('completed', dict())]
+    tasks.sort(key = lambda task: DLC_calculations[task[0]]['n_timesteps'] * DLC_calculations[task[0]]['n_geometries'], reverse = True) # cost of a case scales with the series length and number of geometries
+    
+    def collect(results):
+        for DLC_idx, case_i, result in results:
+            tables[DLC_idx][case_i] = result
+            remaining[DLC_idx] -= 1
+            if 'checkpoint_path' in DLC_calculations[DLC_idx]:
+                _ = append_to_checkpoint(DLC_calculations[DLC_idx]['checkpoint_path'], case_i, DLC_calculations[DLC_idx]['case_signatures'][case_i], *result)
+            if remaining[DLC_idx] == 0:
+                yield DLC_calculations[DLC_idx], tables[DLC_idx]
+                tables[DLC_idx] = None # release the memory of stored DLCs
+    
+    # DLCs that were completed in earlier runs are yielded right away
+    for DLC_idx in range(len(DLC_calculations)):
+        if remaining[DLC_idx] == 0 and tables[DLC_idx] is not None:
+            yield DLC_calculations[DLC_idx], tables[DLC_idx]
+            tables[DLC_idx] = None
+    
+    if len(tasks) == 0:
+        return
+    
+    shared = get_shared_calculation_data(DLC_calculations)
     if multiprocess:
-        with Pool() as p: # loop all cases multiprocessed across available CPUs 
-            outputs = p.starmap(calc_func, args) # returns a list of damages/DEM of len = n_cases 
-        output_table = np.array(outputs)
+        n_workers = n_workers if n_workers is not None else os.cpu_count()
+        chunksize = chunksize if chunksize is not None else max(1, len(tasks) // (4 * n_workers))
+        with Pool(n_workers, initializer = init_worker, initargs = (shared,)) as p: # one pool for all cases, multiprocessed across the worker processes
+            yield from collect(p.imap_unordered(calculate_case_task, tasks, chunksize = chunksize))
         
     else:
-        assert len(output_table) > 0, 'output table must be pre-initialiazed when running single CPU code'
-        for case_i in range(n_cases):
-            output_table[[case_i], :, :] = calc_func(*args[case_i])
-    
-    return output_table # (n_cases, n_geos, n_sectors)
+        _ = init_worker(shared)
+        yield from collect(map(calculate_case_task, tasks))
 
-def calculate_all_DEM_sums(clusters = ['JLN', 'JLO', 'JLP'], multiprocess = True):
-    """Calculate the internal DEM sums, to be used in the overall DEM formula when all DEMs for all DLCs has been concatenated
+def calculate_all_DEM_sums_and_damages(clusters = ['JLN', 'JLO', 'JLP'], multiprocess = True, DEM = True, damage = True, n_workers = None, resume = False, wohler_exponents = None):
+    """Calculates the internal DEM sums and the damages per 10 min of all clusters in a single pass over the simulation results.
+    The cases of all clusters and DLCs are scheduled together on one pool of worker processes.
     The results are stored, not returned.
 
     Args:
         clusters (list, optional): list of str with cluster names. Defaults to ['JLN', 'JLO', 'JLP'].
         multiprocess (bool, optional): Defaults to True.
+        DEM (bool, optional): switch to calculate and store the internal DEM sums. Defaults to True.
+        damage (bool, optional): switch to calculate and store the 10 min damages. Defaults to True.
+        n_workers (int, optional): number of worker processes. Defaults to None, which uses all available CPUs.
+        resume (bool, optional): switch to continue an interrupted run from its checkpoints, skipping the completed cases. Defaults to False.
+        wohler_exponents (list, optional): other wohler exponents to also store internal DEM sums of, see weight_and_store_DEM_sums_other_exponents. Defaults to None.
 
     Returns:
         None: None
     """
-    logger = setup_custom_logger('DEM')
-    logger.info(f'Initiating Dogger Bank DEM sum calculations for clusters {clusters}')
+    info_str = ' and '.join(info for info, calc in zip(['DEM sum', 'damage'], [DEM, damage]) if calc)
+    logger = setup_custom_logger('DEM' if DEM else 'damage')
+    logger.info(f'Initiating Dogger Bank {info_str} calculations for clusters {clusters}')
     
+    DLC_calculations = []
     for cluster in clusters:
-        logger.info(f'Processing cluster {cluster}')
-        _ = main_calculation_of_DEM_or_damage_cluster_i(cluster = cluster, logger = logger, multiprocess = multiprocess, DEM = True)
+        logger.info(f'Preparing cluster {cluster}')
+        DLC_calculations += prepare_DLC_calculations_cluster_i(cluster = cluster, logger = logger, multiprocess = multiprocess, DEM = DEM, damage = damage, wohler_exponents = wohler_exponents)
+    
+    _ = run_DLC_calculations(DLC_calculations, logger, multiprocess = multiprocess, n_workers = n_workers, resume = resume)
         
-    logger.info(f'Finished Dogger Bank DEM sum calculations for clusters {clusters}')
+    logger.info(f'Finished Dogger Bank {info_str} calculations for clusters {clusters}')
     return None
 
+def calculate_all_DEM_sums(clusters = ['JLN', 'JLO', 'JLP'], multiprocess = True):
+    """Calculate the internal DEM sums, to be used in the overall DEM formula when all DEMs for all DLCs has been concatenated
+    The results are stored, not returned.
+
+    Args:
+        clusters (list, optional): list of str with cluster names. Defaults to ['JLN', 'JLO', 'JLP'].
+        multiprocess (bool, optional): Defaults to True.
+
+    Returns:
+        None: None
+    """
+    return calculate_all_DEM_sums_and_damages(clusters = clusters, multiprocess = multiprocess, DEM = True, damage = False)
+
 def calculate_10_min_damages(clusters = ['JLN', 'JLO', 'JLP'], multiprocess = True):
     """Calculates damages per 10 min instead of DEM.
     NOTE that this only works for elevations exactly where we have moment time series results!
@@ -107,35 +203,30 @@ def calculate_10_min_damages(clusters = ['JLN', 'JLO', 'JLP'], multiprocess = Tr
     Returns:
         None: None
     """
-    logger = setup_custom_logger('damage')
-    logger.info(f'Initiating Dogger Bank damage calculations for clusters {clusters}')
-    
-    for cluster in clusters:
-        logger.info(f'Processing cluster {cluster}')
-        _ = main_calculation_of_DEM_or_damage_cluster_i(cluster = cluster, logger = logger, multiprocess = multiprocess, DEM = False, TEN_MIN_TO_HR = 1.0)
-    
-    logger.info(f'Finished Dogger Bank damage calculations for clusters {clusters}')
-    return None
+    return calculate_all_DEM_sums_and_damages(clusters = clusters, multiprocess = multiprocess, DEM = False, damage = True)
 
-def main_calculation_of_DEM_or_damage_cluster_i(cluster, logger, multiprocess = True, DEM = True, TEN_MIN_TO_HR = 6.0):
-    """The main script of calculating all internal DEM sums or 10 min damage of the member elevations
+def prepare_DLC_calculations_cluster_i(cluster, logger, multiprocess = True, DEM = True, damage = True, wohler_exponents = None):
+    """Collects the geometries, DLC cases and output paths of a cluster, and creates the arguments of the calculation of every case
 
     Args:
         cluster (str): cluster name
         logger (logger): logger
-        multiprocess (bool, optional): Defaults to True.
-        DEM (bool, optional): True if DEM, False if damage. Defaults to True.
-        TEN_MIN_TO_HR (float, optional): convertion from 10-min values to hourly values. Defaults to 6.0.
+        multiprocess (bool, optional): only used for logging. Defaults to True.
+        DEM (bool, optional): switch to calculate and store internal DEM sums and moment cycles. Defaults to True.
+        damage (bool, optional): switch to calculate and store damage. Defaults to True.
+        wohler_exponents (list, optional): other wohler exponents than WOHLER_EXPONENT to also store internal DEM sums of, calculated from the moment cycles. Only used with DEM. Defaults to None.
 
     Returns:
-        None: None
+        list: one dict per DLC with the files of all its cases, the settings shared by the cases, the case probabilities and what is needed to store the results
     """
     
-    store_cycles   = True # store rainflow cycles in DEM calculations
-    info_str       = "DEM" if DEM else "damage"
-    calc_func      = calculate_DEM_case_i if DEM else calculate_damage_case_i
+    store_cycles   = DEM # store rainflow cycles in DEM calculations
+    other_wohler_exponents = [float(m) for m in (wohler_exponents or []) if float(m) != WOHLER_EXPONENT] if DEM else [] # calculated from the stored cycles
+    info_strs      = [info_str for info_str, calc in zip(["DEM", "damage"], [DEM, damage]) if calc]
+    info_str       = " and ".join(info_strs)
     sectors        = [float(i) for i in range(0,359,15)] # evenly distributed angles in the turbine frame
     DLC_IDs        = ['DLC12', 'DLC24a',  'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b']
+    N_RFC_BINS     = 128 # number of bins in the rainflow counting of each sector
     DEM_CORRECTION = 1.01 # 1 percent increase in all moment cycles due to lifetime of tower without, not accounted for in the moment time series from GE which was calculated over ~25 years of production
     
     # Get relevant data_paths for DLC and simulation result files  
@@ -143,64 +234,245 @@ def main_calculation_of_DEM_or_damage_cluster_i(cluster, logger, multiprocess =
     DLC_file_path          = os.path.join(data_path, f'Doc-0081164-HAL-X-13MW-DGB-A-OWF-Detailed DLC List-Fatigue Support Structure Load Assessment_Rev7.0.xlsx')
     simulation_result_dir  = os.path.join(data_path, f'Doc-0089427-HAL-X-13MW DB-A OWF-ILA3_{cluster}-model_fatigue_timeseries_all_elevations')
     member_geometries_path = os.path.join(data_path, f'{cluster}_member_geos.xlsx')
+    cache_dir              = os.path.join(os.getcwd(), 'output', 'simulation_cache') # converted simulation results, see convert_simulation_results.py. Used if existing and up to date
     
     geometry     = pd.read_excel(member_geometries_path)
     n_geometries = geometry.shape[0]
     geo_matrix   = create_geo_matrix(geometry, sectors) # summary of the geometric properties. Note that when reading from Excel file, MacOS needs the file to be saved in order to run formulas that shall be read as numbers in Python. 
+    geo_arrays   = create_geo_arrays(geo_matrix) # compact version of the geometries used in the case calculations, sent once to each worker process
 
     out_dir, cycles_dir = check_and_retrieve_output_dirs(cluster)
     
     elevations = [f'{geo_matrix[i]["elevation"]} mLAT' for i in range(len(geo_matrix))]
     status_string = f'Processing {"multiprocessed" if multiprocess else "single CPU"} {info_str} calculation\nDLCs {DLC_IDs}\n{n_geometries} elevations: {elevations}'
     logger.info(status_string)
-        
+    
+    DLC_calculations = []
     for DLC in DLC_IDs:
         # Collect relevant DLC data, find the probabilities of occurence of each case and the number of cases
-        df, probs, n_cases, _ = extract_and_preprocess_data(DLC_file_path, DLC, cluster, simulation_result_dir)
-        cycle_storage_path    = os.path.join(cycles_dir, f"DB_{cluster}_{DLC}")
-        create_dir_if_not_existing(cycle_storage_path)
-        cycle_storage_path    = os.path.join(cycle_storage_path, "cycles_member{}")
-        output_file_name      = os.path.join(out_dir, "all_turbines", cluster, f"DB_{cluster}_{DLC}_{info_str}.mat")
-        summary_table_DLC_i   = np.zeros((n_cases, n_geometries, len(sectors))) # pre-allocate output matrix of the current DLC
+        df, probs, n_cases, n_timesteps = extract_and_preprocess_data(DLC_file_path, DLC, cluster, simulation_result_dir, cache_dir)
         
-        logger.info(f'Starting {info_str} calculation on {cluster} {DLC} with {n_cases} cases')
+        logger.info(f'Scheduling {info_str} calculation on {cluster} {DLC} with {n_cases} cases of {n_timesteps} timesteps{" from converted store" if df.cache_stores[0] is not None else ""}')
         
-        arguments = [(df.results_files[i], 
-                      df.descr_files[i], 
-                      sectors,
-                      geo_matrix,
-                      get_range_and_count_qats,
-                      DEM_CORRECTION,
-                      store_cycles,
-                      cycle_storage_path + f'_case{i}.npy'
-                     ) for i in range(n_cases)]
+        settings = dict(cluster               = cluster, 
+                        sectors               = sectors, 
+                        rainflow_func         = get_range_and_count_multi_sector, 
+                        DEM_correction_factor = DEM_CORRECTION, 
+                        store_cycles          = store_cycles, 
+                        cycle_storage_path    = cycle_store_path(cycles_dir, cluster, DLC), # one consolidated store per DLC, written by case slot
+                        n_rainflow_bins       = N_RFC_BINS, 
+                        DEM                   = DEM, 
+                        damage                = damage)
         
-        summary_table_DLC_i = calc_unweighted_values(multiprocess = multiprocess, 
-                                                     calc_func    = calc_func, 
-                                                     output_table = summary_table_DLC_i, 
-                                                     args         = arguments, 
-                                                     n_cases      = n_cases)
-        
-        logger.info(f'Finished calculating {info_str} for {cluster} - initiating probability weighting and file storage')
+        DLC_calculations.append(dict(cluster          = cluster, 
+                                     DLC              = DLC, 
+                                     results_files    = list(df.results_files), 
+                                     descr_files      = list(df.descr_files), 
+                                     cache_stores     = list(df.cache_stores), 
+                                     settings         = settings, 
+                                     geo_arrays       = geo_arrays, 
+                                     probs            = probs, 
+                                     n_cases          = n_cases, 
+                                     n_timesteps      = n_timesteps, 
+                                     n_geometries     = n_geometries, 
+                                     n_sectors        = len(sectors), 
+                                     info_strs        = info_strs, 
+                                     case_signatures  = [case_signature(df.results_files[i], df.cache_stores[i], i) for i in range(n_cases)], 
+                                     wohler_exponents = other_wohler_exponents, 
+                                     output_file_name = os.path.join(out_dir, "all_turbines", cluster, f"DB_{cluster}_{DLC}_{{}}.mat")))
+    
+    return DLC_calculations
+
+def weight_cases(unweighted_table_DLC_i, weights, ten_min_to_hr):
+    """Weights the cases of an unweighted DEM or damage table of a DLC by their probabilities
+
+    Args:
+        unweighted_table_DLC_i (np.ndarray): (n_cases, n_geometries, n_sectors) table
+        weights (np.ndarray): (1, n_cases) case probabilities
+        ten_min_to_hr (float): convertion from 10-min values to hourly values
+
+    Returns:
+        np.ndarray: (n_geometries, n_sectors) weighted table
+    """
+    n_geometries, n_sectors = unweighted_table_DLC_i.shape[1:]
+    weighted_table_DLC_i = np.zeros((n_geometries, n_sectors))
+    for sector_idx in range(n_sectors):
+        # convert to hour-based values according to "TEN_MIN_TO_HR". Might be == 1 if using 10-min based values
+        weighted_table_DLC_i[:, [sector_idx]] = np.dot(weights, unweighted_table_DLC_i[:,:, sector_idx]).T * ten_min_to_hr  # (n_geometries, 1) -> multiplication of weights by dot product
+    return weighted_table_DLC_i
+
+def weight_and_store_DLC_i(DLC_calculation, summary_table_DLC_i, logger, TEN_MIN_TO_HR = {'DEM': 6.0, 'damage': 1.0}):
+    """Weights the unweighted DEM and damage tables of a DLC by the case probabilities and stores them as separate DEM and damage tables
+
+    Args:
+        DLC_calculation (dict): the DLC calculation, see prepare_DLC_calculations_cluster_i
+        summary_table_DLC_i (np.ndarray): unweighted (n_cases, 2, n_geometries, n_sectors) table of internal DEM sums and damage
+        logger (logger): logger
+        TEN_MIN_TO_HR (dict, optional): convertion from 10-min values to hourly values of DEM and damage. Defaults to {'DEM': 6.0, 'damage': 1.0}.
+
+    Returns:
+        None: None
+    """
+    cluster, DLC = DLC_calculation['cluster'], DLC_calculation['DLC']
+    n_geometries, n_sectors = summary_table_DLC_i.shape[2:]
+    logger.info(f'Finished calculating {" and ".join(DLC_calculation["info_strs"])} for {cluster} {DLC} - initiating probability weighting and file storage')
+    
+    weights = np.array([DLC_calculation['probs']])
+    for table_idx, info_str_i in enumerate(["DEM", "damage"]):
+        if info_str_i not in DLC_calculation['info_strs']:
+            continue
         
         # Transform output to a combined damage / DEM matrix of size (n_geo, n_sectors), weighting cases by their probabilities,
-        weighted_table_DLC_i = np.zeros((n_geometries, len(sectors)))
-        weights = np.array([probs])
-        for sector_idx in range(len(sectors)):
-            # convert to hour-based values according to "TEN_MIN_TO_HR". Might be == 1 if using 10-min based values
-            weighted_table_DLC_i[:, [sector_idx]] = np.dot(weights, summary_table_DLC_i[:,:, sector_idx]).T * TEN_MIN_TO_HR  # (n_geometries, 1) -> multiplication of weights by dot product
+        unweighted_table_DLC_i = summary_table_DLC_i[:, table_idx]
+        weighted_table_DLC_i   = weight_cases(unweighted_table_DLC_i, weights, TEN_MIN_TO_HR[info_str_i])
         
-        store_table(summary_table_DLC_i, 
+        store_table(np.ascontiguousarray(unweighted_table_DLC_i), 
                     weighted_table_DLC_i, 
                     weights, 
-                    output_file_name, 
-                    identifier = info_str)
+                    DLC_calculation['output_file_name'].format(info_str_i), 
+                    identifier = info_str_i)
+        
+        logger.info(f'Stored {info_str_i} table for {cluster} {DLC} \n')
+    
+    return None
+
+def weight_and_store_DEM_sums_other_exponents(DLC_calculation, logger, TEN_MIN_TO_HR = {'DEM': 6.0, 'damage': 1.0}, chunk_size = 256):
+    """Calculates the internal DEM sums of a finished DLC for the other wohler exponents of the calculation from its cycle store, so that the cases are not rainflow counted again.
+    The sums of all exponents are calculated in one pass over the cycle store, in chunks of cases, and weighted and stored as DEM tables named by the exponent, e.g. DB_JLN_DLC12_DEM_m3.mat
+
+    Args:
+        DLC_calculation (dict): the DLC calculation, see prepare_DLC_calculations_cluster_i
+        logger (logger): logger
+        TEN_MIN_TO_HR (dict, optional): convertion from 10-min values to hourly values of DEM and damage. Defaults to {'DEM': 6.0, 'damage': 1.0}.
+        chunk_size (int, optional): number of cases read from the cycle store at a time. Defaults to 256.
+
+    Returns:
+        None: None
+    """
+    wohler_exponents = DLC_calculation.get('wohler_exponents', [])
+    if len(wohler_exponents) == 0:
+        return None
+    
+    store, _ = read_cycle_store(DLC_calculation['settings']['cycle_storage_path']) # (n_cases, n_geometries, n_sectors, n_rainflow_bins, 2), the members are the geometries of the DLC calculation
+    unweighted_tables = np.zeros((len(wohler_exponents),) + store.shape[:3])
+    for case_start in range(0, store.shape[0], chunk_size):
+        cases = slice(case_start, min(case_start + chunk_size, store.shape[0]))
+        moment_cycles = np.array(store[cases])
+        # internal DEM sums, count * (moment_range)**m summed over the bins, for all wohler exponents at once
+        unweighted_tables[:, cases] = np.moveaxis(damage_sums(moment_cycles[..., 1], moment_cycles[..., 0], wohler_exponents), -1, 0)
+    del store
+    
+    weights = np.array([DLC_calculation['probs']])
+    for m, unweighted_table_DLC_i in zip(wohler_exponents, unweighted_tables):
+        info_str_i = f'DEM_m{m:g}'
+        store_table(np.ascontiguousarray(unweighted_table_DLC_i), 
+                    weight_cases(unweighted_table_DLC_i, weights, TEN_MIN_TO_HR['DEM']), 
+                    weights, 
+                    DLC_calculation['output_file_name'].format(info_str_i), 
+                    identifier = 'DEM')
+        logger.info(f'Stored {info_str_i} table for {DLC_calculation["cluster"]} {DLC_calculation["DLC"]}')
+    
+    return None
+
+def prepare_checkpoints(DLC_calculations, logger, resume = False):
+    """Starts the checkpoints and cycle stores of the given DLC calculations, and reports what is left to calculate.
+    When resuming, the cases completed in earlier runs with the same geometries, settings and input files are kept and added to the DLC calculations as 'completed'. 
+    Otherwise the checkpoints and cycle stores are started from scratch
+
+    Args:
+        DLC_calculations (list): dicts describing the DLC calculations, see prepare_DLC_calculations_cluster_i
+        logger (logger): logger
+        resume (bool, optional): switch to continue from the checkpoints of earlier runs. Defaults to False.
+
+    Returns:
+        int: number of cases left to calculate
+    """
+    checkpoint_dir = os.path.join(os.getcwd(), 'output', 'checkpoints')
+    
+    n_left = 0
+    for calc in DLC_calculations:
+        signature = settings_signature(calc['settings'], calc['geo_arrays'])
+        calc['checkpoint_path'] = checkpoint_path(checkpoint_dir, calc['cluster'], calc['DLC'], calc['info_strs'])
+        
+        completed = dict()
+        if resume:
+            shape = (calc['n_geometries'], calc['n_sectors'])
+            completed = {case_i: result for case_i, result in read_checkpoint(calc['checkpoint_path'], signature).items() 
+                         if case_i < calc['n_cases'] and result[0] == calc['case_signatures'][case_i] and result[1].shape == shape and result[2].shape == shape}
         
-        logger.info(f'Stored {info_str} table for {cluster} {DLC} \n')
+        if calc['settings']['store_cycles']:
+            settings = calc['settings']
+            header   = create_cycle_store_header(calc['cluster'], calc['DLC'], calc['n_cases'], calc['geo_arrays']['member_id'], settings['sectors'], settings['n_rainflow_bins'])
+            if not (resume and is_cycle_store_valid(settings['cycle_storage_path'], header)):
+                completed = dict() # the moment cycles of the completed cases are missing
+                _ = create_cycle_store(settings['cycle_storage_path'], header)
         
+        if resume:
+            logger.info(f'{calc["cluster"]} {calc["DLC"]}: {len(completed)} of {calc["n_cases"]} cases completed, {calc["n_cases"] - len(completed)} left')
+        
+        calc['completed'] = completed
+        _ = start_checkpoint(calc['checkpoint_path'], signature, completed) # drops outdated and partly written records
+        n_left += calc['n_cases'] - len(completed)
+    
+    if resume:
+        logger.info(f'Resuming with {n_left} of {sum(calc["n_cases"] for calc in DLC_calculations)} cases left to calculate')
+    
+    return n_left
+
+def run_DLC_calculations(DLC_calculations, logger, multiprocess = True, n_workers = None, TEN_MIN_TO_HR = {'DEM': 6.0, 'damage': 1.0}, resume = False):
+    """Calculates all cases of the given DLC calculations on one scheduler, and weights and stores the tables of each DLC as soon as it is finished.
+    Every finished case is checkpointed, so that an interrupted run can be resumed without calculating the completed cases again
+
+    Args:
+        DLC_calculations (list): dicts describing the DLC calculations, see prepare_DLC_calculations_cluster_i
+        logger (logger): logger
+        multiprocess (bool, optional): Defaults to True.
+        n_workers (int, optional): number of worker processes. Defaults to None, which uses all available CPUs.
+        TEN_MIN_TO_HR (dict, optional): convertion from 10-min values to hourly values of DEM and damage. Defaults to {'DEM': 6.0, 'damage': 1.0}.
+        resume (bool, optional): switch to continue from the checkpoints of earlier runs. Defaults to False.
+
+    Returns:
+        None: None
+    """
+    n_cases = prepare_checkpoints(DLC_calculations, logger, resume = resume)
+    logger.info(f'Calculating {n_cases} cases of {len(DLC_calculations)} DLCs {"on " + str(n_workers if n_workers is not None else os.cpu_count()) + " worker processes" if multiprocess else "on a single CPU"}')
+    
+    for DLC_calculation, summary_table_DLC_i in calc_unweighted_values(DLC_calculations, multiprocess = multiprocess, n_workers = n_workers):
+        _ = weight_and_store_DLC_i(DLC_calculation, summary_table_DLC_i, logger, TEN_MIN_TO_HR = TEN_MIN_TO_HR)
+        _ = weight_and_store_DEM_sums_other_exponents(DLC_calculation, logger, TEN_MIN_TO_HR = TEN_MIN_TO_HR) # from the cycle store, which is complete when the DLC is finished
+    
+    return None
+
+def main_calculation_of_DEM_and_damage_cluster_i(cluster, logger, multiprocess = True, DEM = True, damage = True, TEN_MIN_TO_HR = {'DEM': 6.0, 'damage': 1.0}, n_workers = None, resume = False, wohler_exponents = None):
+    """The main script of calculating all internal DEM sums and 10 min damage of the member elevations of a single cluster. 
+    Each case is read and rainflow counted once for both, and the DEM and damage tables are stored separately
+
+    Args:
+        cluster (str): cluster name
+        logger (logger): logger
+        multiprocess (bool, optional): Defaults to True.
+        DEM (bool, optional): switch to calculate and store internal DEM sums and moment cycles. Defaults to True.
+        damage (bool, optional): switch to calculate and store damage. Defaults to True.
+        TEN_MIN_TO_HR (dict, optional): convertion from 10-min values to hourly values of DEM and damage. Defaults to {'DEM': 6.0, 'damage': 1.0}.
+        n_workers (int, optional): number of worker processes. Defaults to None, which uses all available CPUs.
+        resume (bool, optional): switch to continue an interrupted run from its checkpoints, skipping the completed cases. Defaults to False.
+        wohler_exponents (list, optional): other wohler exponents to also store internal DEM sums of, see weight_and_store_DEM_sums_other_exponents. Defaults to None.
+
+    Returns:
+        None: None
+    """
+    DLC_calculations = prepare_DLC_calculations_cluster_i(cluster, logger, multiprocess = multiprocess, DEM = DEM, damage = damage, wohler_exponents = wohler_exponents)
+    _ = run_DLC_calculations(DLC_calculations, logger, multiprocess = multiprocess, n_workers = n_workers, TEN_MIN_TO_HR = TEN_MIN_TO_HR, resume = resume)
+    
     logger.info(f'Main calculation script finished for cluster {cluster}')
     return None
 
 if __name__ == '__main__':
     
-    _ = calculate_all_DEM_sums(multiprocess = True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = 'In-place DEM and damage calculation of the Dogger Bank wind turbines')
+    parser.add_argument('--clusters', nargs = '+', default = ['JLN', 'JLO', 'JLP'], help = 'cluster names')
+    parser.add_argument('--resume', action = 'store_true', help = 'continue an interrupted run, reporting and calculating only the cases that are left')
+    parser.add_argument('--wohler-exponents', nargs = '+', type = float, default = None, help = f'other wohler exponents than {WOHLER_EXPONENT:g} to also store internal DEM sums of, e.g. 3 4')
+    args = parser.parse_args()
+    
+    _ = calculate_all_DEM_sums_and_damages(clusters = args.clusters, multiprocess = True, resume = args.resume, wohler_exponents = args.wohler_exponents)
\ No newline at end of file
@@ -2,42 +2,67 @@ import os
 from utils.setup_custom_logger import setup_custom_logger
 import pandas as pd 
 import numpy as np
-from multiprocessing import Pool
-from utils.fastnumpyio import load as fastio_load 
 from utils.fastnumpyio import save as fastio_save
-from natsort import natsorted
+from utils.DLC_catalog import get_DLC_probabilities
+from utils.cycle_store import create_cycle_index, locate_cycles, read_member_cycles, iterate_member_cycles
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from timeit import default_timer as timer
 import sys
 
-def get_files_in_dir_matching_identifier_natsorted(cycle_storage_dir: str, id_tup: tuple):
-    # Files are found as strings, so Python sorts them lexicographical where ['10', '1', '2'].sort() = ['1', '10', '2' ]
-    # natsort sorts like expected: ['1', '2', '10']     
-    DLC_id, cycle_id = id_tup
-    candidate_paths = [os.path.join(path, name) for path, subdirs, files in os.walk(cycle_storage_dir) for name in files]
-    return natsorted([p for p in candidate_paths if ( (DLC_id in p) and (cycle_id in p) )])
-    
-    # return natsorted([(cycle_storage_dir + '\\' + file_name) for file_name in os.listdir(cycle_storage_dir) if (id_tup in file_name)])
+def read_DLC_probabilities(DLC_IDs = ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b']):
+    """Reads the probabilities of occurence of the cases of each DLC from the DLC catalog, see utils.DLC_catalog
+
+    Args:
+        DLC_IDs (list, optional): DLC IDs as a list of strings. Defaults to ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'].
+
+    Returns:
+        dict: DLC ID as key, (n_cases,) array of case probabilities [hr / year] as values
+    """
+    DLC_file = os.path.join(os.getcwd(), "data", "Doc-0081164-HAL-X-13MW-DGB-A-OWF-Detailed DLC List-Fatigue Support Structure Load Assessment_Rev7.0.xlsx" )
+    return get_DLC_probabilities(DLC_file, DLC_IDs)
+
+def prefetch(iterator):
+    """Iterates over an iterator while its next item is read in a background thread, so that reading the next chunk of cycles overlaps with processing the current one
+
+    Args:
+        iterator (iterator): e.g. utils.cycle_store.iterate_member_cycles
+
+    Yields:
+        the items of the iterator
+    """
+    done = object()
+    with ThreadPoolExecutor(max_workers = 1) as reader:
+        next_item = reader.submit(next, iterator, done)
+        while True:
+            item = next_item.result()
+            if item is done:
+                break
+            next_item = reader.submit(next, iterator, done)
+            yield item
 
-def open_npy_cycle_file_and_scale_counts(file, weight):
-    """return the array with scaled counts according to weights and 10min->yr factor
+def count_read(io_stats, cycles):
+    """Adds the number of cycle records (one per case and member, i.e. one of the former cycle files) and bytes of a chunk of cycles to the I/O statistics
 
     Args:
-        file (str): r-string of path to the np.ndarray file with cycles for a given case
-        weight (float): the probability of the case occuring
+        io_stats (dict): 'records' and 'bytes' read so far, or None to skip counting
+        cycles (np.ndarray): (n_cases, n_sectors, n_rainflow_bins, 2) cycles read
 
     Returns:
-        np.ndarray: loaded and scaled cycles
+        None: None
     """
-    
-    # cycles are shaped (n_sectors, n_cycles, 2: (m_range, count) )
-    cycles = np.array(fastio_load(file))
-    cycles[:, :, 1] *= weight * 6.0
-    return cycles
+    if io_stats is not None:
+        io_stats['records'] = io_stats.get('records', 0) + cycles.shape[0]
+        io_stats['bytes']   = io_stats.get('bytes', 0) + cycles.nbytes
+    return None
 
 def get_all_moment_cycles_weighted_by_probs_member_i(cycle_storage_dir: str,
                                     logger, 
                                     member: int = 54,
                                     DLC_IDs: list = ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'], 
-                                    cluster: str = 'JLN'):
+                                    cluster: str = 'JLN', 
+                                    cycle_index: dict = None, 
+                                    probabilities: dict = None, 
+                                    io_stats: dict = None):
     """Concatenates all members' moment cycles into markov matrix = moment ranges and weighted counts according to their probability
     Concatenates across all DLCs. 
 
@@ -47,46 +72,133 @@ def get_all_moment_cycles_weighted_by_probs_member_i(cycle_storage_dir: str,
         member (int, optional): member ID, defined in structural reports. Defaults to 54.
         DLC_IDs (list, optional): DLC IDs as a list of strings. Defaults to ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'].
         cluster (str, optional): cluster name. Defaults to 'JLN'.
+        cycle_index (dict, optional): lookup table of the cycle stores, see utils.cycle_store.create_cycle_index. Defaults to None, which creates it from cycle_storage_dir.
+        probabilities (dict, optional): case probabilities per DLC, see read_DLC_probabilities. Defaults to None, which reads them from the DLC definition sheet.
+        io_stats (dict, optional): 'records' and 'bytes' read, updated in place. Defaults to None.
 
     Returns:
         np.ndarray: of all cycles: for all sectors with each single rainflow counting observed, scaled for the count probability
     """
     # First concatenate all cycles for all cases within each DLC [scaled_markov_DLC_i], then concatenate all cycles for all DLCs [all_ranges] 
-    DLC_file   = os.path.join(os.getcwd(), "data", "Doc-0081164-HAL-X-13MW-DGB-A-OWF-Detailed DLC List-Fatigue Support Structure Load Assessment_Rev7.0.xlsx" )
-    all_cycles = [] # To store all the cycles : [[ranges, counts]] for each sector, for all DLCs
+    all_cycles    = [] # To store all the cycles : [[ranges, counts]] for each sector, for all DLCs
+    cycle_index   = cycle_index if cycle_index is not None else create_cycle_index(cycle_storage_dir)
+    probabilities = probabilities if probabilities is not None else read_DLC_probabilities(DLC_IDs)
     
     for DLC in DLC_IDs:
         
-        DLC_info_df = pd.read_excel(DLC_file, sheet_name = DLC)
-        probabilities = list(DLC_info_df.Tot_Prob_in_10_percent_idling_scenario_hr_year) # Extract directly from excel
+        # Read the member's cycles of all cases from the cycle store prepared by the main script previously, and scale all counts according to prob of occurence of case
+        location = locate_cycles(cycle_index, cluster, DLC, member)
+        cycles_DLC_i = read_member_cycles(location['store_path'], member, location['member_idx']) # (n_cases, n_sectors, n_cycles, 2)
+        count_read(io_stats, cycles_DLC_i)
+        logger.info(f'Starting markov concatenation on {DLC} with {cycles_DLC_i.shape[0]} cases')
+        cycles_DLC_i[:, :, :, 1] *= probabilities[DLC][:, None, None] * 6.0
         
-        # Collect file paths of prepared cycles from main script previously. When opening, scale all counts according to prob of occurence of case
-        file_paths_DLC_i = get_files_in_dir_matching_identifier_natsorted(cycle_storage_dir, id_tup = (f"DB_{cluster}_{DLC}", f"cycles_member{member}"))
-        multiprocess_args = [(file_paths_DLC_i[i], 
-                              probabilities[i]
-                             ) for i in range(len(file_paths_DLC_i))]
-        
-        logger.info(f'Starting markov concatenation on {DLC} with {len(file_paths_DLC_i)} cases')
-        with Pool() as p: 
-            list_of_cycles_all_cases_DLC_i = p.starmap(open_npy_cycle_file_and_scale_counts, multiprocess_args)       
-        
-        # Concatenate results along axis 1 (the cycles) to create a large list with all observed cycles
-        scaled_markov_DLC_i = np.concatenate(list_of_cycles_all_cases_DLC_i, axis = 1) 
+        # Concatenate the cases along axis 1 (the cycles) to create a large list with all observed cycles
+        scaled_markov_DLC_i = np.concatenate(cycles_DLC_i, axis = 1) 
         all_cycles.append(scaled_markov_DLC_i)
         logger.info(f'Finished concatenating {DLC}')
 
     return np.concatenate(all_cycles, axis = 1) # add all ranges together 
 
-def parse_markov_files_cluster_i(cluster, logger, DLC_IDs = ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b']):
+def histogram_bin_count(max_relative_error):
+    """Number of histogram bins needed for the moment ranges of the aggregated markov matrices to be within a given error.
+    A cycle is represented by a range in the same bin, so the error of any moment range is at most one bin width = largest moment range / n_bins
+
+    Args:
+        max_relative_error (float): largest accepted error of the moment ranges, relative to the largest moment range of the sector
+
+    Returns:
+        int: number of bins
+    """
+    return int(np.ceil(1.0 / max_relative_error))
+
+def get_moment_cycle_histogram_weighted_by_probs_member_i(cycle_storage_dir: str,
+                                    logger, 
+                                    member: int = 54,
+                                    DLC_IDs: list = ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'], 
+                                    cluster: str = 'JLN', 
+                                    n_bins: int = 1024, 
+                                    m: float = 5.0, 
+                                    chunk_size: int = 256, 
+                                    cycle_index: dict = None, 
+                                    probabilities: dict = None, 
+                                    io_stats: dict = None):
+    """Aggregates all moment cycles of a member into a markov matrix of fixed size = moment ranges and weighted counts according to their probability. 
+    The cycles are streamed from the cycle stores in chunks of cases and re-binned into n_bins equally wide bins per sector from 0 to the largest moment range of the sector, 
+    so the memory use does not depend on the number of cases. 
+    The range of each bin is the m-th power mean of the ranges in the bin, so that sum(counts * ranges**m), i.e. the internal DEM sum for wohler exponent m, is preserved.
+    All ranges are within one bin width of their true value, see histogram_bin_count
+
+    Args:
+        cycle_storage_dir (str): path to cycle storage pre calculated
+        logger (logger): logger
+        member (int, optional): member ID, defined in structural reports. Defaults to 54.
+        DLC_IDs (list, optional): DLC IDs as a list of strings. Defaults to ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'].
+        cluster (str, optional): cluster name. Defaults to 'JLN'.
+        n_bins (int, optional): number of bins per sector. Defaults to 1024.
+        m (float, optional): wohler exponent preserved by the bin ranges. Defaults to 5.0.
+        chunk_size (int, optional): number of cases read at a time. Defaults to 256.
+        cycle_index (dict, optional): lookup table of the cycle stores, see utils.cycle_store.create_cycle_index. Defaults to None, which creates it from cycle_storage_dir.
+        probabilities (dict, optional): case probabilities per DLC, see read_DLC_probabilities. Defaults to None, which reads them from the DLC definition sheet.
+        io_stats (dict, optional): 'records' and 'bytes' read, updated in place. Both passes are counted. Defaults to None.
+
+    Returns:
+        np.ndarray: (n_sectors, n_bins, 2) markov matrix with [..., 0] = moment ranges and [..., 1] = counts per year
+    """
+    cycle_index   = cycle_index if cycle_index is not None else create_cycle_index(cycle_storage_dir)
+    probabilities = probabilities if probabilities is not None else read_DLC_probabilities(DLC_IDs)
+    locations     = [locate_cycles(cycle_index, cluster, DLC, member) for DLC in DLC_IDs]
+    
+    # First pass: the largest moment range of each sector decides the bin edges
+    max_ranges = None
+    for location in locations:
+        for _, cycles in prefetch(iterate_member_cycles(location['store_path'], member, chunk_size = chunk_size, member_idx = location['member_idx'])):
+            count_read(io_stats, cycles)
+            max_ranges_chunk = cycles[:, :, :, 0].max(axis = (0, 2))
+            max_ranges = max_ranges_chunk if max_ranges is None else np.maximum(max_ranges, max_ranges_chunk)
+    
+    n_sectors  = max_ranges.shape[0]
+    bin_widths = np.where(max_ranges > 0, max_ranges, 1.0) / n_bins
+    counts     = np.zeros(n_sectors * n_bins)
+    moments    = np.zeros(n_sectors * n_bins) # sum(counts * ranges**m) per bin
+    
+    # Second pass: accumulate the weighted counts of all cases, a chunk at a time
+    for DLC, location in zip(DLC_IDs, locations):
+        logger.info(f'Starting markov aggregation on {DLC}')
+        for cases, cycles in prefetch(iterate_member_cycles(location['store_path'], member, chunk_size = chunk_size, member_idx = location['member_idx'])):
+            count_read(io_stats, cycles)
+            ranges = cycles[:, :, :, 0]
+            weighted_counts = cycles[:, :, :, 1] * probabilities[DLC][cases, None, None] * 6.0
+            
+            bin_idx  = np.minimum((ranges / bin_widths[None, :, None]).astype(np.int64), n_bins - 1) # the largest range is placed in the last bin
+            flat_idx = (np.arange(n_sectors)[None, :, None] * n_bins + bin_idx).ravel()
+            counts  += np.bincount(flat_idx, weights = weighted_counts.ravel(), minlength = n_sectors * n_bins)
+            moments += np.bincount(flat_idx, weights = (weighted_counts * ranges**m).ravel(), minlength = n_sectors * n_bins)
+        logger.info(f'Finished aggregating {DLC}')
+    
+    counts  = counts.reshape(n_sectors, n_bins)
+    moments = moments.reshape(n_sectors, n_bins)
+    centers = (np.arange(n_bins)[None, :] + 0.5) * bin_widths[:, None]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ranges = np.where(counts > 0, (moments / counts)**(1.0 / m), centers) # empty bins keep the bin center, they do not contribute with any cycles
+    
+    return np.dstack((ranges, counts))
+
+def parse_markov_files_cluster_i(cluster, logger, DLC_IDs = ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'], n_bins = 1024, n_workers = None):
     """Parses markov file for a single cluster. 
     This will read all markov files for al cluster's members, weight them by their probability, 
-    and concatenate them into a large markov matrix representing all cycles and weighted counts over one year.
+    and aggregate them into a markov matrix representing all cycles and weighted counts over one year.
+    By default the cycles are streamed into a fixed size histogram per sector, see get_moment_cycle_histogram_weighted_by_probs_member_i. 
+    With n_bins = None all cycles are concatenated instead, giving (n_sectors, n_cases * n_rainflow_bins, 2) sized matrices.
+    All members are processed on one pool of threads, since the work is mostly reading from the cycle stores, and the throughput is logged.
     It stores the resulting numpy arrays for later use.
 
     Args:
         cluster (str): cluster name
         logger (logger): logger
         DLC_IDs (list, optional): list of str with DLC names. Defaults to ['DLC12', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b'].
+        n_bins (int, optional): number of histogram bins per sector, see histogram_bin_count. Defaults to 1024. None to concatenate all cycles.
+        n_workers (int, optional): number of threads processing members in parallel. Defaults to None, which uses one per member up to the number of CPUs.
 
     Returns:
         None: None
@@ -94,27 +206,48 @@ def parse_markov_files_cluster_i(cluster, logger, DLC_IDs = ['DLC12', 'DLC24a',
     out_dir = os.path.join(os.getcwd(), "output", "all_turbines") 
     res_path = os.path.join(out_dir, cluster, "total_markov_member{}.npy")
     cycles_dir = os.path.join(out_dir, cluster, "markov")  
+    cycle_index = create_cycle_index(cycles_dir) # where the cycles of every member and DLC are stored, looked up once for all members
+    probabilities = read_DLC_probabilities(DLC_IDs) # read once for all members
     mbr_geos = pd.read_excel( os.path.join(os.getcwd(), "data", f"{cluster}_member_geos.xlsx") ) 
     member_2_elevation_map = {k: v for k, v in zip(mbr_geos[f'member_id'], mbr_geos['elevation'])}
+    members = list(member_2_elevation_map.keys())
+    n_workers = n_workers if n_workers is not None else max(1, min(len(members), os.cpu_count()))
     
-    logger.info(f'Starting markov parsing for {cluster}, {len(member_2_elevation_map)} members @ {list(member_2_elevation_map.values())} mLat')
-    for mbr_idx, member in enumerate( list(member_2_elevation_map.keys()) ):
-        logger.info(f'[{mbr_idx}/{len(member_2_elevation_map)}] Adding and weighting all markov ranges for {cluster} member {member} @ {member_2_elevation_map[member]} mLat')
-        cycles_member_i = get_all_moment_cycles_weighted_by_probs_member_i(cycle_storage_dir = cycles_dir, logger = logger, member = member, DLC_IDs = DLC_IDs, cluster = cluster)
-        
-        logger.info(f'Storing npy array for member {member}\n')
-        fastio_save(res_path.format(member), cycles_member_i)
-        del cycles_member_i # this improves speed signifificantly, not quite sure why, thought it would matter the most for memory, which is not really affected here
-        logger.info(f'Stored concatenated cycles in markov matrix for member {member}\n')
+    def aggregate_member(member):
+        io_stats = dict(records = 0, bytes = 0)
+        if n_bins is None:
+            cycles_member_i = get_all_moment_cycles_weighted_by_probs_member_i(cycle_storage_dir = cycles_dir, logger = logger, member = member, DLC_IDs = DLC_IDs, cluster = cluster, 
+                                                                               cycle_index = cycle_index, probabilities = probabilities, io_stats = io_stats)
+        else:
+            cycles_member_i = get_moment_cycle_histogram_weighted_by_probs_member_i(cycle_storage_dir = cycles_dir, logger = logger, member = member, DLC_IDs = DLC_IDs, cluster = cluster, n_bins = n_bins, 
+                                                                                    cycle_index = cycle_index, probabilities = probabilities, io_stats = io_stats)
+        return cycles_member_i, io_stats
+    
+    logger.info(f'Starting markov parsing for {cluster}, {len(member_2_elevation_map)} members @ {list(member_2_elevation_map.values())} mLat on {n_workers} threads')
+    start = timer()
+    n_records, n_bytes = 0, 0
+    with ThreadPoolExecutor(max_workers = n_workers) as pool: # one pool for all members and DLCs of the cluster
+        futures = {pool.submit(aggregate_member, member): member for member in members}
+        for mbr_idx, future in enumerate(as_completed(futures)):
+            member = futures[future]
+            cycles_member_i, io_stats = future.result()
+            n_records, n_bytes = n_records + io_stats['records'], n_bytes + io_stats['bytes']
+            
+            logger.info(f'[{mbr_idx + 1}/{len(members)}] Storing npy array for {cluster} member {member} @ {member_2_elevation_map[member]} mLat')
+            fastio_save(res_path.format(member), cycles_member_i)
+            del cycles_member_i
+            
+            elapsed = timer() - start
+            logger.info(f'Read {n_records} cycle records ({n_bytes / 1e6:.1f} MB) in {elapsed:.1f} s: {n_records / elapsed:.0f} records/s, {n_bytes / 1e6 / elapsed:.1f} MB/s\n')
     
     logger.info(f'Stored all total markov matrices for each member of cluster {cluster}\n')
     
     return None 
 
-def concatenate_all_DBA_markov_matrices(clusters = ['JLN', 'JLO', 'JLP']):
+def concatenate_all_DBA_markov_matrices(clusters = ['JLN', 'JLO', 'JLP'], n_bins = 1024, n_workers = None):
     logger = setup_custom_logger('markov_parser')
     for cluster in clusters:
-        _ = parse_markov_files_cluster_i(cluster, logger)
+        _ = parse_markov_files_cluster_i(cluster, logger, n_bins = n_bins, n_workers = n_workers)
     return None 
 
 if __name__ == '__main__':
@@ -3,6 +3,7 @@ import os
 from utils.setup_custom_logger import setup_custom_logger
 from lifetime_calculation_from_lookup import calculate_lifetime_from_fatigue_lookup_table
 from multiprocessing import Pool
+from utils.IO_handler import load_dataframe, store_dataframe, list_dataframes, find_dataframe
 import sys
 
 '''
@@ -13,10 +14,10 @@ def update_summary_table_with_worst_elevation(worst_util_summary_path, turbine_n
     
     updated_table_path = worst_util_summary_path.replace(".xlsx", "_subseabed_scaled.xlsx")
     try:
-        df = pd.read_excel(updated_table_path, index_col = None)
-    except:
+        df = load_dataframe(updated_table_path)
+    except FileNotFoundError:
         logger.info(f"First time reading the util summary for adjustment, opening original. From here the updated file will be read")
-        df = pd.read_excel(worst_util_summary_path, index_col = None)
+        df = load_dataframe(worst_util_summary_path)
     
     # Update the values of the turbine 
     df.loc[df["turbine_name"] == turbine_name, "el_rule"] = df_worst_Dd_tot['elevation'].iloc[0]
@@ -24,7 +25,7 @@ def update_summary_table_with_worst_elevation(worst_util_summary_path, turbine_n
     df.loc[df["turbine_name"] == turbine_name, "desc_rule"] = df_worst_Dd_tot['description'].iloc[0]
     df.loc[df["turbine_name"] == turbine_name, "util_rule"] = df_worst_Dd_tot['Dd_tot'].iloc[0]
     
-    df.to_excel(updated_table_path, index = False)
+    _ = store_dataframe(df, updated_table_path, export_excel = True) # final table, always exported
     logger.info(f"[{turbine_name}] Updated summary table for with new subseabed point")
     return None
 
@@ -35,7 +36,7 @@ def load_rescale_and_save_lookup(lookup_path, util_relation, logger, turbine_nam
         logger.info(f'[{turbine_name}] Fatigue table will be upscaled with a factor of {util_relation:.2f}')    
     
         logger.info(f'[{turbine_name}] Loading fatigue table')
-        lookup_table_df = pd.read_excel(lookup_path, index_col=None)
+        lookup_table_df = load_dataframe(lookup_path)
         logger.info(f'[{turbine_name}] Loaded fatigue table')
         
         logger.info(f'[{turbine_name}] Lifetime of worst sector according to original fatigue table: {calculate_lifetime_from_fatigue_lookup_table(lookup_table_df).min():.2f}')
@@ -45,15 +46,15 @@ def load_rescale_and_save_lookup(lookup_path, util_relation, logger, turbine_nam
         lookup_table_df.loc[:, lookup_table_df.columns.str.contains('sector')] *= util_relation # in-place multiplication
         logger.info(f'[{turbine_name}] Lifetime of worst sector according to adjusted fatigue table: {calculate_lifetime_from_fatigue_lookup_table(lookup_table_df).min():.2f}')
         
-        out_path = lookup_path.replace(".", "_subseabed_scaled.")
+        out_path = os.path.splitext(lookup_path)[0] + "_subseabed_scaled.xlsx"
         
         lookup_table_df.to_json(out_path.replace('.xlsx', '.json'), double_precision = 15, force_ascii = True, indent = 4)
-        lookup_table_df.to_excel(out_path, index = False)
+        _ = store_dataframe(lookup_table_df, out_path, export_excel = True) # final table, always exported
         
         return None
 
 def find_utils_subseabed_and_scale_lookup_table(info_path, lookup_path, worst_rule_path, member_geo_path, worst_util_summary_path, logger, rescale = False):
-    df_info = pd.read_excel(info_path)
+    df_info = load_dataframe(info_path)
     turbine_name = df_info['turbine_name'].iloc[0]
     cluster = df_info['cluster'].iloc[0]
     logger.info(f'[{turbine_name}]: Investigating turbine for subseabed scaling options')
@@ -74,7 +75,7 @@ def find_utils_subseabed_and_scale_lookup_table(info_path, lookup_path, worst_ru
     worst_dd_tot_util = df_worst_Dd_tot['Dd_tot'].iloc[0]
    
     # find worst util where RULe has calculated
-    df_rule_worst = pd.read_excel(worst_rule_path)
+    df_rule_worst = load_dataframe(worst_rule_path)
     df_rule_worst_elevation = df_rule_worst['rule_worst_elevation'].iloc[0]
     df_rule_worst_util = df_rule_worst['rule_worst_utilization'].iloc[0]
     
@@ -99,17 +100,18 @@ if __name__ == '__main__':
     
     member_geo_path         = os.path.join(os.getcwd(), "data", "{}_member_geos.xlsx")# format for cluster
     result_output_dir       = os.path.join(os.getcwd(), "output", "all_turbines")
-    info_from_reports_paths = [os.path.join(path, name) for path, subdirs, files in os.walk(result_output_dir) for name in files if 'utils_and_geos_from_structure_report.xlsx' in name]
-    lookup_table_paths      = [os.path.join(path, name) for path, subdirs, files in os.walk(result_output_dir) for name in files if 'lookup_table.xlsx' in name]
-    worst_util_rule_paths   = [os.path.join(path, name) for path, subdirs, files in os.walk(result_output_dir) for name in files if 'util_worst_elevation_comparison.xlsx' in name]
+    info_from_reports_paths = list_dataframes(result_output_dir, 'utils_and_geos_from_structure_report')
+    lookup_table_paths      = list_dataframes(result_output_dir, 'lookup_table')
+    worst_util_rule_paths   = list_dataframes(result_output_dir, 'util_worst_elevation_comparison')
     
     worst_util_summary_path = os.path.join(result_output_dir, "utilization_summary_worst_points_Ddtot_vs_inplace_vs_rule.xlsx")
     logger = setup_custom_logger(f'sub-seabed_scaler')
     rescale = True
     
-    if rescale and os.path.isfile(worst_util_summary_path.replace(".xlsx", "_subseabed_scaled.xlsx")):
+    if rescale and find_dataframe(worst_util_summary_path.replace(".xlsx", "_subseabed_scaled.xlsx")) is not None:
         logger.info(f"Subseabed scaled util summary already found. Removing file before calculating sub seabed scaled summary table again")
-        os.remove( worst_util_summary_path.replace(".xlsx", "_subseabed_scaled.xlsx") )
+        while find_dataframe(worst_util_summary_path.replace(".xlsx", "_subseabed_scaled.xlsx")) is not None: # stored in the binary format and exported to Excel
+            os.remove( find_dataframe(worst_util_summary_path.replace(".xlsx", "_subseabed_scaled.xlsx")) )
             
     # Prepare arguments for the scaling function. Can be run multiprocessed or not 
     args = [(info_path, lookup_path, worst_rule_path, member_geo_path, worst_util_summary_path, setup_custom_logger(f'sub-seabed_scaler_{i}'), rescale) 
@@ -1,4 +1,4 @@
-from utils.IO_handler import load_table
+from utils.IO_handler import load_table, store_dataframe
 import numpy as np
 import pandas as pd 
 from utils.setup_custom_logger import setup_custom_logger
@@ -30,7 +30,8 @@ The calculation is done by extracting stored tables of "internal DEM sums" from
             - N_eq; the number of counts / year the equivalent load is calculated over 
 '''
 
-def calculate_total_DEM_sum_cluster_i(cluster, logger):
+def calculate_total_DEM_sum_cluster_i(cluster, logger, wohler_exponent = None):
+    # wohler_exponent: one of the other exponents stored by main.py --wohler-exponents, None for the DEM sums of the default exponent
     DLC_IDs = ['DLC12', 'DLC24a',  'DLC31', 'DLC41a', 'DLC41b', 'DLC64a', 'DLC64b']
 
     sectors         = [float(i) for i in range(0,359,15)]
@@ -40,8 +41,9 @@ def calculate_total_DEM_sum_cluster_i(cluster, logger):
     geo_matrix      = create_geo_matrix(member_geometry, sectors) # better matrix to pass to the main function
 
     out_path = os.path.join(os.getcwd(), "output", "all_turbines")
-    DEM_sum_paths_placeholder = os.path.join(out_path, cluster, f"DB_{cluster}_" + r'{}_DEM.mat')
-    out_path_xlsx = os.path.join(out_path, cluster, f"{cluster}_combined_DEM.xlsx")
+    DEM_str = 'DEM' if wohler_exponent is None else f'DEM_m{wohler_exponent:g}'
+    DEM_sum_paths_placeholder = os.path.join(out_path, cluster, f"DB_{cluster}_" + r'{}' + f"_{DEM_str}.mat")
+    out_path_xlsx = os.path.join(out_path, cluster, f"{cluster}_combined_{DEM_str}.xlsx")
     
     # Store the worst DEM results in a dict for tabular presentation later on
     logger.info(f'Calculating total DEM from {len(DLC_IDs)} DLCs')
@@ -67,8 +69,8 @@ def calculate_total_DEM_sum_cluster_i(cluster, logger):
                           index     = [f'{geo_matrix[key]["elevation"]:1f}' for key in geo_matrix.keys()], 
                           columns   = [f'{sector:.1f}' for sector in sectors[:]])
     
-    df_out.to_excel(out_path_xlsx, index_label = 'mLat')
-    logger.info(f'Stored the weighted DEM sums pr hr, all DLCs summed together, to {out_path_xlsx}')
+    out_path = store_dataframe(df_out, out_path_xlsx, index = True, index_label = 'mLat')
+    logger.info(f'Stored the weighted DEM sums pr hr, all DLCs summed together, to {out_path}')
 
     return None
 
@@ -0,0 +1,158 @@
+import pandas as pd
+import hashlib
+import pickle
+import os
+
+'''
+Catalog of the DLC definitions, parsed once from the DLC definition workbook and shared by all scripts
+
+The workbook (Doc-0081164-...-Rev7.0.xlsx) has one sheet per DLC, with one row per case: simulation name and path, environmental conditions and the probability of the case.
+All sheets are parsed in one pass and cached on disk as a pickle in output/DLC_catalog, together with the size, modification time and hash of the workbook:
+    - the cache is used as long as the workbook has the same size and modification time, or the same content if only the modification time has changed
+    - the parsed catalog is also kept in memory, so that repeated lookups in the same process (per member, per turbine) do not read the cache again
+The paths of the result and description files of a cluster are resolved from the catalog with resolve_simulation_files.
+'''
+
+PROBABILITY_COLUMN = 'Tot_Prob_in_10_percent_idling_scenario_hr_year'
+
+_catalogs = dict() # DLC file as key, (workbook signature, catalog) as values
+
+def DLC_catalog_path(cache_dir, DLC_file):
+    """Path to the cached catalog of a DLC definition workbook
+
+    Args:
+        cache_dir (str): directory of the cached catalogs
+        DLC_file (str): path to the DLC definition workbook
+
+    Returns:
+        str: path to the .pkl cache
+    """
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(DLC_file))[0] + '.pkl')
+
+def file_hash(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def is_same_workbook(signature, DLC_file):
+    """Checks if a workbook is the one a catalog was parsed from
+
+    Args:
+        signature (dict): size, mtime_ns and sha1 of the workbook the catalog was parsed from
+        DLC_file (str): path to the DLC definition workbook
+
+    Returns:
+        bool: True if the workbook is unchanged. The hash is only calculated if the size is the same but the modification time has changed
+    """
+    stat = os.stat(DLC_file)
+    if stat.st_size != signature['size']:
+        return False
+    return stat.st_mtime_ns == signature['mtime_ns'] or file_hash(DLC_file) == signature['sha1']
+
+def parse_DLC_workbook(DLC_file):
+    """Parses all DLC sheets of the workbook in one pass
+
+    Args:
+        DLC_file (str): path to the DLC definition workbook
+
+    Returns:
+        dict: DLC ID (sheet name) as key, pd.DataFrame with one row per case as values. The case probabilities are floats [hr / year]
+    """
+    sheets = pd.read_excel(DLC_file, sheet_name = None)
+    catalog = dict()
+    for DLC, df in sheets.items():
+        if PROBABILITY_COLUMN not in df.columns: # e.g. an overview sheet
+            continue
+        df = df.reset_index(drop = True)
+        df[PROBABILITY_COLUMN] = df[PROBABILITY_COLUMN].astype(float)
+        catalog[DLC] = df
+    return catalog
+
+def load_DLC_catalog(DLC_file, cache_dir = None):
+    """Loads the catalog of a DLC definition workbook, from memory or the cache on disk if the workbook is unchanged, and else by parsing the workbook
+
+    Args:
+        DLC_file (str): path to the DLC definition workbook
+        cache_dir (str, optional): directory of the cached catalogs. Defaults to None, which uses output/DLC_catalog in the current work directory.
+
+    Returns:
+        dict: DLC ID as key, pd.DataFrame with one row per case as values, see parse_DLC_workbook. The DataFrames are shared, copy them before changing them
+    """
+    if DLC_file in _catalogs and is_same_workbook(_catalogs[DLC_file][0], DLC_file):
+        return _catalogs[DLC_file][1]
+
+    cache_dir = cache_dir if cache_dir is not None else os.path.join(os.getcwd(), "output", "DLC_catalog")
+    cache_path = DLC_catalog_path(cache_dir, DLC_file)
+    catalog = None
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'rb') as file:
+            signature, cached_catalog = pickle.load(file)
+        if is_same_workbook(signature, DLC_file):
+            catalog = cached_catalog
+
+    if catalog is None:
+        stat = os.stat(DLC_file)
+        signature = dict(size = stat.st_size, mtime_ns = stat.st_mtime_ns, sha1 = file_hash(DLC_file))
+        catalog = parse_DLC_workbook(DLC_file)
+
+        # written to a temporary file first, so that a process reading the cache never sees it partly written
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok = True)
+        tmp_path = cache_path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump((signature, catalog), file)
+        os.replace(tmp_path, cache_path)
+
+    signature['mtime_ns'] = os.stat(DLC_file).st_mtime_ns # a touched but unchanged workbook is not hashed again in this process
+    _catalogs[DLC_file] = (signature, catalog)
+    return catalog
+
+def get_DLC_cases(DLC_file, DLC_ID, cache_dir = None):
+    """Returns the cases of a DLC, see load_DLC_catalog
+
+    Args:
+        DLC_file (str): path to the DLC definition workbook
+        DLC_ID (str): DLC ID e.g. 'DLC12'
+        cache_dir (str, optional): directory of the cached catalogs. Defaults to None.
+
+    Returns:
+        pd.DataFrame: copy of the sheet of the DLC, one row per case
+    """
+    catalog = load_DLC_catalog(DLC_file, cache_dir)
+    if DLC_ID not in catalog:
+        raise KeyError(f'{DLC_ID} is not defined in {os.path.basename(DLC_file)}. Defined DLCs: {list(catalog.keys())}')
+    return catalog[DLC_ID].copy()
+
+def get_DLC_probabilities(DLC_file, DLC_IDs, cache_dir = None):
+    """Returns the probabilities of occurence of the cases of each DLC
+
+    Args:
+        DLC_file (str): path to the DLC definition workbook
+        DLC_IDs (list): DLC IDs as a list of strings
+        cache_dir (str, optional): directory of the cached catalogs. Defaults to None.
+
+    Returns:
+        dict: DLC ID as key, (n_cases,) array of case probabilities [hr / year] as values
+    """
+    catalog = load_DLC_catalog(DLC_file, cache_dir)
+    return {DLC: catalog[DLC][PROBABILITY_COLUMN].to_numpy(copy = True) for DLC in DLC_IDs}
+
+def resolve_simulation_files(df, cluster_ID, sim_res_cluster_folder):
+    """Resolves the paths of the simulation result and description files of the cases of a DLC for a cluster
+
+    Args:
+        df (pd.DataFrame): cases of the DLC, see get_DLC_cases
+        cluster_ID (str): which wind park cluster is the turbine a part of -> e.g. JLO for intermediate depth on Dogger Bank
+        sim_res_cluster_folder (str): path to where the simulation result time series are located depending on the current DLC
+
+    Returns:
+        pd.DataFrame: the cases with filenames, results_files and descr_files columns added
+    """
+    # Be aware of that the creation of the "path" column in the DLC file looks as if it was made for Windows. MacOS uses different backslashes
+    filenames  = [simulation_name.replace('XXX', cluster_ID) for simulation_name in df['simulation_name']]
+    case_dirs  = [os.path.join(sim_res_cluster_folder, os.path.join( *path.split("\\"))) for path in df['path']]
+    return df.assign(filenames     = filenames,
+                     results_files = [os.path.join(case_dir, filename + '.$105') for case_dir, filename in zip(case_dirs, filenames)],
+                     descr_files   = [os.path.join(case_dir, filename + '.%105') for case_dir, filename in zip(case_dirs, filenames)])
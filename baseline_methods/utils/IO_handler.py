@@ -1,7 +1,22 @@
 import scipy.io
 import numpy as np
+import pandas as pd
+import warnings
+import os
 import sys
 
+try:
+    import pyarrow # optional, parquet is used for the intermediate tables if it is installed
+    DATAFRAME_FORMAT = '.parquet'
+except ImportError:
+    DATAFRAME_FORMAT = '.pkl'
+
+# Switch for also exporting the intermediate tables to Excel, for inspection by hand. The final tables are always exported
+EXPORT_EXCEL = False
+
+# Formats of the tables passed between the stages, in the order they are looked for when loading. Excel is last, as it is by far the slowest to parse
+DATAFRAME_FORMATS = ['.parquet', '.pkl', '.xlsx']
+
 def store_table(table, combined_table, weights, output_file_name, identifier = 'damage'):
     """
     Stores either a DEM or a damage table to a file format decided by output_file_name. Can store both .npy binaries and .mat binaries
@@ -72,4 +87,114 @@ def load_table(file_name, identifier = 'damage', method = 'python'):
         
     else:
         print('Not a recognized method')
-        return np.empty((1,1,)) * np.nan
\ No newline at end of file
+        return np.empty((1,1,)) * np.nan
+
+def infer_column_types(df):
+    """Converts the object columns that only contain numbers (e.g. as strings from the structural reports) to numeric columns, and None to NaN,
+    so that a table loaded from a binary format gets the same column types as if it was written to and read back from Excel
+
+    Args:
+        df (pd.DataFrame): table to convert
+
+    Returns:
+        pd.DataFrame: converted copy of the table
+    """
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError): # mixed column, e.g. numbers and '-', are kept as they are like when read from Excel
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+def dataframe_path(file_name, file_format):
+    return os.path.splitext(file_name)[0] + file_format
+
+def find_dataframe(file_name):
+    """Finds the stored table of a file name in any of the DATAFRAME_FORMATS, regardless of the extension given in the file name.
+    An Excel file that is newer than the binary table, e.g. an export that has been edited by hand, is used instead of the binary table, with a warning
+
+    Args:
+        file_name (str): path of the table, e.g. .../util_rule_vs_report.xlsx
+
+    Returns:
+        str: path of the stored table, binary formats before Excel unless the Excel file is newer. None if the table is not stored in any format
+    """
+    paths = [dataframe_path(file_name, file_format) for file_format in DATAFRAME_FORMATS if os.path.isfile(dataframe_path(file_name, file_format))]
+    if len(paths) == 0:
+        return None
+    
+    excel_path = dataframe_path(file_name, '.xlsx')
+    if paths[0] != excel_path and excel_path in paths and os.stat(excel_path).st_mtime_ns > os.stat(paths[0]).st_mtime_ns:
+        warnings.warn(f'{excel_path} is newer than {os.path.basename(paths[0])} and is used instead. Store the table again to use the binary format')
+        return excel_path
+    return paths[0]
+
+def list_dataframes(base_dir, name):
+    """Lists all stored tables with a name below a directory, once per table even if it is stored in several formats
+
+    Args:
+        base_dir (str): directory to search recursively
+        name (str): name of the table without extension, e.g. 'util_worst_elevation_comparison'
+
+    Returns:
+        list: paths of the stored tables, see find_dataframe
+    """
+    return [find_dataframe(os.path.join(path, name)) for path, subdirs, files in os.walk(base_dir) 
+            if any(name + file_format in files for file_format in DATAFRAME_FORMATS)]
+
+def store_dataframe(df, file_name, index = False, index_label = None, export_excel = None):
+    """Stores a table passed between the stages of the calculations in the binary format DATAFRAME_FORMAT, parquet if pyarrow is installed and else pickle.
+    The table is stored next to the given file name, with the extension of the format. Tables that parquet can not store, e.g. with mixed column types, are pickled
+
+    Args:
+        df (pd.DataFrame): table to store
+        file_name (str): path of the table, the extension is replaced by the one of the format
+        index (bool, optional): store the index as the first column, like pd.DataFrame.to_excel. Defaults to False.
+        index_label (str, optional): name of the index column. Defaults to None.
+        export_excel (bool, optional): also export the table to Excel. Defaults to None, which uses EXPORT_EXCEL.
+
+    Returns:
+        str: path of the stored table
+    """
+    df = df.rename_axis(index_label).reset_index() if index else df.reset_index(drop = True) # a loaded table has a range index, like when read from Excel
+    df = infer_column_types(df)
+    
+    path = dataframe_path(file_name, DATAFRAME_FORMAT)
+    if DATAFRAME_FORMAT == '.parquet':
+        try:
+            df.to_parquet(path, index = False)
+        except (ValueError, TypeError, ImportError): # pyarrow errors derive from ValueError and TypeError
+            path = dataframe_path(file_name, '.pkl')
+    if path.endswith('.pkl'):
+        df.to_pickle(path)
+    
+    # Remove the table in the other binary format, so that it is not loaded instead of this one
+    for file_format in DATAFRAME_FORMATS[:-1]:
+        if dataframe_path(file_name, file_format) != path and os.path.isfile(dataframe_path(file_name, file_format)):
+            os.remove(dataframe_path(file_name, file_format))
+    
+    if export_excel or (export_excel is None and EXPORT_EXCEL):
+        df.to_excel(dataframe_path(file_name, '.xlsx'), index = False)
+        binary_stat = os.stat(path)
+        os.utime(dataframe_path(file_name, '.xlsx'), ns = (binary_stat.st_atime_ns, binary_stat.st_mtime_ns)) # same time as the binary table, so that the export is only used instead of it when edited, see find_dataframe
+    return path
+
+def load_dataframe(file_name):
+    """Loads a table stored by store_dataframe, or written to Excel by a previous version of the calculations. The format is detected from the stored files
+
+    Args:
+        file_name (str): path of the table, with any extension
+
+    Returns:
+        pd.DataFrame: the table
+    """
+    path = find_dataframe(file_name)
+    if path is None:
+        raise FileNotFoundError(f'No table stored as {os.path.splitext(file_name)[0]} with any of the extensions {DATAFRAME_FORMATS}')
+    
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    elif path.endswith('.pkl'):
+        return pd.read_pickle(path)
+    return pd.read_excel(path)
@@ -1,96 +1,206 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import qats
-import sys
+from types import MappingProxyType
 
 '''
 Implementation of SN curves using qats package
 '''
 
+def n_cycles_to_failure(stress_ranges, m1, loga1, m2 = None, loga2 = None, sswitch = None):
+    """Predicted number of cycles to failure of the given stress ranges for a single slope or bi-linear SN curve, for arrays of any shape. 
+    Same as qats.fatigue.sn.SNCurve.n without thickness correction
+
+    Args:
+        stress_ranges (np.array): stress ranges in MPa
+        m1 (float): slope for N <= Nd cycles
+        loga1 (float): intercept of the first linear curve
+        m2 (float, optional): slope for N > Nd cycles. Defaults to None for single slope curves.
+        loga2 (float, optional): intercept of the second linear curve. Defaults to None for single slope curves.
+        sswitch (float, optional): stress range at the switch between the two linear curves. Defaults to None for single slope curves.
+
+    Returns:
+        np.array: number of cycles to failure, same shape as stress_ranges
+    """
+    stress_ranges = np.asarray(stress_ranges, dtype = np.float64)
+    with np.errstate(divide = 'ignore'): # zero stress ranges gives infinite capacity, as in qats
+        log_s = np.log10(stress_ranges)
+    
+    if sswitch is None:
+        return 10 ** (loga1 - m1 * log_s)
+    
+    # bi-linear curve: upper part of the curve for stress ranges above the fatigue limit at Nd cycles
+    return np.where(stress_ranges >= sswitch, 10 ** (loga1 - m1 * log_s), 10 ** (loga2 - m2 * log_s))
+
+def miner_sum_batched(stress_cycles, m1, loga1, m2 = None, loga2 = None, sswitch = None):
+    """Palmgren-Miner summation of several sets of stress cycles at once, for a single slope or bi-linear SN curve given by its parameters. 
+    Gives the same result as qats.fatigue.sn.minersum of each set of stress cycles
+
+    Args:
+        stress_cycles (np.array): (..., n_cycles, 2) array with [..., 0] = stress ranges and [..., 1] = counts per stress range
+        m1, loga1, m2, loga2, sswitch (float): SN curve parameters, see n_cycles_to_failure
+
+    Returns:
+        np.array: (...) shaped array of miner sums as fractions of failure capacity (if >= 1, material fails)
+    """
+    stress_cycles = np.asarray(stress_cycles, dtype = np.float64)
+    damage_per_bin = stress_cycles[..., 1] / n_cycles_to_failure(stress_cycles[..., 0], m1, loga1, m2, loga2, sswitch)
+    if damage_per_bin.shape[-1] == 0:
+        return np.zeros(damage_per_bin.shape[:-1])
+    return np.cumsum(damage_per_bin, axis = -1)[..., -1] # sequential summation in the same order as qats, instead of pairwise summation in np.sum
+
+def miner_sums(curves, stress_cycles):
+    """Palmgren-Miner summation of a list of stress cycles with their own SN curves, e.g. the rows of a table of geometries.
+    The stress cycles are batched per SN curve and number of cycles, so that the miner sums of each batch are calculated at once 
+
+    Args:
+        curves (list): SN_Curve_qats instances
+        stress_cycles (list): (n_cycles, 2) arrays of stress ranges and counts, same length as curves
+
+    Returns:
+        np.array: miner sums in the same order as the input
+    """
+    batches = {}
+    for idx, (curve, cycles) in enumerate(zip(curves, stress_cycles)):
+        batches.setdefault((curve.SN.name, np.shape(cycles)), []).append(idx)
+    
+    out = np.zeros(len(curves))
+    for idx in batches.values():
+        out[idx] = curves[idx[0]].miner_sum_batched(np.stack([stress_cycles[i] for i in idx]))
+    return out
+
+# DNVGL-RP-C203 tables as in the standard. Wrapped read only in SN_TABLES below, which is parsed once at import and shared by all curves
+_FREE = dict(
+        reference = "DNVGL-RP-C203 - Edition April 2016, Table 2-4 S-N curves in seawater for free corrosion",
+        B1 = dict(m=3.0, loga=12.436, k=0.00),
+        B2 = dict(m=3.0, loga=12.262, k=0.00),
+        C  = dict(m=3.0, loga=12.115, k=0.15),
+        C1 = dict(m=3.0, loga=11.972, k=0.15),
+        C2 = dict(m=3.0, loga=11.824, k=0.15),
+        D  = dict(m=3.0, loga=11.687, k=0.20),
+        E  = dict(m=3.0, loga=11.533, k=0.20),
+        F  = dict(m=3.0, loga=11.378, k=0.25),
+        F1 = dict(m=3.0, loga=11.222, k=0.25),
+        F3 = dict(m=3.0, loga=11.068, k=0.25),
+        G  = dict(m=3.0, loga=10.921, k=0.25),
+        W1 = dict(m=3.0, loga=10.784, k=0.25),
+        W2 = dict(m=3.0, loga=10.630, k=0.25),
+        W3 = dict(m=3.0, loga=10.493, k=0.25),
+    )
+
+_CATH = dict(
+        reference = "DNVGL-RP-C203 - Edition April 2016, Table 2-2 S-N curves in seawater with cathodic protection",
+        B1 = dict(m1=4.0, loga1=14.917, m2=5, Nd=1e6, loga2=17.146, fl=106.97, k=0.00),
+        B2 = dict(m1=4.0, loga1=14.685, m2=5, Nd=1e6, loga2=16.856, fl= 93.59, k=0.00),
+        C  = dict(m1=3.0, loga1=12.192, m2=5, Nd=1e6, loga2=16.320, fl= 73.10, k=0.05),
+        C1 = dict(m1=3.0, loga1=12.049, m2=5, Nd=1e6, loga2=16.081, fl= 65.50, k=0.10),
+        C2 = dict(m1=3.0, loga1=11.901, m2=5, Nd=1e6, loga2=15.835, fl= 58.48, k=0.15),
+        D  = dict(m1=3.0, loga1=11.764, m2=5, Nd=1e6, loga2=15.606, fl= 52.63, k=0.20),
+        E  = dict(m1=3.0, loga1=11.610, m2=5, Nd=1e6, loga2=15.350, fl= 46.78, k=0.20),
+        F  = dict(m1=3.0, loga1=11.455, m2=5, Nd=1e6, loga2=15.091, fl= 41.52, k=0.25),
+        F1 = dict(m1=3.0, loga1=11.299, m2=5, Nd=1e6, loga2=14.832, fl= 36.84, k=0.25),
+        F3 = dict(m1=3.0, loga1=11.146, m2=5, Nd=1e6, loga2=14.576, fl= 32.75, k=0.25),
+        G  = dict(m1=3.0, loga1=10.998, m2=5, Nd=1e6, loga2=14.330, fl= 29.24, k=0.25),
+        W1 = dict(m1=3.0, loga1=10.861, m2=5, Nd=1e6, loga2=14.101, fl= 26.32, k=0.25),
+        W2 = dict(m1=3.0, loga1=10.707, m2=5, Nd=1e6, loga2=13.845, fl= 23.39, k=0.25),
+        W3 = dict(m1=3.0, loga1=10.570, m2=5, Nd=1e6, loga2=13.617, fl= 21.05, k=0.25),
+    )
+
+_AIR = dict(
+        reference = "DNVGL-RP-C203 Ed.: Apr 2016, Tab. 2-1 S-N curves in air",
+        B1 = dict(m1=4.0, loga1=15.117, m2=5, Nd=1e7, loga2=17.146, fl=106.97, k=0.00),
+        B2 = dict(m1=4.0, loga1=14.885, m2=5, Nd=1e7, loga2=16.856, fl= 93.59, k=0.00),
+        C  = dict(m1=3.0, loga1=12.592, m2=5, Nd=1e7, loga2=16.320, fl= 73.10, k=0.05),
+        C1 = dict(m1=3.0, loga1=12.449, m2=5, Nd=1e7, loga2=16.081, fl= 65.50, k=0.10),
+        C2 = dict(m1=3.0, loga1=12.301, m2=5, Nd=1e7, loga2=15.835, fl= 58.48, k=0.15),
+        D  = dict(m1=3.0, loga1=12.164, m2=5, Nd=1e7, loga2=15.606, fl= 52.63, k=0.20),
+        E  = dict(m1=3.0, loga1=12.010, m2=5, Nd=1e7, loga2=15.350, fl= 46.78, k=0.20),
+        F  = dict(m1=3.0, loga1=11.855, m2=5, Nd=1e7, loga2=15.091, fl= 41.52, k=0.25),
+        F1 = dict(m1=3.0, loga1=11.699, m2=5, Nd=1e7, loga2=14.832, fl= 36.84, k=0.25),
+        F3 = dict(m1=3.0, loga1=11.546, m2=5, Nd=1e7, loga2=14.576, fl= 32.75, k=0.25),
+        G  = dict(m1=3.0, loga1=11.398, m2=5, Nd=1e7, loga2=14.330, fl= 29.24, k=0.25),
+        W1 = dict(m1=3.0, loga1=11.261, m2=5, Nd=1e7, loga2=14.101, fl= 26.32, k=0.25),
+        W2 = dict(m1=3.0, loga1=11.107, m2=5, Nd=1e7, loga2=13.845, fl= 23.39, k=0.25),
+        W3 = dict(m1=3.0, loga1=10.970, m2=5, Nd=1e7, loga2=13.617, fl= 21.05, k=0.25),
+        Dg = dict(m1=3.5, loga1=13.540, m2=5, Nd=1e7, loga2=16.343, fl= 00.10, k=0.15), # Table F-9 S-N curves for improved details by grinding or hammer peening in air environment
+    )
+
+def _read_only_table(table):
+    # keys in lower case to avoid key errors based on any manual input, and read only views so that the shared tables can not be changed by a curve
+    return MappingProxyType({key.lower(): (MappingProxyType(dict(val)) if isinstance(val, dict) else val) for key, val in table.items()})
+
+SN_TABLES = MappingProxyType({'air': _read_only_table(_AIR), 'cath': _read_only_table(_CATH), 'free': _read_only_table(_FREE)})
+
+class SNCurveError(ValueError):
+    """Raised for names of SN curves that are not in SN_TABLES"""
+
+def parse_sn_curve_name(name):
+    """Finds the SN curve of a name like 'D-cath' or 'Dg-Air' in SN_TABLES. Letters are case insensitive, 
+    and a double lettered class that is not in the table is interpreted by its first letter, e.g. 'Dg-cath' as 'd-cath'
+
+    Args:
+        name (str): '<curve class>-<environment>', with environment 'air', 'cath' or 'free'
+
+    Raises:
+        SNCurveError: if the name is not of that format, or the curve is not in the tables
+
+    Returns:
+        str, str: curve class and environment in lower case, as keys of SN_TABLES
+    """
+    if not isinstance(name, str) or name.count('-') != 1:
+        raise SNCurveError(f"SN curve name {name!r} must be given as '<curve class>-<environment>', e.g. 'D-cath'")
+    curve_class, curve_type = [s.lower() for s in name.split('-')]
+    
+    if curve_type not in SN_TABLES:
+        raise SNCurveError(f'SN curve {name!r}: environment {curve_type!r} is not one of the supported {list(SN_TABLES.keys())}')
+    
+    if curve_class not in SN_TABLES[curve_type] and len(curve_class) > 1: # handle cases where eg. "Dg-cath" is passed, which only exists in air
+        print(f'SN curve class {curve_class!r} not in {curve_type}. Interpreted as {curve_class[0]!r}.')
+        curve_class = curve_class[0]
+    
+    if curve_class == 'reference' or curve_class not in SN_TABLES[curve_type]:
+        raise SNCurveError(f'SN curve {name!r}: class {curve_class!r} is not in the {curve_type} table {SN_TABLES[curve_type]["reference"]!r}')
+    return curve_class, curve_type
+
+_sn_curves = dict() # (curve class, environment) as key, shared SN_Curve_qats as values
+
+def get_sn_curve(name):
+    """Returns the SN curve of a name from the registry of curves, creating it at first use. 
+    All geometries with the same curve share one instance, which must not be modified
+
+    Args:
+        name (str): name of the curve, see parse_sn_curve_name
+
+    Raises:
+        SNCurveError: if the curve is not in SN_TABLES
+
+    Returns:
+        SN_Curve_qats: the shared curve
+    """
+    key = parse_sn_curve_name(name)
+    if key not in _sn_curves:
+        _sn_curves[key] = SN_Curve_qats(f'{key[0]}-{key[1]}')
+    return _sn_curves[key]
+
 class SN_Curve_qats:  
     
     def __init__(self, name):
-        self.free = dict(
-            reference = "DNVGL-RP-C203 - Edition April 2016, Table 2-4 S-N curves in seawater for free corrosion",
-            B1 = dict(m=3.0, loga=12.436, k=0.00),
-            B2 = dict(m=3.0, loga=12.262, k=0.00),
-            C  = dict(m=3.0, loga=12.115, k=0.15),
-            C1 = dict(m=3.0, loga=11.972, k=0.15),
-            C2 = dict(m=3.0, loga=11.824, k=0.15),
-            D  = dict(m=3.0, loga=11.687, k=0.20),
-            E  = dict(m=3.0, loga=11.533, k=0.20),
-            F  = dict(m=3.0, loga=11.378, k=0.25),
-            F1 = dict(m=3.0, loga=11.222, k=0.25),
-            F3 = dict(m=3.0, loga=11.068, k=0.25),
-            G  = dict(m=3.0, loga=10.921, k=0.25),
-            W1 = dict(m=3.0, loga=10.784, k=0.25),
-            W2 = dict(m=3.0, loga=10.630, k=0.25),
-            W3 = dict(m=3.0, loga=10.493, k=0.25),
-        )
-        self.cath = dict(
-            reference = "DNVGL-RP-C203 - Edition April 2016, Table 2-2 S-N curves in seawater with cathodic protection",
-            B1 = dict(m1=4.0, loga1=14.917, m2=5, Nd=1e6, loga2=17.146, fl=106.97, k=0.00),
-            B2 = dict(m1=4.0, loga1=14.685, m2=5, Nd=1e6, loga2=16.856, fl= 93.59, k=0.00),
-            C  = dict(m1=3.0, loga1=12.192, m2=5, Nd=1e6, loga2=16.320, fl= 73.10, k=0.05),
-            C1 = dict(m1=3.0, loga1=12.049, m2=5, Nd=1e6, loga2=16.081, fl= 65.50, k=0.10),
-            C2 = dict(m1=3.0, loga1=11.901, m2=5, Nd=1e6, loga2=15.835, fl= 58.48, k=0.15),
-            D  = dict(m1=3.0, loga1=11.764, m2=5, Nd=1e6, loga2=15.606, fl= 52.63, k=0.20),
-            E  = dict(m1=3.0, loga1=11.610, m2=5, Nd=1e6, loga2=15.350, fl= 46.78, k=0.20),
-            F  = dict(m1=3.0, loga1=11.455, m2=5, Nd=1e6, loga2=15.091, fl= 41.52, k=0.25),
-            F1 = dict(m1=3.0, loga1=11.299, m2=5, Nd=1e6, loga2=14.832, fl= 36.84, k=0.25),
-            F3 = dict(m1=3.0, loga1=11.146, m2=5, Nd=1e6, loga2=14.576, fl= 32.75, k=0.25),
-            G  = dict(m1=3.0, loga1=10.998, m2=5, Nd=1e6, loga2=14.330, fl= 29.24, k=0.25),
-            W1 = dict(m1=3.0, loga1=10.861, m2=5, Nd=1e6, loga2=14.101, fl= 26.32, k=0.25),
-            W2 = dict(m1=3.0, loga1=10.707, m2=5, Nd=1e6, loga2=13.845, fl= 23.39, k=0.25),
-            W3 = dict(m1=3.0, loga1=10.570, m2=5, Nd=1e6, loga2=13.617, fl= 21.05, k=0.25),
-        )
-        self.air = dict(
-            reference = "DNVGL-RP-C203 Ed.: Apr 2016, Tab. 2-1 S-N curves in air",
-            B1 = dict(m1=4.0, loga1=15.117, m2=5, Nd=1e7, loga2=17.146, fl=106.97, k=0.00),
-            B2 = dict(m1=4.0, loga1=14.885, m2=5, Nd=1e7, loga2=16.856, fl= 93.59, k=0.00),
-            C  = dict(m1=3.0, loga1=12.592, m2=5, Nd=1e7, loga2=16.320, fl= 73.10, k=0.05),
-            C1 = dict(m1=3.0, loga1=12.449, m2=5, Nd=1e7, loga2=16.081, fl= 65.50, k=0.10),
-            C2 = dict(m1=3.0, loga1=12.301, m2=5, Nd=1e7, loga2=15.835, fl= 58.48, k=0.15),
-            D  = dict(m1=3.0, loga1=12.164, m2=5, Nd=1e7, loga2=15.606, fl= 52.63, k=0.20),
-            E  = dict(m1=3.0, loga1=12.010, m2=5, Nd=1e7, loga2=15.350, fl= 46.78, k=0.20),
-            F  = dict(m1=3.0, loga1=11.855, m2=5, Nd=1e7, loga2=15.091, fl= 41.52, k=0.25),
-            F1 = dict(m1=3.0, loga1=11.699, m2=5, Nd=1e7, loga2=14.832, fl= 36.84, k=0.25),
-            F3 = dict(m1=3.0, loga1=11.546, m2=5, Nd=1e7, loga2=14.576, fl= 32.75, k=0.25),
-            G  = dict(m1=3.0, loga1=11.398, m2=5, Nd=1e7, loga2=14.330, fl= 29.24, k=0.25),
-            W1 = dict(m1=3.0, loga1=11.261, m2=5, Nd=1e7, loga2=14.101, fl= 26.32, k=0.25),
-            W2 = dict(m1=3.0, loga1=11.107, m2=5, Nd=1e7, loga2=13.845, fl= 23.39, k=0.25),
-            W3 = dict(m1=3.0, loga1=10.970, m2=5, Nd=1e7, loga2=13.617, fl= 21.05, k=0.25),
-            Dg = dict(m1=3.5, loga1=13.540, m2=5, Nd=1e7, loga2=16.343, fl= 00.10, k=0.15), # Table F-9 S-N curves for improved details by grinding or hammer peening in air environment
-        )
-        
-        classes = {'air': self.air, 'cath': self.cath, 'free': self.free}
-        
-        assert '-' in name, "Check init naming"
-        curve_class, curve_type = [s.lower() for s in name.split('-')]
-        
-        try:
-            self.input = classes[curve_type]
-        except KeyError as err:
-            print(f'Caught a key error: {err}, not in classes {classes.keys()}. Please check implementation of SN curve to see which types are supported. Exiting.')
-            sys.exit()
-        
-        self.input = {key.lower(): val for key, val in self.input.items()} # make everything lower case to avoid key errors based on any manual input 
+        """DNVGL-RP-C203 SN curve, see parse_sn_curve_name for the naming. Use get_sn_curve to share one instance per curve instead of creating new ones
+
+        Args:
+            name (str): e.g. 'D-cath' or 'Dg-Air'
+
+        Raises:
+            SNCurveError: if the curve is not in SN_TABLES
+        """
+        self.free = SN_TABLES['free']
+        self.cath = SN_TABLES['cath']
+        self.air  = SN_TABLES['air']
         
-        try:   
-            self.data = self.input[curve_class]
-        except KeyError as err:
-            print(f'Caught a key error: {err}. Checking for double lettered input')
-            if curve_class not in self.air.keys(): # handle cases where eg. "Dg-Air" is passed to constructor
-                if len(curve_class) > 1.0:
-                    curve_class = curve_class[0]
-                    try:
-                        self.data = self.input[curve_class]
-                        print(f'Interpreted {err} as {curve_class}. Continuing.')
-                    except KeyError as err:
-                        print(f'Caught a key error: {err}. Please check the keyword you are creating the curve with. Exiting.')
-                        sys.exit()
+        curve_class, curve_type = parse_sn_curve_name(name)
+        self.input = SN_TABLES[curve_type]
+        self.data = self.input[curve_class]
                 
-        self.input = {k.lower(): v for k, v in self.input.items()} # make all keys lower case
         self.curve_type = curve_type
         self.title = self.input['reference'] + f', {curve_class}'
         self.t_ref = 25.0 # millimeters - reference thickness equal 25 mm for welded connections other than simple tubular joints. For simple tubular joints the reference thickness is 16 mm when using the T-curve. The reference thickness is equal 25 mm when other S-N curves are used for fatigue analysis of tubular joints. For bolts tref = 25 mm
@@ -107,6 +217,10 @@ class SN_Curve_qats:
                                           m2 = self.data["m2"], # slope for N > Nd cycles
                                           loga1 = self.data["loga1"], # crossing point for one linear curve
                                           nswitch = self.data["Nd"])
+    
+    def __reduce__(self):
+        # pickled by name, e.g. when sent to worker processes, and unpickled as the shared curve of the receiving process
+        return (get_sn_curve, (self.SN.name,))
         
     def miner_sum(self, stress_ranges):
         """Calculate and return the Palmgren-Miner summation of the given stress ranges 
@@ -118,6 +232,39 @@ class SN_Curve_qats:
             float: The miner sum as a fraction of failure capacity (if >= 1, material fails)
         """
         return qats.fatigue.sn.minersum(stress_ranges[:,0], stress_ranges[:,1], self.SN) #takes ranges, counts, curve as input
+    
+    def sn_parameters(self):
+        """Parameters of the SN curve, to be used with n_cycles_to_failure and miner_sum_batched without the class instance
+
+        Returns:
+            dict: m1, loga1, m2, loga2 and sswitch, where the last three are None for single slope curves
+        """
+        if not self.SN.bilinear:
+            return dict(m1 = self.SN.m1, loga1 = self.SN.loga1, m2 = None, loga2 = None, sswitch = None)
+        return dict(m1 = self.SN.m1, loga1 = self.SN.loga1, m2 = self.SN.m2, loga2 = self.SN.loga2, sswitch = self.SN.sswitch)
+    
+    def n_cycles_to_failure(self, stress_ranges):
+        """Predicted number of cycles to failure of the given stress ranges, for arrays of any shape. Same as self.SN.n without thickness correction
+
+        Args:
+            stress_ranges (np.array): stress ranges in MPa
+
+        Returns:
+            np.array: number of cycles to failure, same shape as stress_ranges
+        """
+        return n_cycles_to_failure(stress_ranges, **self.sn_parameters())
+    
+    def miner_sum_batched(self, stress_cycles):
+        """Calculate and return the Palmgren-Miner summation of several sets of stress cycles at once, e.g. all sectors of a geometry or all cases of a DLC. 
+        Gives the same result as calling miner_sum on each set of stress cycles
+
+        Args:
+            stress_cycles (np.array): (..., n_cycles, 2) array with [..., 0] = stress ranges and [..., 1] = counts per stress range
+
+        Returns:
+            np.array: (...) shaped array of miner sums as fractions of failure capacity (if >= 1, material fails)
+        """
+        return miner_sum_batched(stress_cycles, **self.sn_parameters())
         
     def plot_characteristics(self, info_on_plot = True):
         """Plots how the SN_curve looks as a function of stress and cycles
@@ -170,7 +317,7 @@ if __name__ == '__main__':
     
     
     # The code below is for testing against reported values
-    curve = SN_Curve_qats('d-cath')
+    curve = get_sn_curve('d-cath')
     D = 8.456
     t = 72. / 1000
     DFF = 3.0
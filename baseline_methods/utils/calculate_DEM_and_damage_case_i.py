@@ -0,0 +1,128 @@
+import numpy as np
+from utils.simulation_cache import read_case_channels
+from utils.cycle_store import write_case_cycles
+from utils.SN_Curve import miner_sum_batched
+from utils.create_geo_matrix import sn_parameters_geo_i
+
+WOHLER_EXPONENT = 5.0 # wohler exponent of the internal DEM sums
+
+def damage_sums(cycles, ranges, wohler_exponents):
+    """
+    Damage sums count * (moment_range)**m of binned cycles, summed over the bins (last axis), for several wohler exponents in one pass. Bins without cycles (nan range) are ignored
+
+    Args:
+        cycles (np.array): counts of the bins, e.g. (..., n_rainflow_bins) of several sectors and cases
+        ranges (np.array): ranges of the bins, broadcastable with cycles
+        wohler_exponents (list): wohler exponents
+
+    Returns:
+        np.array: (..., len(wohler_exponents)) damage sums of each set of bins
+    """
+    with np.errstate(invalid = 'ignore', over = 'ignore'):
+        return np.nansum(np.asarray(cycles, dtype = np.float64)[..., None, :] * np.asarray(ranges, dtype = np.float64)[..., None, :] ** np.atleast_1d(np.asarray(wohler_exponents, dtype = np.float64))[:, None], axis = -1)
+
+def calculate_DEM_and_damage_case_i(binary_file_i, description_file_i, sectors, geo_arrays, rainflow_func, DEM_correction_factor, store_cycles, cycle_storage_path, cache_store = None, case_i = None, calc_DEM = True, calc_damage = True, n_rainflow_bins = 128):
+    """
+    Calculates in-place internal Damage Equivalent (bending) Moment sums, damage and moment cycles of a single DLC case in one pass
+    - Reads the moment and force channels of all geometries from the simulation files from vendor once
+    - Transforms time series into resultant moment for the relevant sectors we are looking at, and into stress scaled according to SCF and alpha
+    - Uses rainflow counting to find the moment ranges and stress ranges of all sectors in one call
+    - Calculates the internal moment * count sum in order to later be weighted with the current case_i probability, and used in an overall DEM calculation
+    - Calculates damage by assuming linear damage accumulation via the Palmgren-Miner summation, using DNVGL SN-curves
+    NOTE the damage is only meaningful for a geometry / elevation that is a member from the result simulations
+
+    Args:
+        binary_file_i (str): path of simulation result binary file
+        description_file_i (str): path of simulation description file, containing information about the format in the binary files
+        sectors (list): angles of relevant sectors, in degrees
+        geo_arrays (dict): array-backed geometry details at different elevations, see utils.create_geo_matrix.create_geo_arrays
+        rainflow_func (func): a python function for returning binned (ranges, counts) of all rows of a (n_sectors, n_timesteps) array using rainflow counting, see utils.rainflow_methods.get_range_and_count_multi_sector
+        DEM_correction_factor (float): a factor for increasing or decreasing the ranges according to details such as prolonged design lifetime due to commissioning/de-commissioning etc.
+        store_cycles (bool): a decider on weather or not the moment cycles (markov matrices) shall be stored
+        cycle_storage_path (str): path to the cycle store of the DLC where moment cycles can be stored if used later, see utils.cycle_store. The cycles are written to slot case_i
+        cache_store (str, optional): path to a converted store of the DLC to read the case from instead of the simulation files. Defaults to None.
+        case_i (int, optional): index of the case in the DLC, used for the cache store and the cycle store. Defaults to None.
+        calc_DEM (bool, optional): switch to calculate the internal DEM sums. Defaults to True.
+        calc_damage (bool, optional): switch to calculate the damage. Defaults to True.
+        n_rainflow_bins (int, optional): number of bins of the rainflow counting. Defaults to 128.
+
+    Returns:
+        np.array, np.array: 2D arrays containing internal DEM sum and damage for each geometry (rows), for each sector/angle (columns) for the current DLC case.
+                            An array that is not calculated is returned as zeros
+    """
+    m = WOHLER_EXPONENT
+    count_moments = calc_DEM or store_cycles # moment cycles are used for the DEM and stored as markov matrices
+
+    # Only the moment (and force) channels of the geometries are read from the simulation file, using -1 to fit Python indexing
+    cols = ['mx_col', 'my_col', 'fz_col'] if calc_damage else ['mx_col', 'my_col']
+    channels = sorted({int(channel) for col in cols for channel in geo_arrays[col]})
+    channel_rows = {channel: row for row, channel in enumerate(channels)}
+    content_reshaped = read_case_channels(binary_file_i, description_file_i, channels, cache_store, case_i) # (n,m) numpy array with n = no. of requested channels,  m = no. of timesteps for each data quantity
+
+    n_sectors = len(sectors)
+    n_geometries = len(geo_arrays['A'])
+    DEM_sum = np.zeros((n_geometries, n_sectors))
+    damage  = np.zeros((n_geometries, n_sectors))
+    moment_cycles = np.zeros((n_geometries, n_sectors, n_rainflow_bins, 2)) if store_cycles else None
+    sectors_rad = np.deg2rad(sectors)
+    for geo_idx in range(n_geometries):
+
+        moments_x_timeseries = content_reshaped[[channel_rows[geo_arrays['mx_col'][geo_idx]]], :] # Moments as (1, timesteps) array - hence the [[],:] type slice
+        moments_y_timeseries = content_reshaped[[channel_rows[geo_arrays['my_col'][geo_idx]]], :] # Moments as (1, timesteps) array
+
+        # Resulting moment time series in shape (n_angles, n_timesteps)
+        res_moments_timeseries_case_i = np.sin([sectors_rad]).T.dot(moments_x_timeseries) - np.cos([sectors_rad]).T.dot(moments_y_timeseries)
+
+        timeseries_to_count = []
+        if count_moments:
+            timeseries_to_count.append(res_moments_timeseries_case_i)
+
+        if calc_damage:
+            forces_z_case_i = content_reshaped[[channel_rows[geo_arrays['fz_col'][geo_idx]]], :] # Axial F as (1, timesteps) array
+            res_force_timeseries_case_i = np.repeat(forces_z_case_i, n_sectors, axis = 0)
+
+            # size (n_thetas, n_timesteps)
+            stress_timeseries_case_i = res_force_timeseries_case_i / geo_arrays['A'][geo_idx] + res_moments_timeseries_case_i / geo_arrays['Z'][geo_idx] # [Pa]: N / m**2 + Nm / m**3 = N / m**2 = Pa
+
+            # Adjust the stress according the stress concentration factors for certain angles
+            stress_timeseries_case_i *= geo_arrays['scf_per_point'][geo_idx][:, None] # Elementwise multiplication row wise
+            stress_timeseries_case_i *= geo_arrays['alpha'][geo_idx] * 1e-6 # [MPa]
+            timeseries_to_count.append(stress_timeseries_case_i)
+
+        if len(timeseries_to_count) == 0:
+            continue
+
+        # Moments and stresses of all sectors are counted in one call, as (n_rows, n_rainflow_bins, 2) sized array with [..., 0] = ranges and [..., 1] = counts [- / 10 min].
+        # The stress cycles must be counted separately from the moment cycles since the axial force changes the turning points
+        cycles = rainflow_func(np.vstack(timeseries_to_count), k = n_rainflow_bins)
+
+        # Scale the ranges 1% according to reports to account for the period prior to RNA attachment during commissioning and after RNA detachment during decommissioning
+        cycles[:, :, 0] *= DEM_correction_factor
+
+        if count_moments:
+            moment_cycles_all_sectors = cycles[:n_sectors]
+
+        if calc_DEM:
+            for sector_idx, cycles_sector_j in enumerate(moment_cycles_all_sectors):
+                '''
+                Calculate the sum of ranges and counts ("internal DEM sum") of the point at (geo_idx, sector_idx) by
+                for moment_range, count in cycles_sector_j:
+                  res += count * (moment_range)**wohler
+                For efficiency we use dot product instead of summing n_rainflow_bins elements each loop
+                '''
+
+                moment_ranges_sector_j = cycles_sector_j[:, [0]]
+                counts_sector_j = cycles_sector_j[:, [1]]
+
+                DEM_sum[[geo_idx], [sector_idx]] = ((moment_ranges_sector_j.T)**m).dot(counts_sector_j)
+
+        if calc_damage:
+            damage[geo_idx, :] = miner_sum_batched(cycles[-n_sectors:], **sn_parameters_geo_i(geo_arrays, geo_idx)) # miner sums of all sectors at once
+
+        if store_cycles:
+            moment_cycles[geo_idx] = moment_cycles_all_sectors
+
+    if store_cycles:
+        _ = write_case_cycles(cycle_storage_path, case_i, moment_cycles) # all members of the case in one write
+
+    return DEM_sum, damage # (n_geo, n_angles) shaped arrays
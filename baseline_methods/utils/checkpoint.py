@@ -0,0 +1,133 @@
+import numpy as np
+import hashlib
+import pickle
+import os
+
+'''
+Append-only checkpoints of the case results of a DLC calculation
+
+Each finished case is appended as one pickled record (case_i, case signature, DEM_sum, damage) to a checkpoint file per cluster and DLC:
+    - case signature:     name, size and modification time of the file the case was read from (the cache store if used, else the .$105 file),
+                          so that a case is recalculated if its input has changed
+    - settings signature: hash of the geometries, sectors and settings of the calculation, stored in the header of the file.
+                          A checkpoint made with other geometries or settings is discarded
+Records are only appended by the parent process, and a record that is cut short by a crash is ignored when the checkpoint is read,
+so a restarted run can skip all cases that were completed before the crash.
+'''
+
+def checkpoint_path(checkpoint_dir, cluster, DLC, info_strs):
+    """Path to the checkpoint file of a cluster's DLC
+
+    Args:
+        checkpoint_dir (str): base directory of the checkpoints
+        cluster (str): cluster name
+        DLC (str): DLC ID
+        info_strs (list): the calculated quantities, e.g. ['DEM', 'damage']
+
+    Returns:
+        str: path to the .pkl checkpoint file
+    """
+    return os.path.join(checkpoint_dir, cluster, f'DB_{cluster}_{DLC}_{"_".join(info_strs)}_checkpoint.pkl')
+
+def case_signature(binary_file, cache_store = None, case_i = None):
+    """Signature of the input of a case, changes if the file the case is read from is changed
+
+    Args:
+        binary_file (str): path to the .$105 binary file
+        cache_store (str, optional): path to the cache store the case is read from instead of the binary file. Defaults to None.
+        case_i (int, optional): index of the case in the cache store. Defaults to None.
+
+    Returns:
+        tuple: (file name, case index, size in bytes, modification time in ns)
+    """
+    source = cache_store if cache_store is not None else binary_file
+    stat   = os.stat(source)
+    return (os.path.basename(source), case_i if cache_store is not None else None, stat.st_size, stat.st_mtime_ns)
+
+def settings_signature(settings, geo_arrays):
+    """Hash of the geometries and settings of a DLC calculation, changes if anything that affects the case results is changed
+
+    Args:
+        settings (dict): settings of the DLC calculation, see main.prepare_DLC_calculations_cluster_i
+        geo_arrays (dict): geometry arrays of the cluster, see utils.create_geo_matrix.create_geo_arrays
+
+    Returns:
+        str: hex digest
+    """
+    sha1 = hashlib.sha1()
+    for key in sorted(settings):
+        value = settings[key]
+        sha1.update(key.encode())
+        sha1.update(repr(value.__module__ + '.' + value.__name__ if callable(value) else value).encode())
+    for key in sorted(geo_arrays):
+        sha1.update(key.encode())
+        sha1.update(np.asarray(geo_arrays[key]).tobytes() if key != 'member_id' else repr(geo_arrays[key]).encode())
+    return sha1.hexdigest()
+
+def read_checkpoint(path, signature):
+    """Reads the completed cases of a checkpoint file. Records after a partly written record are ignored
+
+    Args:
+        path (str): path to the checkpoint file
+        signature (str): settings signature of the current calculation, see settings_signature
+
+    Returns:
+        dict: case_i as key, (case signature, DEM_sum, damage) as values. Empty if there is no checkpoint or it was made with other settings
+    """
+    completed = dict()
+    if not os.path.isfile(path):
+        return completed
+
+    with open(path, 'rb') as file:
+        try:
+            if pickle.load(file) != signature:
+                return completed
+            while True:
+                case_i, case_sign, DEM_sum, damage = pickle.load(file)
+                completed[case_i] = (case_sign, DEM_sum, damage) # a case calculated again is overwritten by the latest record
+        except (EOFError, pickle.UnpicklingError, ValueError): # end of file, or a record cut short by a crash
+            pass
+
+    return completed
+
+def start_checkpoint(path, signature, completed = None):
+    """Starts a new checkpoint file, containing the already completed cases if given.
+    The file is rewritten to drop outdated or partly written records, and is written to a temporary file first so that a crash never leaves the previous checkpoint broken
+
+    Args:
+        path (str): path to the checkpoint file
+        signature (str): settings signature of the current calculation, see settings_signature
+        completed (dict, optional): completed cases to keep, see read_checkpoint. Defaults to None.
+
+    Returns:
+        str: path to the checkpoint file
+    """
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(signature, file)
+        for case_i, (case_sign, DEM_sum, damage) in (completed or dict()).items():
+            pickle.dump((case_i, case_sign, DEM_sum, damage), file)
+
+    os.replace(tmp_path, path)
+    return path
+
+def append_to_checkpoint(path, case_i, case_sign, DEM_sum, damage):
+    """Appends the result of a completed case to a checkpoint file
+
+    Args:
+        path (str): path to the checkpoint file, started by start_checkpoint
+        case_i (int): case index in the DLC
+        case_sign (tuple): signature of the case input, see case_signature
+        DEM_sum (np.array): (n_geo, n_sectors) internal DEM sums of the case
+        damage (np.array): (n_geo, n_sectors) damage of the case
+
+    Returns:
+        None: None
+    """
+    with open(path, 'ab') as file:
+        pickle.dump((case_i, case_sign, DEM_sum, damage), file)
+        file.flush()
+    return None
@@ -1,7 +1,7 @@
 import numpy as np 
 from utils.get_scf_sector_list import get_scf_sector_list
 from utils.transformations import compass_2_global, global_2_compass
-from utils.SN_Curve import SN_Curve_qats
+from utils.SN_Curve import SN_Curve_qats, get_sn_curve
 
 def calculate_cross_section_properties(geo_row):
     """Calculate general geometric properties of a turbine's cross section as defined by properties in the input
@@ -79,7 +79,7 @@ def create_geo_matrix(geometry, sectors):
         out_df[geo_idx]['adjusted_angles'] = adjusted_sectors
         out_df[geo_idx]['scf_per_point'] = scf_per_point
         
-        out_df[geo_idx]['sn_curve']    = SN_Curve_qats(geo_row['sn_curve'])
+        out_df[geo_idx]['sn_curve']    = get_sn_curve(geo_row['sn_curve']) # shared curve of the registry
         out_df[geo_idx]['scf']         = geo_row['scf']
         out_df[geo_idx]['gritblast']   = geo_row['gritblast']
         out_df[geo_idx]['orientation'] = compass_2_global(geo_row['orientation']) if (geo_row['orientation'] != 'omni' and geo_row['orientation'] != 'Omni') else None
@@ -109,4 +109,49 @@ def create_geo_matrix(geometry, sectors):
             out_df[geo_idx]['Nref']          = geo_row['Nref']
             out_df[geo_idx]['in_place_utilization'] = geo_row['in_place_utilization']
             
-    return out_df
\ No newline at end of file
+    return out_df
+
+def create_geo_arrays(geo_matrix):
+    """Create a compact, array-backed version of a geometry matrix, containing only what is needed in the case calculations. 
+    It holds no SN_Curve objects or pandas rows, so it is cheap to send to worker processes once instead of with every case
+
+    Args:
+        geo_matrix (dict): key as elevation index, values as all relevant geometrical values at the elevation, see create_geo_matrix
+
+    Returns:
+        dict: values as arrays along the geometries (first axis), in the order of the geo_matrix indices:
+              A, Z, alpha (n_geo,) | scf_per_point (n_geo, n_sectors) | mx_col, my_col, fz_col (n_geo,) 0-indexed channels, -1 for non-members | member_id (list) |
+              sn_m1, sn_loga1, sn_m2, sn_loga2, sn_sswitch (n_geo,) SN curve parameters, NaN for the second slope of single slope curves
+    """
+    geo_dicts = [geo_matrix[geo_idx] for geo_idx in range(len(geo_matrix))]
+    sn_params = [geo_dict['sn_curve'].sn_parameters() for geo_dict in geo_dicts]
+    
+    geo_arrays = dict()
+    geo_arrays['A']             = np.array([geo_dict['A'] for geo_dict in geo_dicts], dtype = np.float64)
+    geo_arrays['Z']             = np.array([geo_dict['Z'] for geo_dict in geo_dicts], dtype = np.float64)
+    geo_arrays['alpha']         = np.array([geo_dict['alpha'] for geo_dict in geo_dicts], dtype = np.float64)
+    geo_arrays['scf_per_point'] = np.array([geo_dict['scf_per_point'] for geo_dict in geo_dicts], dtype = np.float64)
+    geo_arrays['member_id']     = [geo_dict['member_id'] for geo_dict in geo_dicts]
+    
+    for col in ['mx_col', 'my_col', 'fz_col']:
+        # -1 to fit Python indexing of the channels in the simulation files
+        geo_arrays[col] = np.array([int(geo_dict[col] - 1) if geo_dict[col] is not None else -1 for geo_dict in geo_dicts], dtype = np.int64)
+    
+    for param in ['m1', 'loga1', 'm2', 'loga2', 'sswitch']:
+        geo_arrays[f'sn_{param}'] = np.array([params[param] if params[param] is not None else np.nan for params in sn_params], dtype = np.float64)
+    
+    return geo_arrays
+
+def sn_parameters_geo_i(geo_arrays, geo_idx):
+    """SN curve parameters of a single geometry in a geometry array struct, as used by utils.SN_Curve.miner_sum_batched
+
+    Args:
+        geo_arrays (dict): see create_geo_arrays
+        geo_idx (int): index of the geometry
+
+    Returns:
+        dict: m1, loga1, m2, loga2 and sswitch, where the last three are None for single slope curves
+    """
+    if np.isnan(geo_arrays['sn_sswitch'][geo_idx]):
+        return dict(m1 = geo_arrays['sn_m1'][geo_idx], loga1 = geo_arrays['sn_loga1'][geo_idx], m2 = None, loga2 = None, sswitch = None)
+    return {param: geo_arrays[f'sn_{param}'][geo_idx] for param in ['m1', 'loga1', 'm2', 'loga2', 'sswitch']}
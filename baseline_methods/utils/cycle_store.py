@@ -0,0 +1,294 @@
+import numpy as np
+import json
+import os
+
+'''
+Consolidated store of the moment cycles (markov matrices) of all members in all cases of a DLC
+
+The moment cycles of a cluster's DLC are stored in one pre-allocated .npy file that can be memory mapped:
+    - cycles:  (n_cases, n_members, n_sectors, n_rainflow_bins, 2) float64 array with [..., 0] = moment ranges and [..., 1] = counts [- / 10 min]
+    - header:  .json file next to the .npy file with the cluster, DLC, member ids, sectors and shape, used to look up the member index of a member id
+               and to check that an existing store fits the calculation
+The store is created by the parent process before the cases are calculated, and every case writes its own slot store[case_i] from the worker processes.
+Readers can then read the cycles of a member in all cases from one file instead of opening one file per member per case.
+
+The stores of a cluster are listed in a manifest, cycle_manifest.json in the markov directory, which is updated whenever a store is created.
+It holds the header and data offset of each store, so that the file and byte offset of the cycles of any (cluster, DLC, member, case) is found
+with a dictionary lookup, see create_cycle_index, instead of scanning the directory.
+'''
+
+def cycle_store_path(cycles_dir, cluster, DLC):
+    """Path to the cycle store of a cluster's DLC
+
+    Args:
+        cycles_dir (str): base directory of the cycle stores, i.e. output/all_turbines/<cluster>/markov
+        cluster (str): cluster name
+        DLC (str): DLC ID
+
+    Returns:
+        str: path to the .npy store
+    """
+    return os.path.join(cycles_dir, f'DB_{cluster}_{DLC}_cycles.npy')
+
+def cycle_store_header_path(store_path):
+    return os.path.splitext(store_path)[0] + '.json'
+
+def cycle_manifest_path(cycles_dir):
+    return os.path.join(cycles_dir, 'cycle_manifest.json')
+
+def _to_json(value):
+    # numpy scalars from the geometry sheets are not JSON serializable
+    return value.item() if isinstance(value, np.generic) else value
+
+def create_cycle_store_header(cluster, DLC, n_cases, member_ids, sectors, n_rainflow_bins = 128):
+    """Header describing the content of a cycle store
+
+    Args:
+        cluster (str): cluster name
+        DLC (str): DLC ID
+        n_cases (int): number of cases in the DLC
+        member_ids (list): member ids in the order of the geometries
+        sectors (list): angles of the sectors, in degrees
+        n_rainflow_bins (int, optional): number of bins of the rainflow counting. Defaults to 128.
+
+    Returns:
+        dict: header of the store
+    """
+    member_ids = [_to_json(member_id) for member_id in member_ids]
+    return dict(cluster    = cluster,
+                DLC        = DLC,
+                member_ids = member_ids,
+                sectors    = [float(sector) for sector in sectors],
+                shape      = [int(n_cases), len(member_ids), len(sectors), int(n_rainflow_bins), 2])
+
+def create_cycle_store(store_path, header):
+    """Creates an empty cycle store of the shape given in the header, replacing any existing store
+
+    Args:
+        store_path (str): path of the .npy store
+        header (dict): see create_cycle_store_header
+
+    Returns:
+        str: path of the .npy store
+    """
+    if not os.path.exists(os.path.dirname(store_path)):
+        os.makedirs(os.path.dirname(store_path))
+
+    store = np.lib.format.open_memmap(store_path, mode = 'w+', dtype = np.float64, shape = tuple(header['shape'])) # sparse file, the slots are filled in by the cases
+    data_offset = store.offset
+    del store
+    with open(cycle_store_header_path(store_path), 'w') as file:
+        json.dump(header, file)
+    
+    _ = update_cycle_manifest(store_path, header, data_offset)
+    return store_path
+
+def read_cycle_manifest(cycles_dir):
+    """Reads the manifest of the cycle stores in a directory
+
+    Args:
+        cycles_dir (str): directory of the cycle stores
+
+    Returns:
+        dict: DLC ID as key, dict with file name, header and data offset of the store as values. Empty if there is no manifest
+    """
+    if not os.path.isfile(cycle_manifest_path(cycles_dir)):
+        return dict()
+    with open(cycle_manifest_path(cycles_dir), 'r') as file:
+        return json.load(file)
+
+def update_cycle_manifest(store_path, header, data_offset):
+    """Adds or replaces the entry of a cycle store in the manifest of its directory. 
+    The manifest is written to a temporary file first, so that it is never left partly written
+
+    Args:
+        store_path (str): path of the .npy store
+        header (dict): see create_cycle_store_header
+        data_offset (int): offset in bytes of the cycles in the .npy file, i.e. the size of the .npy header
+
+    Returns:
+        dict: the updated manifest
+    """
+    cycles_dir = os.path.dirname(store_path)
+    manifest = read_cycle_manifest(cycles_dir)
+    manifest[header['DLC']] = dict(file = os.path.basename(store_path), header = header, data_offset = int(data_offset))
+    
+    tmp_path = cycle_manifest_path(cycles_dir) + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, cycle_manifest_path(cycles_dir))
+    return manifest
+
+def rebuild_cycle_manifest(cycles_dir):
+    """Rebuilds the manifest of a directory from the headers of the cycle stores in it, e.g. for stores copied from another machine
+
+    Args:
+        cycles_dir (str): directory of the cycle stores
+
+    Returns:
+        dict: the rebuilt manifest
+    """
+    if os.path.isfile(cycle_manifest_path(cycles_dir)):
+        os.remove(cycle_manifest_path(cycles_dir))
+    
+    manifest = dict()
+    for file_name in sorted(os.listdir(cycles_dir)):
+        store_path = os.path.join(cycles_dir, file_name)
+        header = read_cycle_store_header(store_path) if file_name.endswith('_cycles.npy') else None
+        if header is not None:
+            manifest = update_cycle_manifest(store_path, header, np.load(store_path, mmap_mode = 'r').offset)
+    return manifest
+
+def create_cycle_index(cycles_dir):
+    """Creates a lookup table of the cycles of every member in every DLC in a directory, from its manifest. 
+    The manifest is rebuilt if it is missing
+
+    Args:
+        cycles_dir (str): directory of the cycle stores, i.e. output/all_turbines/<cluster>/markov
+
+    Returns:
+        dict: (cluster, DLC, member_id) as keys, dict with store_path, member_idx, n_cases, data_offset and case_stride / member_stride in bytes as values
+    """
+    manifest = read_cycle_manifest(cycles_dir)
+    if len(manifest) == 0 and os.path.isdir(cycles_dir):
+        manifest = rebuild_cycle_manifest(cycles_dir)
+    
+    cycle_index = dict()
+    for entry in manifest.values():
+        header = entry['header']
+        n_cases, n_members, n_sectors, n_rainflow_bins, _ = header['shape']
+        member_stride = n_sectors * n_rainflow_bins * 2 * np.dtype(np.float64).itemsize
+        for member_idx, member_id in enumerate(header['member_ids']):
+            cycle_index[(header['cluster'], header['DLC'], member_id)] = dict(store_path    = os.path.join(cycles_dir, entry['file']), 
+                                                                              member_idx    = member_idx, 
+                                                                              n_cases       = n_cases, 
+                                                                              data_offset   = entry['data_offset'], 
+                                                                              case_stride   = n_members * member_stride, 
+                                                                              member_stride = member_stride, 
+                                                                              shape         = (n_sectors, n_rainflow_bins, 2))
+    return cycle_index
+
+def locate_cycles(cycle_index, cluster, DLC, member_id, case_i = None):
+    """Looks up where the cycles of a member are stored
+
+    Args:
+        cycle_index (dict): see create_cycle_index
+        cluster (str): cluster name
+        DLC (str): DLC ID
+        member_id (int): member id as defined in the structural reports
+        case_i (int, optional): case index in the DLC. Defaults to None.
+
+    Returns:
+        dict: the entry of the member in the index, with the byte offset of the case's cycles added as 'offset' if case_i is given
+    """
+    try:
+        entry = cycle_index[(cluster, DLC, _to_json(member_id))]
+    except KeyError:
+        raise KeyError(f'No moment cycles stored for {cluster} {DLC} member {member_id}. Run main.py with DEM calculation first')
+    
+    if case_i is None:
+        return entry
+    return dict(entry, offset = entry['data_offset'] + case_i * entry['case_stride'] + entry['member_idx'] * entry['member_stride'])
+
+def read_case_cycles(cycle_index, cluster, DLC, member_id, case_i):
+    """Reads the moment cycles of a member in a single case, with one read at the offset of the case
+
+    Args:
+        cycle_index (dict): see create_cycle_index
+        cluster (str): cluster name
+        DLC (str): DLC ID
+        member_id (int): member id as defined in the structural reports
+        case_i (int): case index in the DLC
+
+    Returns:
+        np.array: (n_sectors, n_rainflow_bins, 2) moment cycles of the member in the case
+    """
+    entry = locate_cycles(cycle_index, cluster, DLC, member_id, case_i)
+    return np.fromfile(entry['store_path'], dtype = np.float64, count = int(np.prod(entry['shape'])), offset = entry['offset']).reshape(entry['shape'])
+
+def read_cycle_store_header(store_path):
+    """Reads the header of a cycle store
+
+    Args:
+        store_path (str): path of the .npy store
+
+    Returns:
+        dict: header of the store, None if the store does not exist
+    """
+    if not (os.path.isfile(store_path) and os.path.isfile(cycle_store_header_path(store_path))):
+        return None
+    with open(cycle_store_header_path(store_path), 'r') as file:
+        return json.load(file)
+
+def is_cycle_store_valid(store_path, header):
+    """Checks that a cycle store exists and has the given header
+
+    Args:
+        store_path (str): path of the .npy store
+        header (dict): see create_cycle_store_header
+
+    Returns:
+        bool: True if the existing store can be used for the calculation described by the header
+    """
+    return read_cycle_store_header(store_path) == json.loads(json.dumps(header)) # compared as stored, i.e. with lists instead of tuples
+
+def write_case_cycles(store_path, case_i, cycles):
+    """Writes the moment cycles of all members of a case into the slot of the case
+
+    Args:
+        store_path (str): path of the .npy store
+        case_i (int): case index in the DLC
+        cycles (np.array): (n_members, n_sectors, n_rainflow_bins, 2) moment cycles of the case
+
+    Returns:
+        None: None
+    """
+    store = np.lib.format.open_memmap(store_path, mode = 'r+')
+    store[case_i] = cycles
+    store.flush()
+    del store
+    return None
+
+def read_cycle_store(store_path):
+    """Opens a cycle store for reading, without reading the cycles into memory
+
+    Args:
+        store_path (str): path of the .npy store
+
+    Returns:
+        np.memmap, dict: (n_cases, n_members, n_sectors, n_rainflow_bins, 2) read only array of the cycles, header of the store
+    """
+    return np.load(store_path, mmap_mode = 'r'), read_cycle_store_header(store_path)
+
+def read_member_cycles(store_path, member_id, member_idx = None):
+    """Reads the moment cycles of a member in all cases of the DLC
+
+    Args:
+        store_path (str): path of the .npy store
+        member_id (int): member id as defined in the structural reports
+        member_idx (int, optional): index of the member in the store, e.g. from locate_cycles. Defaults to None, which looks it up in the header of the store.
+
+    Returns:
+        np.array: (n_cases, n_sectors, n_rainflow_bins, 2) moment cycles of the member
+    """
+    store, header = read_cycle_store(store_path)
+    member_idx = member_idx if member_idx is not None else header['member_ids'].index(_to_json(member_id))
+    return np.array(store[:, member_idx])
+
+def iterate_member_cycles(store_path, member_id, chunk_size = 256, member_idx = None):
+    """Reads the moment cycles of a member in chunks of cases, so that a DLC can be processed with constant memory
+
+    Args:
+        store_path (str): path of the .npy store
+        member_id (int): member id as defined in the structural reports
+        chunk_size (int, optional): number of cases read at a time. Defaults to 256.
+        member_idx (int, optional): index of the member in the store, e.g. from locate_cycles. Defaults to None, which looks it up in the header of the store.
+
+    Yields:
+        slice, np.array: the cases of the chunk, (n_cases_in_chunk, n_sectors, n_rainflow_bins, 2) moment cycles of the member in these cases
+    """
+    store, header = read_cycle_store(store_path)
+    member_idx = member_idx if member_idx is not None else header['member_ids'].index(_to_json(member_id))
+    for case_start in range(0, store.shape[0], chunk_size):
+        cases = slice(case_start, min(case_start + chunk_size, store.shape[0]))
+        yield cases, np.array(store[cases, member_idx])
@@ -1,30 +1,34 @@
 import pandas as pd
-from utils.read_simulation_file import read_bladed_file
+from utils.DLC_catalog import get_DLC_cases, resolve_simulation_files, PROBABILITY_COLUMN
+from utils.read_simulation_file import read_bladed_header
+from utils.simulation_cache import cache_store_path, cache_store_shape, is_cache_store_valid
 import os
 
-def extract_and_preprocess_data(DLC_file, DLC_ID, cluster_ID, sim_res_cluster_folder):
+def extract_and_preprocess_data(DLC_file, DLC_ID, cluster_ID, sim_res_cluster_folder, cache_dir = None):
     """Creates a dataframe of the DLC case, generates paths for all the simulation files, and finds the shape of the data to be iterated through
 
     Args:
-        DLC_file (str): file path to the Excel file defining the DLC cases
+        DLC_file (str): file path to the Excel file defining the DLC cases, read through the DLC catalog, see utils.DLC_catalog
         DLC_ID (str): DLC ID e.g. 'DLC12', identifying the sheet of the DLC_file to extract data from
         cluster_ID (str): which wind park cluster is the turbine a part of -> e.g. JLO for intermediate depth on Dogger Bank
         sim_res_cluster_folder (str): path to where the simulation result time series are located depending on the current DLC
+        cache_dir (str, optional): base directory of converted simulation result stores. If a valid store is found for the DLC, the cases are read from it instead of the vendor files. Defaults to None.
 
     Returns:
         pd.DataFrame, list, int, int: DataFrame with DLC information, list of the DLC cases probabilities of occuring per in hr/year, the number of cases in this DLC, the number of timesteps in the result time series 
     """
-    df = pd.read_excel(DLC_file, sheet_name=DLC_ID)
-    probs = list(df.Tot_Prob_in_10_percent_idling_scenario_hr_year) # Extract directly from excel
+    df = get_DLC_cases(DLC_file, DLC_ID)
+    probs = list(df[PROBABILITY_COLUMN])
     n_cases = df.shape[0]
     
     # Assign and store the file locations for the current DLC
-    # Be aware of that the creation of the "path" column in the DLC file looks as if it was made for Windows. MacOS uses different backslashes
-    df = df.assign(filenames = df.apply(lambda x: x['simulation_name'].replace('XXX', cluster_ID), axis = 1))
-    df = df.assign(results_files = df.apply(lambda x: os.path.join(sim_res_cluster_folder, os.path.join( *x["path"].split("\\")), x['filenames'] + '.$105'), axis = 1))
-    df = df.assign(descr_files = df.apply(lambda x: os.path.join(sim_res_cluster_folder, os.path.join( *x["path"].split("\\")), x['filenames'] + '.%105'), axis = 1)) 
+    df = resolve_simulation_files(df, cluster_ID, sim_res_cluster_folder)
     
-    # Sneak peek one of the files to find the number of timesteps in order to pre allocate arrays and assist some functions
-    n_timesteps = read_bladed_file(df.results_files[0], df.descr_files[0]).shape[1]
+    # Use the converted store of the DLC if it exists and matches the vendor files -> cases are then read by their index in the store
+    store_path = cache_store_path(cache_dir, cluster_ID, DLC_ID) if cache_dir is not None else None
+    df = df.assign(cache_stores = store_path if (store_path is not None and is_cache_store_valid(store_path, list(df.results_files))) else None)
+    
+    # Sneak peek the description of one of the files (or the converted store) to find the number of timesteps in order to pre allocate arrays and assist some functions
+    n_timesteps = cache_store_shape(df.cache_stores[0])[2] if df.cache_stores[0] is not None else read_bladed_header(df.descr_files[0])['n_timesteps']
     
     return df, probs, n_cases, n_timesteps
\ No newline at end of file
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np 
 import os 
 import sys
+from utils.IO_handler import load_dataframe, store_dataframe, list_dataframes
 
 '''
 Script for inspecting the RULe utilization results
@@ -12,13 +13,13 @@ Meant to be run from parent folder
 if __name__ == '__main__':
     
     turbine_output_dir  = os.path.join(os.getcwd(), "output", "all_turbines")
-    info_from_reports_paths = [os.path.join(path, name) for path, subdirs, files in os.walk(turbine_output_dir) for name in files if 'geos_from_structure_report' in name]
+    info_from_reports_paths = list_dataframes(turbine_output_dir, 'utils_and_geos_from_structure_report')
     pd.options.display.max_rows = 500 # Print more rows
 
     # reported total util results
     max_dtot = []
     for path in info_from_reports_paths:
-        file = pd.read_excel(path)
+        file = load_dataframe(path)
         file = file[ file['Dd_tot'] != '-']
         res = pd.DataFrame(file.iloc[[pd.to_numeric(file['Dd_tot']).argmax()]])
         res = res[['turbine_name', 'cluster', 'elevation', 'in_out', 'description', 'Dd_tot']].copy()
@@ -30,7 +31,7 @@ if __name__ == '__main__':
     # reported inplace results
     max_inplace = []
     for path in info_from_reports_paths:
-        file = pd.read_excel(path)
+        file = load_dataframe(path)
         file = file[ file['in_place_utilization'] != '-']
         res = pd.DataFrame( file.iloc[ [pd.to_numeric(file['in_place_utilization']).argmax()] ])
         res = res[["turbine_name", "cluster", 'elevation', 'in_out', 'description', 'in_place_utilization']].copy()
@@ -40,10 +41,10 @@ if __name__ == '__main__':
     df_reported_inplace = pd.DataFrame(max_inplace)
     
     # RULe results
-    report_vs_rule_comparison_paths = [os.path.join(path, name) for path, subdirs, files in os.walk(turbine_output_dir) for name in files if 'worst_elevation_comparison' in name]
+    report_vs_rule_comparison_paths = list_dataframes(turbine_output_dir, 'util_worst_elevation_comparison')
     comparison_results = []
     for file in report_vs_rule_comparison_paths:
-        res = pd.read_excel(file).iloc[[0]] # the worst elevation comparison simply contains one row of information
+        res = load_dataframe(file).iloc[[0]] # the worst elevation comparison simply contains one row of information
         res = res[['turbine_name', "cluster", 'rule_worst_elevation', 'rule_worst_in_out', 'rule_worst_description',  'rule_worst_utilization']].copy()
         res.rename(columns = {"rule_worst_elevation": "el_rule", "rule_worst_in_out": "io_rule", "rule_worst_description" : "desc_rule", "rule_worst_utilization": 'util_rule'}, inplace = True)
         
@@ -68,5 +69,5 @@ if __name__ == '__main__':
     print(df_out) 
     
     out_path = os.path.join(turbine_output_dir, "utilization_summary_worst_points_Ddtot_vs_inplace_vs_rule.xlsx")
-    df_out.to_excel(out_path, index=False)
+    _ = store_dataframe(df_out, out_path, export_excel = True) # final table, always exported
     print(f"Stored util summary to {out_path}")
\ No newline at end of file
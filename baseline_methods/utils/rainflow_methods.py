@@ -2,6 +2,16 @@ import numpy as np
 import rainflow 
 import qats
 
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError: # numba is optional, the kernels below then run as plain Python functions
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
 '''
 Scripts for rainflow cycle counting
 Previously contained fatpack, but not used now
@@ -31,4 +41,126 @@ def get_range_and_count_qats(stress_timeseries, k = 128):
     ranges, mean, counts = qats.fatigue.rainflow.rebin(cycles, binby='range', n=k).T # rebin into k equidistant bins
     
     # ranges, mean, counts = qats.fatigue.rainflow.count_cycles(stress_timeseries).T # No rebinning
-    return np.hstack((ranges.reshape(-1,1), counts.reshape(-1,1))) 
\ No newline at end of file
+    return np.hstack((ranges.reshape(-1,1), counts.reshape(-1,1))) 
+
+def get_reversals(timeseries):
+    """Finds the reversals (turning points) of each row of a 2D array of time series, vectorized over all rows.
+    Gives the same reversals as qats.fatigue.rainflow.reversals, i.e. first and last points are never included and plateaus count as a single point
+
+    Args:
+        timeseries (np.ndarray): (n_series, n_timesteps) array of time series
+
+    Returns:
+        np.ndarray, np.ndarray: (n_series, max_n_reversals) array of reversals, padded with zeros after the last reversal of each row, and (n_series,) array of the number of reversals per row
+    """
+    diffs    = np.diff(timeseries, axis = 1) # diffs[:, j] = x[j+1] - x[j]
+    steps    = np.arange(diffs.shape[1])
+    nonzero  = diffs != 0
+    
+    # The previous non-zero difference of each step is found by a forward fill of the indices of non-zero differences. 
+    # The first difference is used as is, even if zero, which makes the first non-zero step after an initial plateau a non-reversal like in qats
+    last_nonzero          = np.maximum.accumulate(np.where(nonzero, steps, 0), axis = 1)
+    previous_diffs        = np.zeros_like(diffs)
+    previous_diffs[:, 1:] = np.take_along_axis(diffs, last_nonzero[:, :-1], axis = 1)
+    
+    is_reversal = nonzero & (previous_diffs * diffs < 0) # x[j] is a reversal if the series changes direction when stepping on to x[j+1]
+    
+    n_reversals = is_reversal.sum(axis = 1)
+    reversals   = np.zeros((timeseries.shape[0], max(int(n_reversals.max(initial = 0)), 1)))
+    rows, cols  = np.nonzero(is_reversal)
+    reversals[rows, np.cumsum(is_reversal, axis = 1)[rows, cols] - 1] = timeseries[rows, cols] # pack the reversals of each row to the left
+    return reversals, n_reversals
+
+@njit(cache = True)
+def _count_cycles_sectors(reversals, n_reversals):
+    """Four-point rainflow counting of the reversals of each row, according to ASTM E1049-85 (2011) 5.4.4 in the same way as qats.fatigue.rainflow.cycles
+
+    Args:
+        reversals (np.ndarray): (n_series, max_n_reversals) array of reversals, see get_reversals
+        n_reversals (np.ndarray): (n_series,) number of reversals per row
+
+    Returns:
+        np.ndarray, np.ndarray, np.ndarray: (n_series, max_n_reversals) arrays of cycle ranges and counts (1.0 for full and 0.5 for half cycles), and (n_series,) number of cycles per row
+    """
+    n_series, max_n_reversals = reversals.shape
+    ranges   = np.zeros((n_series, max_n_reversals))
+    counts   = np.zeros((n_series, max_n_reversals))
+    n_cycles = np.zeros(n_series, dtype = np.int64)
+    stack    = np.zeros(max_n_reversals)
+    
+    for row in range(n_series):
+        first = 0 # index of the first point of the stack, which is discarded instead of popped when counting half cycles
+        top   = 0 # no. of points on the stack, including discarded ones
+        n     = 0
+        for i in range(n_reversals[row]):
+            stack[top] = reversals[row, i]
+            top += 1
+            while top - first >= 3:
+                x = abs(stack[top - 2] - stack[top - 1])
+                y = abs(stack[top - 3] - stack[top - 2])
+                if x < y:
+                    break
+                elif top - first == 3: # Y contains the starting point -> count Y as half cycle and discard the first point
+                    ranges[row, n] = y
+                    counts[row, n] = 0.5
+                    first += 1
+                else: # count Y as one cycle and discard the peak and the valley of Y
+                    ranges[row, n] = y
+                    counts[row, n] = 1.0
+                    stack[top - 3] = stack[top - 1]
+                    top -= 2
+                n += 1
+        
+        # Count the remaining ranges as half cycles
+        while top - first > 1:
+            ranges[row, n] = abs(stack[top - 2] - stack[top - 1])
+            counts[row, n] = 0.5
+            top -= 1
+            n += 1
+        n_cycles[row] = n
+    
+    return ranges, counts, n_cycles
+
+def bin_cycles(ranges, counts, n_cycles, bin_edges):
+    """Sums the counts of each row into the bins given by the bin edges of the row, with the same edge handling as np.histogram:
+    bins are closed to the left and open to the right, except the last bin which is closed on both sides
+
+    Args:
+        ranges (np.ndarray): (n_series, max_n_cycles) array of cycle ranges
+        counts (np.ndarray): (n_series, max_n_cycles) array of cycle counts
+        n_cycles (np.ndarray): (n_series,) number of cycles per row
+        bin_edges (np.ndarray): (n_series, k+1) array of increasing bin edges per row
+
+    Returns:
+        np.ndarray: (n_series, k) array of binned counts
+    """
+    k = bin_edges.shape[1] - 1
+    binned_counts = np.zeros((len(n_cycles), k))
+    for row, n in enumerate(n_cycles):
+        bin_idx = np.searchsorted(bin_edges[row], ranges[row, :n], side = 'right') - 1
+        bin_idx = np.minimum(bin_idx, k - 1) # the largest range lies on the last edge
+        binned_counts[row, :] = np.bincount(bin_idx, weights = counts[row, :n], minlength = k)
+    return binned_counts
+
+def get_range_and_count_multi_sector(timeseries, k = 128):
+    """Rainflow counting of several time series at once, e.g. the resultant moment or stress of all sectors of a geometry.
+    Gives the same binned cycles as calling get_range_and_count_qats on each row, with the turning points found by vectorized numpy operations
+    and the four-point counting done by a compiled numba kernel (plain Python if numba is not installed)
+
+    Args:
+        timeseries (np.ndarray): (n_sectors, n_timesteps) array of time series, or a single (n_timesteps,) time series
+        k (int, optional): no. of equidistant range bins, from 0 to the largest range of each row. Defaults to 128.
+
+    Returns:
+        np.ndarray: (n_sectors, k, 2) array with [..., 0] = range bin mid points and [..., 1] = counts of the bin, counting half cycles as 0.5
+    """
+    timeseries = np.atleast_2d(np.asarray(timeseries, dtype = np.float64))
+    
+    reversals, n_reversals   = get_reversals(timeseries)
+    ranges, counts, n_cycles = _count_cycles_sectors(reversals, n_reversals)
+    
+    bin_edges = np.linspace(0., ranges.max(axis = 1), k + 1, axis = 1) # (n_sectors, k+1), equal to the bins of qats.fatigue.rainflow.rebin for each row
+    cycles    = np.zeros((timeseries.shape[0], k, 2))
+    cycles[:, :, 0] = 0.5 * (bin_edges[:, :-1] + bin_edges[:, 1:])
+    cycles[:, :, 1] = bin_cycles(ranges, counts, n_cycles, bin_edges)
+    return cycles
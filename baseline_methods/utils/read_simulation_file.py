@@ -1,22 +1,137 @@
 import numpy as np
-import struct
+import shlex
+import h5py
+import os
 
-def read_bladed_file(binary_file,text_file):
+'''
+Readers for the Bladed result files delivered by the vendor
+- the .%105 file is a text header describing the layout of the data
+- the .$105 file is the binary data itself, stored as little-endian floats with all channels of one timestep stored consecutively (Fortran order)
+- optionally, all cases of a DLC can be converted once into a compressed HDF5 cache store (see utils.simulation_cache) that is read by case index and channel
+'''
+
+BLADED_FORMAT_TO_DTYPE = {'R*4': '<f4', 'R*8': '<f8'} # binary formats given by the FORMAT keyword of the .%105 header
+
+def parse_header_value(value):
+    """Split the value part of a .%105 header line into tokens, keeping quoted channel names like 'Mx' as one token
+
+    Args:
+        value (str): everything after the keyword on a header line
+
+    Returns:
+        list: of str tokens
+    """
+    try:
+        return shlex.split(value)
+    except ValueError: # unbalanced quotes in free text fields
+        return value.split()
+
+def read_bladed_header(text_file):
+    """Parses the .%105 description file of a Bladed result into a dictionary
+
+    Args:
+        text_file (str): path to the .%105 description file
+
+    Returns:
+        dict: keywords of the header as keys with lists of tokens as values (keywords occuring several times, like AXISLAB, gets one list per occurence),
+              in addition to the derived entries 'n_channels', 'n_timesteps', 'dtype' and 'channels'
+    """
+    occurences = {}
+    with open(text_file, mode='r') as file:
+        for line in file:
+            tokens = line.strip().split(maxsplit = 1)
+            if len(tokens) == 0:
+                continue
+            value = parse_header_value(tokens[1]) if len(tokens) > 1 else []
+            occurences.setdefault(tokens[0].upper(), []).append(value)
+
+    header = {key: values[0] if len(values) == 1 else values for key, values in occurences.items()}
+
+    if 'DIMENS' not in header:
+        raise ValueError(f'Could not find the DIMENS keyword in {text_file} - unable to determine the size of the data matrix')
+
+    # The last dimension is always time, the others (variables, and possibly locations) are stored consecutively for each timestep
+    dimens = [int(d) for d in header['DIMENS']]
+    header['n_channels']  = int(np.prod(dimens[:-1]))
+    header['n_timesteps'] = dimens[-1]
+
+    data_format = header.get('FORMAT', ['R*4'])[0].upper()
+    try:
+        header['dtype'] = np.dtype(BLADED_FORMAT_TO_DTYPE[data_format])
+    except KeyError as err:
+        raise ValueError(f'Unsupported binary format {err} in {text_file}, supported formats are {list(BLADED_FORMAT_TO_DTYPE.keys())}')
+
+    header['channels'] = header.get('VARIAB', [])
+    return header
+
+def map_bladed_file(binary_file, header):
+    """Memory maps a Bladed binary file according to an already parsed description header
+
+    Args:
+        binary_file (str): path to the .$105 binary file
+        header (dict): parsed description file, see read_bladed_header
+
+    Returns:
+        np.ndarray: read-only (n_channels, n_timesteps) view of the mapped file
+    """
+    rows, cols, dtype = header['n_channels'], header['n_timesteps'], header['dtype']
+
+    expected_size = rows * cols * dtype.itemsize
+    if os.path.getsize(binary_file) != expected_size:
+        raise ValueError(f'Size of {binary_file} is {os.path.getsize(binary_file)} bytes, but the description file specifies {rows} x {cols} values = {expected_size} bytes')
+
+    content = np.memmap(binary_file, dtype = dtype, mode = 'r', shape = (rows, cols), order = 'F') # all channels of a timestep are stored consecutively -> Fortran order
+    return content.view(np.ndarray) # plain ndarray view of the same buffer, avoids the quirks of np.memmap subclass results in later calculations
+
+def read_bladed_file(binary_file, text_file):
     '''
-    Processes binary file and returns a matrix with time series data. 
-    
-    Loads binary files and reads the data corresponding to the specification in description text file 
-    Returns a (n,m) numpy array with dimensions:
-        n = no. of quantities of data,  m = no. of timesteps for each data quantity 
+    Processes binary file and returns a matrix with time series data.
+
+    Memory maps the binary file, interprets it according to the specification in description text file and copies it into double precision
+    Returns a (n,m) float64 numpy array with dimensions:
+        n = no. of quantities of data,  m = no. of timesteps for each data quantity
+    Use map_bladed_file for a read-only view of the file in its stored precision, without copying the data
     '''
-    with open(binary_file, mode='rb') as file:
-        content = file.read()
-    with open(text_file, mode='r') as file: # b is important -> binary
-        lines = file.read().split('\n')
-    dimens = lines[8].split() # Defining the size of the data matrix
-    rows = int(dimens[1]) # Number of different quantities in the matrix
-    cols = int(dimens[2]) # Number of time steps
-
-    content_unpacked = struct.unpack("<" + "f"*(len(content) // 4), content) # Define interpretation of binary data
-    content_reshaped = np.reshape(content_unpacked, (rows, cols), order='F') # Reshape for a useable numpy array
-    return content_reshaped
\ No newline at end of file
+    return map_bladed_file(binary_file, read_bladed_header(text_file)).astype(np.float64)
+
+def read_bladed_channels(binary_file, text_file, channels):
+    """Reads only the requested channels of a Bladed result file
+
+    The binary file is memory mapped and only the rows of the requested channels are copied out of it, so the memory use scales with the
+    number of requested channels. Since all channels of a timestep are stored next to each other, gathering even a few channels still
+    reads every page of the file from disk, so this does not save any I/O. Only the cache store (see read_cached_channels) avoids reading the other channels
+
+    Args:
+        binary_file (str): path to the .$105 binary file
+        text_file (str): path to the .%105 description file
+        channels (list): channels to read, either as 0-indexed row numbers or as channel names given in the VARIAB keyword of the description file
+
+    Returns:
+        np.ndarray: (len(channels), n_timesteps) shaped float64 array with the time series of the requested channels, in the requested order
+    """
+    header = read_bladed_header(text_file)
+    if any(isinstance(channel, str) for channel in channels):
+        try:
+            channels = [header['channels'].index(channel) if isinstance(channel, str) else channel for channel in channels]
+        except ValueError as err:
+            raise ValueError(f'{err} - available channels in {text_file} are {header["channels"]}')
+
+    content = map_bladed_file(binary_file, header)
+    return content[np.asarray(channels, dtype = int), :].astype(np.float64) # fancy indexing copies only the requested rows out of the mapped file, converted to double precision for the calculations
+
+def read_cached_channels(store_path, case_i, channels):
+    """Reads the requested channels of a single case from a converted HDF5 cache store
+
+    Args:
+        store_path (str): path to the .h5 cache store of the DLC, see utils.simulation_cache
+        case_i (int): index of the case in the DLC
+        channels (list): 0-indexed channel numbers to read
+
+    Returns:
+        np.ndarray: (len(channels), n_timesteps) shaped float64 array with the time series of the requested channels, in the requested order
+    """
+    channels = np.asarray(channels, dtype = int)
+    unique_channels, order = np.unique(channels, return_inverse = True) # HDF5 selections must be increasing
+    with h5py.File(store_path, 'r') as store:
+        content = store['timeseries'][int(case_i), unique_channels, :] # each (case, channel) series is stored as a separate chunk, so only the requested ones are decompressed
+    return content[order, :].astype(np.float64)
@@ -3,6 +3,7 @@ import PyPDF2
 import pandas as pd
 import copy
 import re
+from utils.IO_handler import store_dataframe
     
 def identify_pages_with_key_word(file_path, key_word, start_page = 40, end_page = 50):
     """Finds the page number of the first page in PDF file that contains a key word
@@ -174,7 +175,7 @@ def find_turbine_and_cluster(structural_report_path):
     return turbine_name, cluster    
 
 def read_utilization_and_store_geometries(structural_report_path, result_dir, STORE = True):
-    """Reads, interprets and calculates main features of the fatigue design reports. Stores the results as an Excel file.
+    """Reads, interprets and calculates main features of the fatigue design reports. Stores the results as a table, see utils.IO_handler.store_dataframe.
 
     Args:
         structural_report_path (str): r-string path to structural report
@@ -242,7 +243,7 @@ def read_utilization_and_store_geometries(structural_report_path, result_dir, ST
     
     result_path = os.path.join(result_dir, "utils_and_geos_from_structure_report.xlsx")
     if STORE:
-        df.to_excel(result_path)
+        result_path = store_dataframe(df, result_path, index = True)
         print(f'Stored util and geos for {turbine_name}')
     else:
         pd.options.display.max_rows = 100 
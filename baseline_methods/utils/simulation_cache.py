@@ -0,0 +1,171 @@
+import numpy as np
+import hashlib
+import h5py
+import warnings
+import os
+from .read_simulation_file import read_bladed_header, map_bladed_file, read_bladed_channels, read_cached_channels # relative, so the module is also importable as baseline_methods.utils.simulation_cache from the repository root
+
+'''
+Persistent cache of the vendor simulation results
+
+The Bladed result files of every case in a DLC are converted once into a single HDF5 store per cluster and DLC:
+    - timeseries:    (n_cases, n_channels, n_timesteps) dataset in the binary format of the result files (float32 for R*4, float64 for R*8), chunked per (case, channel) and compressed
+    - source_files:  (n_cases,) file names of the .$105 files the cases were converted from, in the same order as the DLC definition sheet
+    - source_sizes:  (n_cases,) sizes of the source files in bytes
+    - source_mtimes: (n_cases,) modification times of the source files in ns when they were converted
+    - source_hashes: (n_cases,) sha1 content hashes of the source files
+A store is valid as long as every source file has the same size and modification time, or the same content hash if the modification time has changed.
+A re-run simulation keeps the size of its result file, so the size alone is not enough. See is_cache_store_valid.
+Later campaigns can then read the cases sequentially from one file instead of parsing the vendor tree again.
+'''
+
+def hash_file(path, block_size = 2**20):
+    """Returns the sha1 hash of the content of a file, read in blocks to limit memory usage
+
+    Args:
+        path (str): path to the file
+        block_size (int, optional): number of bytes read at a time. Defaults to 2**20.
+
+    Returns:
+        str: hex digest of the file content
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def cache_store_path(cache_dir, cluster, DLC):
+    """Path to the cache store of a cluster's DLC
+
+    Args:
+        cache_dir (str): base directory of the cache stores
+        cluster (str): cluster name
+        DLC (str): DLC ID
+
+    Returns:
+        str: path to the .h5 store
+    """
+    return os.path.join(cache_dir, cluster, f'DB_{cluster}_{DLC}_timeseries.h5')
+
+def convert_DLC_to_cache_store(results_files, descr_files, store_path, logger = None):
+    """Converts all the Bladed result files of a DLC into a single HDF5 cache store.
+    The store is written to a temporary file first and moved into place when complete, so that an interrupted conversion never leaves a partial store behind.
+
+    Args:
+        results_files (list): paths to the .$105 binary files of all cases, ordered as in the DLC definition sheet
+        descr_files (list): paths to the .%105 description files of all cases
+        store_path (str): path of the resulting .h5 store
+        logger (logger, optional): logger. Defaults to None.
+
+    Returns:
+        str: path of the resulting .h5 store
+    """
+    header  = read_bladed_header(descr_files[0]) # the store gets the binary format of the first case, so that R*8 results keep their precision
+    n_cases = len(results_files)
+    shape   = (n_cases, header['n_channels'], header['n_timesteps'])
+
+    if not os.path.exists(os.path.dirname(store_path)):
+        os.makedirs(os.path.dirname(store_path))
+
+    tmp_path = store_path + '.tmp'
+    with h5py.File(tmp_path, 'w') as store:
+        timeseries = store.create_dataset('timeseries', shape = shape, dtype = header['dtype'], chunks = (1, 1, shape[2]), compression = 'lzf', shuffle = True)
+        timeseries.attrs['channels'] = [str(channel) for channel in header['channels']]
+
+        source_hashes, source_mtimes = [], []
+        for case_i, (binary_file, text_file) in enumerate(zip(results_files, descr_files)):
+            header_i = read_bladed_header(text_file)
+            if header_i['dtype'].itemsize > header['dtype'].itemsize:
+                raise ValueError(f'{text_file} is stored as {header_i["dtype"]}, which would lose precision in the {header["dtype"]} store of {descr_files[0]}')
+            timeseries[case_i, :, :] = map_bladed_file(binary_file, header_i) # sequential read of the memory mapped source file, written as one slab per case
+            source_mtimes.append(os.stat(binary_file).st_mtime_ns)
+            source_hashes.append(hash_file(binary_file))
+
+            if (logger is not None) and ((case_i + 1) % 500 == 0):
+                logger.info(f'Converted {case_i + 1} / {n_cases} cases into {os.path.basename(store_path)}')
+
+        store.create_dataset('source_files',  data = [os.path.basename(f) for f in results_files], dtype = h5py.string_dtype())
+        store.create_dataset('source_sizes',  data = [os.path.getsize(f) for f in results_files])
+        store.create_dataset('source_mtimes', data = np.array(source_mtimes, dtype = np.int64))
+        store.create_dataset('source_hashes', data = source_hashes, dtype = h5py.string_dtype())
+
+    os.replace(tmp_path, store_path)
+    return store_path
+
+def cache_store_shape(store_path):
+    """Shape of the time series stored in a cache store
+
+    Args:
+        store_path (str): path to the .h5 store
+
+    Returns:
+        tuple: (n_cases, n_channels, n_timesteps)
+    """
+    with h5py.File(store_path, 'r') as store:
+        return store['timeseries'].shape
+
+def is_cache_store_valid(store_path, results_files, verify_hashes = False, logger = None):
+    """Checks that a cache store exists and was converted from the given result files, in the same order and with the same content
+
+    Every source file must have the same size as when it was converted. If its modification time has changed as well (or is not stored, for stores converted 
+    by earlier versions), its content hash is compared, so that re-run simulations with result files of the same size are detected, and a touched but 
+    unchanged file is not. Source files that are missing, e.g. moved away after conversion, cannot be checked: they are reported and the stored hashes are trusted.
+
+    Args:
+        store_path (str): path to the .h5 store
+        results_files (list): paths to the .$105 binary files of all cases, ordered as in the DLC definition sheet
+        verify_hashes (bool, optional): switch to compare the content hashes of all existing source files, also if their modification time is unchanged. Defaults to False.
+        logger (logger, optional): logger for the missing source files, a warning is issued if None. Defaults to None.
+
+    Returns:
+        bool: True if the store can be used in place of the result files
+    """
+    if not os.path.isfile(store_path):
+        return False
+
+    with h5py.File(store_path, 'r') as store:
+        source_files = [f.decode() if isinstance(f, bytes) else f for f in store['source_files'][:]]
+        source_sizes = store['source_sizes'][:]
+        source_mtimes = store['source_mtimes'][:] if 'source_mtimes' in store else [None] * len(source_files)
+        source_hashes = [h.decode() if isinstance(h, bytes) else h for h in store['source_hashes'][:]]
+
+    if source_files != [os.path.basename(f) for f in results_files]:
+        return False
+
+    missing_files = []
+    for results_file, size, mtime, sha1 in zip(results_files, source_sizes, source_mtimes, source_hashes):
+        if not os.path.isfile(results_file):
+            missing_files.append(results_file)
+            continue
+        stat = os.stat(results_file)
+        if stat.st_size != size:
+            return False
+        if (verify_hashes or stat.st_mtime_ns != mtime) and hash_file(results_file) != sha1:
+            return False
+
+    if len(missing_files) > 0:
+        message = f'{len(missing_files)} of {len(results_files)} source files of {os.path.basename(store_path)} are missing, e.g. {missing_files[0]}. Their cases are read from the store unchecked'
+        if logger is not None:
+            logger.warning(message)
+        else:
+            warnings.warn(message)
+
+    return True
+
+def read_case_channels(binary_file, text_file, channels, cache_store = None, case_i = None):
+    """Reads the requested channels of a case, from the cache store if one is given and from the vendor files otherwise
+
+    Args:
+        binary_file (str): path to the .$105 binary file
+        text_file (str): path to the .%105 description file
+        channels (list): 0-indexed channel numbers to read
+        cache_store (str, optional): path to a validated cache store of the case's DLC. Defaults to None.
+        case_i (int, optional): index of the case in the cache store. Defaults to None.
+
+    Returns:
+        np.ndarray: (len(channels), n_timesteps) shaped float64 array with the time series of the requested channels, in the requested order
+    """
+    if cache_store is not None:
+        return read_cached_channels(cache_store, case_i, channels)
+    return read_bladed_channels(binary_file, text_file, channels)
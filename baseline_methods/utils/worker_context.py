@@ -0,0 +1,30 @@
+'''
+Data shared by all cases of a calculation, published once to every worker process instead of being sent with each case
+
+The parent process collects the shared data (geometry arrays, sectors, settings of each DLC etc.) in a dict and passes it to init_worker,
+either as the initializer of a multiprocessing.Pool or directly when running on a single CPU. The tasks then only carry what differs
+between the cases (case index and file paths), and look up the rest with get_shared_data in the worker.
+'''
+
+_shared_data = dict()
+
+def init_worker(shared_data):
+    """Publishes the shared data in the current process. Used as initializer of the worker processes, it is called once per worker
+
+    Args:
+        shared_data (dict): data shared by all cases of the calculation
+
+    Returns:
+        None: None
+    """
+    _shared_data.clear()
+    _shared_data.update(shared_data)
+    return None
+
+def get_shared_data():
+    """Returns the data published in the current process by init_worker
+
+    Returns:
+        dict: data shared by all cases of the calculation
+    """
+    return _shared_data
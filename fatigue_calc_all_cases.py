@@ -1,83 +1,158 @@
-from wetb.fatigue_tools.fatigue import eq_load, eq_load_and_cycles
-from read_simulation_file.read_simulation_file import read_bladed_file
-import matplotlib.pyplot as plt
+from wetb.fatigue_tools.fatigue import CycleMatrix, ampl_bin_edges, fine_ampl_bin_edges
 from wetb.fatigue_tools.rainflowcounting import rainflowcount
 import numpy as np
-import struct
-from get_moment_time_series import get_moment_time_series
+import pandas as pd
+from get_moment_time_series import get_case_files, get_moment_time_series_case_i
+from baseline_methods.utils.DLC_catalog import PROBABILITY_COLUMN
+from baseline_methods.utils.simulation_cache import cache_store_path, is_cache_store_valid
 from multiprocessing import Pool
-import os 
+from functools import partial
+import os
 
 
+'''
+Damage equivalent moments of all sectors of a cluster, over all cases of all DLCs
 
-def calculate_eq_loads_case_i(sector, sectors, DLC_IDs, timeseries_lengths, cluster_ID):
+The cases are calculated in chunks in the workers of a pool, so no process holds more than one case at a time:
+    - each worker reads a case once and projects it onto all sectors at once (see get_moment_time_series_case_i)
+    - the rainflow counted cycles of each sector are binned into a CycleMatrix (see wetb.fatigue_tools.fatigue), and the matrices of the
+      chunk are returned to the parent process and merged into the total of the sector
+The amplitude bin edges go from 0 to the largest amplitude of a sector in all cases, as in eq_load_and_cycles, which is only known after the
+last case. The cycles are therefore binned on fine_ampl_bin_edges first, whose bin width grows by powers of two with the largest amplitude so far,
+and the merged matrices are rebinned to no_bins edges at the end (see fine_cycle_matrices_cases). Only the cycles within one fine bin of the final
+edges can end up in the neighbouring bin, so the equivalent loads differ from binning all cycles on the final edges by much less than the binning
+itself. Pass the max_ampls of an earlier run (see read_max_ampls) to bin on the final edges directly. The equivalent loads are calculated from the
+merged cycle matrices and written to a csv file with one row per sector, Wohler exponent and equivalent number, see write_eq_loads. The merged cycle
+matrices can also be saved, to calculate equivalent loads for other Wohler exponents and equivalent numbers later without counting the cycles again.
+'''
 
-    rainflow_windap = rainflowcount.rainflow_windap
-    rainflow_astm = rainflowcount.rainflow_astm
+def read_case_list(DLC_IDs, timeseries_lengths, cluster_ID, fatigue_config_file, results_folder_for_cluster, cache_dir):
 
-    path = r'C:\Users\IDH\OneDrive - Equinor\R&T Wind\RULe\SSE Doggerbank'
-    fatigue_config_file = path +  r'\Doc-0081164-HAL-X-13MW-DGB-A-OWF-Detailed DLC List-Fatigue Support Structure Load Assessment_Rev7.0.xlsx'
-    results_folder_for_cluster = path +  r'\Doc-0089427-HAL-X-13MW DB-A OWF-ILA3_JLO-model_fatigue_timeseries_all_elevations'
+    cases = []
+    for DLC_ID, timeseries_length in zip(DLC_IDs, timeseries_lengths):
+        df = get_case_files(DLC_ID, cluster_ID, fatigue_config_file, results_folder_for_cluster)
 
+        # the store is only used if it was converted from the result files of the DLC, in the same order, as in baseline_methods/utils/extract_and_preprocess_data.py
+        cache_store = None if cache_dir is None else cache_store_path(cache_dir, cluster_ID, DLC_ID)
+        cache_store = cache_store if cache_store is not None and is_cache_store_valid(cache_store, list(df.results_files)) else None
 
-    print( f'Process {os.getpid()} starts sector {sector}')
+        # (files, length, cache store and index in the DLC, weight) of each case
+        for index, (bin_file, text_file, prob) in enumerate(zip(df.results_files, df.descr_files, df[PROBABILITY_COLUMN])):
+            cases.append((bin_file, text_file, timeseries_length, cache_store, index, prob*6))
+        print('DLC_ID', DLC_ID, df.shape[0], 'cases')
 
-    weights_all_dlcs = []
-    list_of_moments = []
+    return cases
 
-    for DLC_ID, timeseries_length in zip(DLC_IDs, timeseries_lengths):
-        moments_all_cases, weights = get_moment_time_series(DLC_ID, cluster_ID, fatigue_config_file, results_folder_for_cluster, timeseries_length)
-        
-        moments_all_cases_sector_1 = moments_all_cases[:, sectors.index(sector),:]
-        
-        for timeseries in moments_all_cases_sector_1:
-            list_of_moments.append(timeseries)
+def fit_fine_cycle_matrix(cycle_mat, max_ampl, no_fine_bins):
+    # fine edges up to the largest amplitude of the matrix and max_ampl. They are coarser than or equal to the current edges, which are
+    # every 2**k-th of them, so the rebinning is exact
+    ampl_edges = fine_ampl_bin_edges(max(cycle_mat.max_ampl, max_ampl), no_fine_bins)
+    return cycle_mat if np.array_equal(ampl_edges, cycle_mat.ampl_edges) else cycle_mat.rebin(ampl_edges)
 
-        weights_all_dlcs = weights_all_dlcs + weights
-        print('DLC_ID', DLC_ID)
+def fine_cycle_matrices_cases(cases, sector_idxs, no_fine_bins = 4096, rainflow_func = rainflowcount.rainflow_astm):
 
-    weights_all_dlcs = np.array(weights_all_dlcs)*6
-    #weights_all_dlcs = np.ones(len(weights_all_dlcs))
-    
-    moment_lists = list(zip(weights_all_dlcs, list_of_moments))
+    cycle_matrices = [CycleMatrix(fine_ampl_bin_edges(0, no_fine_bins)) for _ in sector_idxs]
+    for bin_file, text_file, timeseries_length, cache_store, index, weight in cases:
+        moments = get_moment_time_series_case_i(bin_file, text_file, timeseries_length, cache_store, index)
+        for i, sector_idx in enumerate(sector_idxs):
+            ampls, means = rainflow_func(moments[sector_idx])
+            max_ampl = ampls.max() if weight > 0 and len(ampls) else 0 # cycles without weight do not need to be inside the edges
+            cycle_matrices[i] = fit_fine_cycle_matrix(cycle_matrices[i], max_ampl, no_fine_bins)
+            cycle_matrices[i].add_cycles(ampls, means, weight)
 
-    print(np.shape(list_of_moments))
-    print(np.shape(weights_all_dlcs))
-    print(np.shape(moment_lists))
-    print(type(moment_lists))
+    return cycle_matrices
 
-    eq_loads, cycles, ampl_bin_mean, ampl_bin_edges = eq_load_and_cycles(moment_lists, no_bins=46, m=[5], neq=[ 10 ** 7], rainflow_func=rainflow_astm)
+def cycle_matrices_case_i(case, sector_idxs, max_ampls, no_bins = 46, rainflow_func = rainflowcount.rainflow_astm):
 
-    print(np.shape(eq_loads))
-    print('eq_loads', eq_loads)
+    bin_file, text_file, timeseries_length, cache_store, index, weight = case
+    moments = get_moment_time_series_case_i(bin_file, text_file, timeseries_length, cache_store, index)
 
-    with open('dem_all_dlcs.txt', 'a') as resfile:
-        resfile.write('Sector' + str((sector)) + str(eq_loads) + '\n')
+    cycle_matrices = []
+    for sector_idx, max_ampl in zip(sector_idxs, max_ampls):
+        cycle_mat = CycleMatrix(ampl_bin_edges(no_bins, max_ampl))
+        cycle_mat.add_signal(moments[sector_idx], weight, rainflow_func=rainflow_func)
+        cycle_matrices.append(cycle_mat)
 
-    return eq_loads
+    return cycle_matrices
 
-def calculate_eq_loads_multiprocessed():
-    
-    pool_args = [(sector, sectors, DLC_IDs, timeseries_lengths, cluster_ID) for  sector in sectors]
+def read_max_ampls(cycle_matrix_dir, cluster_ID, sectors):
+    # the largest amplitudes of an earlier run, from its saved cycle matrices, to skip the first pass of calculate_eq_loads_multiprocessed
+    return np.array([CycleMatrix.load(os.path.join(cycle_matrix_dir, f'cycle_matrix_{cluster_ID}_sector{sector}.npz')).max_ampl for sector in sectors])
 
-    # This corresponds to a for-loop over all cases
+def write_eq_loads(result_file, sectors, eq_loads, m, neq, rainflow_func):
+    """Writes the equivalent loads of all sectors to a csv file, with one row per sector, Wohler exponent and equivalent number
 
-    with Pool() as p:
+    Args:
+        result_file (str): path of the .csv file, overwritten if it exists
+        sectors (list): sectors in degrees
+        eq_loads (np.array): (n_sectors, n_neq, n_m) equivalent loads as returned by CycleMatrix.eq_loads for each sector
+        m (list): Wohler exponents
+        neq (list): equivalent numbers
 
-        results = p.starmap(calculate_eq_loads_case_i, pool_args)
+    Returns:
+        pd.DataFrame: the written table
+    """
+    rows = [dict(sector = sector, m = _m, neq = _neq, eq_load = eq_loads[sector_idx][neq_idx][m_idx], rainflow_func = rainflow_func.__name__)
+            for sector_idx, sector in enumerate(sectors) for neq_idx, _neq in enumerate(neq) for m_idx, _m in enumerate(m)]
+    df = pd.DataFrame(rows)
+    df.to_csv(result_file, index = False)
+    return df
 
-    return np.array(results) 
+def calculate_eq_loads_multiprocessed(sectors, DLC_IDs, timeseries_lengths, cluster_ID, fatigue_config_file, results_folder_for_cluster, cache_dir = None, result_file = 'dem_all_dlcs.csv',
+                                      m = [5], neq = [10 ** 7], rainflow_func = rainflowcount.rainflow_astm, no_bins = 46, max_ampls = None, cycle_matrix_dir = None,
+                                      no_fine_bins = 4096, cases_per_task = 50):
+
+    cases = read_case_list(DLC_IDs, timeseries_lengths, cluster_ID, fatigue_config_file, results_folder_for_cluster, cache_dir)
+
+    # get_moment_time_series_case_i projects onto the sectors 0, 15, ..., 345 degrees
+    sector_idxs = [list(range(0,359,15)).index(sector) for sector in sectors]
+
+    with Pool() as p:
+
+        if max_ampls is None:
+            # The cases are binned on fine edges in chunks, and the chunks are merged on the fine edges of the larger amplitude as they are returned
+            chunks = [cases[i:i + cases_per_task] for i in range(0, len(cases), cases_per_task)]
+            cycle_matrices = [CycleMatrix(fine_ampl_bin_edges(0, no_fine_bins)) for _ in sectors]
+            for chunk_i, cycle_matrices_chunk in enumerate(p.imap(partial(fine_cycle_matrices_cases, sector_idxs=sector_idxs, no_fine_bins=no_fine_bins, rainflow_func=rainflow_func), chunks)):
+                for i, cycle_mat_chunk in enumerate(cycle_matrices_chunk):
+                    cycle_matrices[i] = fit_fine_cycle_matrix(cycle_matrices[i], cycle_mat_chunk.max_ampl, no_fine_bins)
+                    cycle_matrices[i] += fit_fine_cycle_matrix(cycle_mat_chunk, cycle_matrices[i].max_ampl, no_fine_bins)
+                print(f'Case {min((chunk_i+1)*cases_per_task, len(cases))} / {len(cases)} merged')
+            cycle_matrices = [cycle_mat.rebin(ampl_bin_edges(no_bins, cycle_mat.max_ampl)) for cycle_mat in cycle_matrices]
+
+        else:
+            # The bin edges are known, so the partial cycle matrices of the cases are merged in the order of the cases, as they are returned
+            cycle_matrices = [CycleMatrix(ampl_bin_edges(no_bins, max_ampl)) for max_ampl in max_ampls]
+            for case_i, cycle_matrices_case in enumerate(p.imap(partial(cycle_matrices_case_i, sector_idxs=sector_idxs, max_ampls=max_ampls, no_bins=no_bins, rainflow_func=rainflow_func), cases)):
+                for cycle_mat, cycle_mat_case in zip(cycle_matrices, cycle_matrices_case):
+                    cycle_mat += cycle_mat_case
+                if (case_i + 1) % 500 == 0 or case_i + 1 == len(cases):
+                    print(f'Case {case_i+1} / {len(cases)} merged')
+
+    if cycle_matrix_dir is not None:
+        os.makedirs(cycle_matrix_dir, exist_ok=True)
+        for sector, cycle_mat in zip(sectors, cycle_matrices):
+            cycle_mat.save(os.path.join(cycle_matrix_dir, f'cycle_matrix_{cluster_ID}_sector{sector}.npz'))
+
+    results = [cycle_mat.eq_loads(m, neq) for cycle_mat in cycle_matrices]
+    _ = write_eq_loads(result_file, sectors, results, m, neq, rainflow_func)
+
+    return np.array(results)
 
 
 if __name__ == '__main__':
 
-    
+
     DLC_IDs = ['DLC12', 'DLC64a', 'DLC64b', 'DLC24a', 'DLC31', 'DLC41a', 'DLC41b'  ]
 
     timeseries_lengths = [1201, 1201, 1201, 1201, 1501, 201, 201]
     sectors = list((range(0,359,15)))
     cluster_ID = 'JLO'
 
-    calculate_eq_loads_multiprocessed()
+    path = r'C:\Users\IDH\OneDrive - Equinor\R&T Wind\RULe\SSE Doggerbank'
+    fatigue_config_file = path +  r'\Doc-0081164-HAL-X-13MW-DGB-A-OWF-Detailed DLC List-Fatigue Support Structure Load Assessment_Rev7.0.xlsx'
+    results_folder_for_cluster = path +  r'\Doc-0089427-HAL-X-13MW DB-A OWF-ILA3_JLO-model_fatigue_timeseries_all_elevations'
+    cache_dir = path + r'\simulation_cache' # converted stores from baseline_methods/convert_simulation_results.py, used if they match the result files
 
+    calculate_eq_loads_multiprocessed(sectors, DLC_IDs, timeseries_lengths, cluster_ID, fatigue_config_file, results_folder_for_cluster, cache_dir)
 
@@ -1,27 +1,45 @@
 import numpy as np
-import pandas as pd
-from read_simulation_file.read_simulation_file import read_bladed_file
+from read_simulation_file.read_simulation_file import read_bladed_channels, read_cached_channels
 import os
+# the DLC definitions are read from the DLC catalog and the converted stores are checked against the result files with the same functions as in baseline_methods
+from baseline_methods.utils.DLC_catalog import get_DLC_cases, resolve_simulation_files, PROBABILITY_COLUMN
+from baseline_methods.utils.simulation_cache import is_cache_store_valid
 
-def get_moment_time_series(DLC_ID, cluster_ID, fatigue_config_file, results_folder_for_cluster, time_series_length):
+def get_case_files(DLC_ID, cluster_ID, fatigue_config_file, results_folder_for_cluster):
 
-    df = pd.read_excel(fatigue_config_file, sheet_name=DLC_ID)
+    # all sheets of the workbook are parsed once and cached, see baseline_methods/utils/DLC_catalog.py
+    df = get_DLC_cases(fatigue_config_file, DLC_ID)
+    df = resolve_simulation_files(df, cluster_ID, results_folder_for_cluster)
 
-    df =  df.assign(filenames = df.apply(lambda x: x['simulation_name'].replace('XXX', cluster_ID), axis = 1))
-    df =  df.assign(results_files = df.apply(lambda x: os.path.join(results_folder_for_cluster +  x['path'], x['filenames']) + '.$105', axis = 1))
-    df =  df.assign(descr_files = df.apply(lambda x: os.path.join(results_folder_for_cluster +  x['path'], x['filenames']) + '.%105', axis = 1))
+    return df
 
-    probs = list(df.Tot_Prob_in_10_percent_idling_scenario_hr_year)
-    thetas = list(np.deg2rad(range(0,359,15)))
+def get_moment_time_series_case_i(bin_file, text_file, time_series_length, cache_store=None, index=None):
 
-    moments_all_cases = np.zeros((df.shape[0], len(thetas), time_series_length))
+    thetas = np.deg2rad(range(0,359,15))
+    sin_thetas, cos_thetas = np.sin(thetas)[:, None], np.cos(thetas)[:, None] # (n_sectors, 1) to project all sectors at once
 
-    for index, (bin_file, text_file) in enumerate(zip(df.results_files, df.descr_files)):
-        content_reshaped = read_bladed_file(bin_file, text_file)
+    moments = np.zeros((len(thetas), time_series_length))
+
+    # cache_store is a converted store of the DLC (see baseline_methods/convert_simulation_results.py), with cases in the same order as the DLC sheet
+    if cache_store is not None:
+        moment_x, moment_y = read_cached_channels(cache_store, index, [0, 1])
+    else:
+        moment_x, moment_y = read_bladed_channels(bin_file, text_file, [0, 1])
+    moments[:, :] = sin_thetas*moment_x+cos_thetas*moment_y # (n_sectors, n_timesteps) in one expression
+
+    return moments
+
+def get_moment_time_series(DLC_ID, cluster_ID, fatigue_config_file, results_folder_for_cluster, time_series_length, cache_store=None):
 
-        moment_x = content_reshaped[0,:]
-        moment_y = content_reshaped[1,:]
-        moments = [np.sin(theta)*moment_x+np.cos(theta)*moment_y for theta in thetas]
-        moments_all_cases[index, :, :] = moments
+    df = get_case_files(DLC_ID, cluster_ID, fatigue_config_file, results_folder_for_cluster)
+    if cache_store is not None and not is_cache_store_valid(cache_store, list(df.results_files)):
+        cache_store = None # stale or reordered store, the cases are read from the Bladed files
+
+    probs = list(df[PROBABILITY_COLUMN])
+
+    moments_all_cases = np.zeros((df.shape[0], len(range(0,359,15)), time_series_length))
+
+    for index, (bin_file, text_file) in enumerate(zip(df.results_files, df.descr_files)):
+        moments_all_cases[index, :, :] = get_moment_time_series_case_i(bin_file, text_file, time_series_length, cache_store, index)
 
-    return moments_all_cases, probs
\ No newline at end of file
+    return moments_all_cases, probs
@@ -3,8 +3,19 @@ Created on 13/10/2014
 
 @author: MMPE
 '''
+import numpy as np
 
-def bearing_damage(angle_moment_lst, m=3, thresshold=0.1):
+# If possible the numba compiled backend is used, otherwise the python implementation is used
+backends = ['python']
+try:
+    from wetb.fatigue_tools import bearing_damage_numba
+    backends.append('numba')
+    default_backend = 'numba'
+except ImportError:
+    default_backend = 'python'
+
+
+def bearing_damage(angle_moment_lst, m=3, thresshold=0.1, backend=None):
     """Function ported from Matlab.
 
     Parameters
@@ -15,12 +26,25 @@ def bearing_damage(angle_moment_lst, m=3, thresshold=0.1):
         analogue to Wohler exponent, should be 3
     threeshold : float, optional
         Pitch noise. Pitch movement below this thresshold is ignored
+    backend : {'python', 'numba'}, optional
+        Implementation to use. If None (default), the numba compiled implementation is used if numba is installed.
+        Both give identical results
 
     Returns
     -------
     max_damage : float
         A damage value of the most damaged pitch bearing. Only suitable for comparison
     """
+    if backend is None:
+        backend = default_backend
+    if backend not in backends:
+        raise ValueError("Bearing damage backend '%s' not available. Available backends are: %s" % (backend, backends))
+    if backend == 'numba':
+        # all blades in one call, as concatenated float arrays with the start index of each blade
+        angles, moments = [np.concatenate([np.asarray(v, dtype=np.float64).ravel() for v in values])
+                           for values in zip(*angle_moment_lst)]
+        starts = np.cumsum([0] + [len(angle) for angle, _ in angle_moment_lst])
+        return float(bearing_damage_numba.bearing_damages(angles, moments, starts, float(m), float(thresshold)).max())
 
     damages = []
     for angle, moment in angle_moment_lst:
@@ -39,4 +63,3 @@ def bearing_damage(angle_moment_lst, m=3, thresshold=0.1):
                 mflap += mo
         damages.append(damage)
     return max(damages)
-
@@ -0,0 +1,45 @@
+'''
+Numba compiled version of the pitch bearing damage routine
+
+The state machine of bearing_damage.bearing_damage is compiled just in time by numba and cached locally,
+so the compilation is only done at first use. The next threshold crossing depends on the angle at the previous
+crossing, so the crossings are found in one sequential pass, and the moments between two crossings are summed
+in the same order as in the python implementation, which gives identical damages.
+
+Importing this module raises ImportError if numba is not installed. Use the function through
+bearing_damage.bearing_damage, which selects this backend automatically when it is available and falls
+back to the python implementation otherwise.
+'''
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def bearing_damages(angles, moments, starts, m, thresshold):
+    """Damages of all blades in one call
+
+    angles, moments: 1-dimensional float arrays with the angles and moments of all blades after each other
+    starts: start index of each blade in angles and moments, followed by the total length
+    m: float exponent
+    thresshold: float, pitch movement below this thresshold is ignored
+    """
+    n_blades = starts.shape[0] - 1
+    damages = np.zeros(n_blades)
+    for blade in range(n_blades):
+        start = starts[blade]
+        k1 = 0
+        p1, mflap = angles[start], moments[start]
+        damage = 0.
+        for k in range(1, starts[blade + 1] - start):
+            pi = angles[start + k]
+            dangle = abs(pi - p1)
+            if dangle > thresshold:
+                damage += dangle * abs(mflap / (k - k1 + 1)) ** m
+                k1 = k
+                mflap = moments[start + k]
+                p1 = pi
+            else:
+                mflap += moments[start + k]
+        damages[blade] = damage
+    return damages
@@ -99,10 +99,68 @@ def eq_load_and_cycles(signals, no_bins=46, m=[3, 4, 6, 8, 10, 12], neq=[10 ** 6
     if 0:  #to be similar to windap
         ampl_bin_mean = (ampl_bin_edges[:-1] + ampl_bin_edges[1:]) / 2
     cycles, ampl_bin_mean = cycles.flatten(), ampl_bin_mean.flatten()
+    eq_loads = eq_loads_from_cycles(25* cycles, ampl_bin_mean, m, neq).tolist()
+    return eq_loads, cycles, ampl_bin_mean, ampl_bin_edges
+
+
+def damage_sums(cycles, ampl_bin_mean, m):
+    """Damage sums of binned cycles for several Wohler exponents at once
+
+    The damage sum of each exponent is sum(cycles * ampl_bin_mean ** m), where the sum is over the bins (last axis).
+    Bins without cycles (nan mean amplitude) are ignored.
+
+    Parameters
+    ----------
+    cycles : array_like, shape(..., no_bins)
+        Number of cycles in each bin, e.g. of several sectors and cases
+    ampl_bin_mean : array_like, shape(..., no_bins)
+        Mean amplitude of the bins, broadcastable with cycles
+    m : int, float or array-like
+        Wohler exponent(s)
+
+    Returns
+    -------
+    sums : ndarray, shape(..., len(m))
+        Damage sums of each set of binned cycles for the Wohler exponents
+    """
+    m = np.atleast_1d(np.asarray(m, dtype=np.float64))
+    cycles, ampl_bin_mean = np.broadcast_arrays(np.asarray(cycles, dtype=np.float64), np.asarray(ampl_bin_mean, dtype=np.float64))
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        eq_loads = [[((np.nansum(25* cycles * ampl_bin_mean ** _m) / _neq) ** (1. / _m)) for _m in np.atleast_1d(m)]  for _neq in np.atleast_1d(neq)]
-    return eq_loads, cycles, ampl_bin_mean, ampl_bin_edges
+        # all exponents in one pass over the bins
+        return np.nansum(cycles[..., None, :] * ampl_bin_mean[..., None, :] ** m[:, None], axis=-1)
+
+
+def eq_loads_from_cycles(cycles, ampl_bin_mean, m, neq):
+    """Equivalent loads of binned cycles for several Wohler exponents and equivalent numbers at once
+
+    The equivalent load of each combination is (damage_sum / neq) ** (1 / m), see damage_sums.
+
+    Parameters
+    ----------
+    cycles : array_like, shape(..., no_bins)
+        Number of cycles in each bin, e.g. of several sectors and cases
+    ampl_bin_mean : array_like, shape(..., no_bins)
+        Mean amplitude of the bins, broadcastable with cycles
+    m : int, float or array-like
+        Wohler exponent(s)
+    neq : int, float or array-like
+        Equivalent number(s) of load cycles
+
+    Returns
+    -------
+    eq_loads : ndarray, shape(..., len(neq), len(m))
+        Equivalent loads of each set of binned cycles for the corresponding equivalent number(s) and Wohler exponents
+
+    Examples
+    --------
+    >>> cycles, ampl_bin_mean = eq_load_and_cycles(signal, no_bins=46)[1:3]
+    >>> eq_loads_from_cycles(cycles, ampl_bin_mean, m=[3, 4, 5], neq=[10 ** 6, 10 ** 7])  # shape (2, 3)
+    """
+    m = np.atleast_1d(np.asarray(m, dtype=np.float64))
+    neq = np.atleast_1d(np.asarray(neq, dtype=np.float64))
+    sums = damage_sums(cycles, ampl_bin_mean, m)
+    return (sums[..., None, :] / neq[:, None]) ** (1. / m)
 
 
 def cycle_matrix(signals, ampl_bins=10, mean_bins=10, rainflow_func=rainflow_windap):
@@ -146,21 +204,322 @@ def cycle_matrix(signals, ampl_bins=10, mean_bins=10, rainflow_func=rainflow_win
     """
 
     if isinstance(signals[0], tuple):
-        weights, ampls, means = np.array([(np.zeros_like(ampl)+weight,ampl,mean) for weight, signal in signals for ampl, mean in rainflow_func(signal[:]).T], dtype=np.float64).T
+        weighted_cycles = [(weight, np.asarray(rainflow_func(signal[:]), dtype=np.float64)) for weight, signal in signals]
     else:
-        ampls, means = rainflow_func(signals[:])
-        weights = np.ones_like(ampls)
+        weighted_cycles = [(1., np.asarray(rainflow_func(signals[:]), dtype=np.float64))]
+
+    # The bin edges given as numbers of bins depend on all cycles, so all signals are counted before the cycles are binned
     if isinstance(ampl_bins, int):
-        ampl_bins = np.linspace(0, 1, num=ampl_bins + 1) * ampls[weights>0].max()
-    cycles, ampl_edges, mean_edges = np.histogram2d(ampls, means, [ampl_bins, mean_bins], weights=weights)
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        ampl_bin_sum = np.histogram2d(ampls, means, [ampl_bins, mean_bins], weights=weights * ampls)[0]
-        ampl_bin_mean = np.nanmean(ampl_bin_sum / np.where(cycles,cycles,np.nan),1)
-        mean_bin_sum = np.histogram2d(ampls, means, [ampl_bins, mean_bins], weights=weights * means)[0]
-        mean_bin_mean = np.nanmean(mean_bin_sum / np.where(cycles, cycles, np.nan), 1)
-    cycles = cycles / 2  # to get full cycles
-    return cycles, ampl_bin_mean, ampl_edges, mean_bin_mean, mean_edges
+        ampl_bins = ampl_bin_edges(ampl_bins, np.max([ampl_mean[0].max() for weight, ampl_mean in weighted_cycles if weight > 0 and ampl_mean.shape[1]]))
+    if isinstance(mean_bins, int):
+        mean_bins = np.histogram_bin_edges(np.concatenate([ampl_mean[1] for _, ampl_mean in weighted_cycles]), mean_bins)
+
+    cycle_mat = CycleMatrix(ampl_bins, mean_bins)
+    for weight, (ampls, means) in weighted_cycles:
+        cycle_mat.add_cycles(ampls, means, weight)
+    return cycle_mat.cycle_matrix()
+
+
+def ampl_bin_edges(no_bins, max_ampl):
+    """Amplitude bin edges from 0 to max_ampl, as used by cycle_matrix if ampl_bins is an int
+
+    Parameters
+    ----------
+    no_bins : int
+        Number of amplitude bins
+    max_ampl : float
+        Upper edge of the last bin, normally the largest amplitude of all signals
+
+    Returns
+    -------
+    ampl_edges : ndarray, shape(no_bins+1,)
+        The amplitude bin edges
+    """
+    return np.linspace(0, 1, num=no_bins + 1) * max_ampl
+
+
+def fine_ampl_bin_edges(max_ampl, no_bins=4096):
+    """Fine amplitude bin edges from 0 to at least max_ampl, with a power of two as bin width
+
+    The grids of different maximum amplitudes are nested, i.e. the edges of a larger max_ampl
+    are every 2**k-th edge of a smaller max_ampl, so a matrix binned on the edges of one signal
+    can be moved to the edges of a larger amplitude with CycleMatrix.rebin without error. This
+    allows to count and bin each signal once, before the largest amplitude of all signals is
+    known, and to rebin the merged matrix to ampl_bin_edges at the end.
+
+    Parameters
+    ----------
+    max_ampl : float
+        Largest amplitude to cover
+    no_bins : int, optional
+        Number of amplitude bins (default is 4096)
+
+    Returns
+    -------
+    ampl_edges : ndarray, shape(no_bins+1,)
+        The amplitude bin edges, 0, h, 2h, ..., no_bins*h with h = 2**k >= max_ampl / no_bins
+    """
+    bin_width = np.ldexp(1., np.frexp(max_ampl / no_bins)[1])
+    return np.arange(no_bins + 1) * bin_width
+
+
+class CycleMatrix(object):
+    """Weighted Markow load cycle matrix accumulated one signal (or one set of cycles) at a time
+
+    The amplitude (and mean) bin edges are fixed when the matrix is created, so the cycles of
+    each signal are binned as soon as they are counted, and only the bin accumulators are kept
+    in memory. Adding the cycles of all signals gives the same result as cycle_matrix with the
+    same bin edges, as the bins are accumulated in the order the cycles are added, like
+    np.histogram2d.
+
+    Matrices with the same bin edges can also be calculated separately, e.g. one per case in
+    worker processes, and merged with `+` (equal to adding all cycles to one matrix, except for
+    rounding). They are serialized with to_dict / from_dict or save / load, and the equivalent
+    loads of the merged matrix are calculated with eq_loads.
+
+    Parameters
+    ----------
+    ampl_bins : array-like
+        The amplitude bin edges, e.g. from ampl_bin_edges. Cycles outside the edges are ignored
+    mean_bins : array-like or None, optional
+        The mean bin edges. If None (default), all cycles are in one mean bin, with edges from
+        the smallest to the largest mean of the added cycles (as cycle_matrix with mean_bins=1)
+
+    Examples
+    --------
+    >>> cycle_mat = CycleMatrix(ampl_bin_edges(46, max_ampl))
+    >>> for weight, signal in signals:
+    ...     cycle_mat.add_signal(signal, weight, rainflow_func=rainflow_astm)
+    >>> cycles, ampl_bin_mean, ampl_edges, mean_bin_mean, mean_edges = cycle_mat.cycle_matrix()
+    >>> total = sum(pool.map(cycle_matrix_of_case, cases), CycleMatrix(ampl_bin_edges(46, max_ampl)))
+    >>> total.eq_loads(m=[3, 4, 5], neq=[10 ** 7])
+    """
+
+    def __init__(self, ampl_bins, mean_bins=None):
+        self.ampl_edges = np.asarray(ampl_bins, dtype=np.float64)
+        self.mean_edges = None if mean_bins is None else np.asarray(mean_bins, dtype=np.float64)
+        # weights, weights * amplitudes and weights * means of the bins, with an outlier bin at each side as in np.histogram2d
+        n_mean = 1 if self.mean_edges is None else len(self.mean_edges) - 1
+        self.shape = (len(self.ampl_edges) + 1, n_mean + 2)
+        self.bin_sums = np.zeros((3,) + self.shape)
+        self.mean_min, self.mean_max = np.inf, -np.inf
+        self.max_ampl = 0.  # largest amplitude of the cycles with positive weight, also if above the last edge
+
+    def _bin_index(self, values, edges):
+        # bin of each value as in np.histogramdd, i.e. values equal to the last edge are in the last bin
+        idx = np.searchsorted(edges, values, side='right')
+        idx[values == edges[-1]] -= 1
+        return idx
+
+    def add_cycles(self, ampls, means, weight=1.):
+        """Adds half cycles to the matrix
+
+        Parameters
+        ----------
+        ampls : array_like
+            Amplitudes of the half cycles, e.g. from rainflow_windap or rainflow_astm
+        means : array_like
+            Mean values of the half cycles
+        weight : float or array_like, optional
+            Weight of the cycles, or of each cycle (default is 1)
+        """
+        ampls = np.asarray(ampls, dtype=np.float64).ravel()
+        means = np.asarray(means, dtype=np.float64).ravel()
+        weights = np.zeros_like(ampls) + weight
+        if len(ampls) == 0:
+            return
+        if np.any(weights > 0):
+            self.max_ampl = max(self.max_ampl, ampls[weights > 0].max())
+
+        if self.mean_edges is None:
+            self.mean_min, self.mean_max = min(self.mean_min, means.min()), max(self.mean_max, means.max())
+            mean_idx = np.ones(len(means), dtype=np.intp)
+        else:
+            mean_idx = self._bin_index(means, self.mean_edges)
+        bin_idx = self._bin_index(ampls, self.ampl_edges) * self.shape[1] + mean_idx
+
+        # One binning pass of the three quantities. The current sums are counted first, so the cycles
+        # are added to them in order, giving the same sums as binning the cycles of all signals at once
+        n = np.prod(self.shape)
+        idx = np.concatenate([np.arange(3 * n)] + [bin_idx + i * n for i in range(3)])
+        self.bin_sums = np.bincount(idx, np.concatenate((self.bin_sums.ravel(), weights, weights * ampls, weights * means)),
+                                    minlength=3 * n).reshape(self.bin_sums.shape)
+
+    def add_signal(self, signal, weight=1., rainflow_func=rainflow_windap):
+        """Counts the half cycles of a signal and adds them to the matrix
+
+        Parameters
+        ----------
+        signal : array-like
+            The raw signal
+        weight : float, optional
+            Weight of the signal (default is 1)
+        rainflow_func : {rainflow_windap, rainflow_astm}, optional
+            The rainflow counting function to use (default is rainflow_windap)
+        """
+        ampls, means = rainflow_func(signal[:])
+        self.add_cycles(ampls, means, weight)
+
+    def _check_bins(self, other):
+        if not (np.array_equal(self.ampl_edges, other.ampl_edges) and
+                (self.mean_edges is None) == (other.mean_edges is None) and
+                (self.mean_edges is None or np.array_equal(self.mean_edges, other.mean_edges))):
+            raise ValueError("Cycle matrices with different bin edges cannot be merged")
+
+    def merge(self, other):
+        """Adds the cycles of another cycle matrix with the same bin edges to this matrix
+
+        Parameters
+        ----------
+        other : CycleMatrix
+            Cycle matrix with the same bin edges
+
+        Returns
+        -------
+        self : CycleMatrix
+        """
+        self._check_bins(other)
+        self.bin_sums = self.bin_sums + other.bin_sums
+        self.mean_min, self.mean_max = min(self.mean_min, other.mean_min), max(self.mean_max, other.mean_max)
+        self.max_ampl = max(self.max_ampl, other.max_ampl)
+        return self
+
+    def rebin(self, ampl_bins):
+        """Cycle matrix with other amplitude bin edges, from the bins of this matrix
+
+        Each bin is moved as a whole to the new bin of the weighted mean amplitude of its
+        cycles. This gives the same matrix as adding the cycles with the new edges if every new
+        edge is also an edge of this matrix (e.g. from fine_ampl_bin_edges of a larger
+        amplitude). Otherwise, the cycles of a bin across a new edge all end up on one side of
+        it, so the error is limited to the cycles within one bin width of the new edges.
+
+        Parameters
+        ----------
+        ampl_bins : array-like
+            The new amplitude bin edges
+
+        Returns
+        -------
+        cycle_mat : CycleMatrix
+            New matrix with the same mean bins
+        """
+        cycle_mat = CycleMatrix(ampl_bins, self.mean_edges)
+        weights, ampl_sums = self.bin_sums[:2, 1:-1]
+        # the mean amplitude is kept inside its bin and below the largest amplitude, so rounding cannot move a bin across a
+        # shared edge or above the last edge of ampl_bin_edges(no_bins, max_ampl)
+        lower = self.ampl_edges[:-1, np.newaxis]
+        upper = np.append(np.nextafter(self.ampl_edges[1:-1], -np.inf), self.ampl_edges[-1])[:, np.newaxis]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ampl_means = np.clip(np.where(weights > 0, np.minimum(ampl_sums / weights, self.max_ampl), lower), lower, upper)
+        ampl_idx = cycle_mat._bin_index(ampl_means.ravel(), cycle_mat.ampl_edges).reshape(ampl_means.shape)
+
+        # the outlier bins stay outlier bins
+        n_ampl, n_mean = cycle_mat.shape
+        ampl_idx = np.vstack([np.zeros((1, ampl_idx.shape[1]), dtype=np.intp), ampl_idx,
+                              np.full((1, ampl_idx.shape[1]), n_ampl - 1, dtype=np.intp)])
+        bin_idx = (ampl_idx * n_mean + np.arange(n_mean)).ravel()
+        cycle_mat.bin_sums = np.array([np.bincount(bin_idx, bin_sums.ravel(), minlength=n_ampl * n_mean).reshape(cycle_mat.shape)
+                                       for bin_sums in self.bin_sums])
+        cycle_mat.mean_min, cycle_mat.mean_max, cycle_mat.max_ampl = self.mean_min, self.mean_max, self.max_ampl
+        return cycle_mat
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def copy(self):
+        return CycleMatrix.from_dict(self.to_dict())
+
+    def to_dict(self):
+        """The state of the matrix as a dict of numpy arrays and floats, see from_dict"""
+        return dict(ampl_edges=self.ampl_edges.copy(),
+                    mean_edges=None if self.mean_edges is None else self.mean_edges.copy(),
+                    bin_sums=self.bin_sums.copy(),
+                    mean_min=float(self.mean_min), mean_max=float(self.mean_max), max_ampl=float(self.max_ampl))
+
+    @classmethod
+    def from_dict(cls, state):
+        """Cycle matrix from the state returned by to_dict"""
+        cycle_mat = cls(state['ampl_edges'], state['mean_edges'])
+        if cycle_mat.bin_sums.shape != np.shape(state['bin_sums']):
+            raise ValueError("Shape of bin_sums %s does not fit the bin edges" % (np.shape(state['bin_sums']),))
+        cycle_mat.bin_sums = np.array(state['bin_sums'], dtype=np.float64)
+        cycle_mat.mean_min, cycle_mat.mean_max, cycle_mat.max_ampl = state['mean_min'], state['mean_max'], state['max_ampl']
+        return cycle_mat
+
+    def save(self, filename):
+        """Saves the matrix to a .npz file, see load"""
+        state = self.to_dict()
+        if state['mean_edges'] is None:
+            del state['mean_edges']
+        np.savez(filename, **state)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a matrix saved with save"""
+        with np.load(filename) as npz:
+            state = {key: npz[key] for key in npz.files}
+        state.setdefault('mean_edges', None)
+        for key in ['mean_min', 'mean_max', 'max_ampl']:
+            state[key] = float(state[key])
+        return cls.from_dict(state)
+
+    def eq_loads(self, m=[3, 4, 6, 8, 10, 12], neq=[10 ** 6, 10 ** 7, 10 ** 8]):
+        """Equivalent loads of the cycles in the matrix, as calculated by eq_load_and_cycles
+
+        The cycles of all mean bins are combined. Cycles with amplitudes above the last amplitude
+        edge are not included, which gives a warning
+
+        Parameters
+        ----------
+        m : int, float or array-like, optional
+            Wohler exponent (default is [3, 4, 6, 8, 10, 12])
+        neq : int or array-like, optional
+            Equivalent number, default is [10^6, 10^7, 10^8]
+
+        Returns
+        -------
+        eq_loads : array-like
+            List of lists of equivalent loads for the corresponding equivalent number(s) and Wohler exponents
+        """
+        if self.max_ampl > self.ampl_edges[-1]:
+            warnings.warn("Cycles with amplitudes up to %g are above the last amplitude bin edge %g and are ignored" % (self.max_ampl, self.ampl_edges[-1]))
+        cycles, ampl_bin_sum = self.bin_sums[:2, 1:-1, 1:-1]
+        if cycles.shape[1] > 1:
+            cycles, ampl_bin_sum = cycles.sum(1, keepdims=True), ampl_bin_sum.sum(1, keepdims=True)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            ampl_bin_mean = np.nanmean(ampl_bin_sum / np.where(cycles, cycles, np.nan), 1)
+        return eq_loads_from_cycles(25* (cycles / 2).flatten(), ampl_bin_mean.flatten(), m, neq).tolist()
+
+    def cycle_matrix(self):
+        """The cycle matrix of the added cycles, see cycle_matrix
+
+        Returns
+        -------
+        cycles : ndarray, shape(ampl_bins, mean_bins)
+            A bi-dimensional histogram of load cycles(full cycles)
+        ampl_bin_mean : ndarray, shape(ampl_bins,)
+            The average cycle amplitude of the bins
+        ampl_edges : ndarray, shape(ampl_bins+1,)
+            The amplitude bin edges
+        mean_bin_mean : ndarray, shape(ampl_bins,)
+            The average cycle mean of the bins
+        mean_edges : ndarray, shape(mean_bins+1,)
+            The mean bin edges
+        """
+        cycles, ampl_bin_sum, mean_bin_sum = self.bin_sums[:, 1:-1, 1:-1]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            ampl_bin_mean = np.nanmean(ampl_bin_sum / np.where(cycles, cycles, np.nan), 1)
+            mean_bin_mean = np.nanmean(mean_bin_sum / np.where(cycles, cycles, np.nan), 1)
+        mean_edges = self.mean_edges
+        if mean_edges is None:
+            mean_min, mean_max = (self.mean_min - .5, self.mean_max + .5) if self.mean_min == self.mean_max else (self.mean_min, self.mean_max)
+            mean_edges = np.array([mean_min, mean_max])
+        return cycles / 2, ampl_bin_mean, self.ampl_edges.copy(), mean_bin_mean, mean_edges  # full cycles
 
     
 def cycle_matrix2(signal, nrb_amp, nrb_mean, rainflow_func=rainflow_windap):
@@ -1,6 +1,33 @@
 import numpy as np
 from wetb.fatigue_tools.rainflowcounting import peak_trough
 from wetb.fatigue_tools.rainflowcounting import pair_range
+from wetb.fatigue_tools.rainflowcounting import rainflowcount_astm
+
+# Implementations of the counting routines. If possible the numba compiled backend is used,
+# otherwise the python implementation is used
+backends = {'python': {'peak_trough': peak_trough.peak_trough,
+                       'pair_range_amplitude_mean': pair_range.pair_range_amplitude_mean,
+                       'find_extremes': rainflowcount_astm.find_extremes,
+                       'rainflowcount': rainflowcount_astm.rainflowcount}}
+try:
+    from wetb.fatigue_tools.rainflowcounting import rainflowcount_numba
+    backends['numba'] = {'peak_trough': rainflowcount_numba.peak_trough,
+                         'pair_range_amplitude_mean': rainflowcount_numba.pair_range_amplitude_mean,
+                         'find_extremes': rainflowcount_numba.find_extremes,
+                         'rainflowcount': rainflowcount_numba.rainflowcount}
+    default_backend = 'numba'
+except ImportError:
+    default_backend = 'python'
+
+
+def get_backend(backend=None):
+    """Returns dict of the counting routines of <backend> ('python' or 'numba').
+    If <backend> is None, the numba backend is used if numba is installed"""
+    if backend is None:
+        backend = default_backend
+    if backend not in backends:
+        raise ValueError("Rainflow counting backend '%s' not available. Available backends are: %s" % (backend, list(backends)))
+    return backends[backend]
 
 
 def check_signal(signal):
@@ -18,7 +45,7 @@ def check_signal(signal):
         raise TypeError("Signal contains no variation")
 
 
-def rainflow_windap(signal, levels=255., thresshold=(255 / 50)):
+def rainflow_windap(signal, levels=255., thresshold=(255 / 50), backend=None):
     """Windap equivalent rainflow counting
 
 
@@ -40,6 +67,10 @@ def rainflow_windap(signal, levels=255., thresshold=(255 / 50)):
         Cycles smaller than this thresshold are ignored
         255/50 is equivalent to the implementation in Windap
 
+    backend : {None, 'python', 'numba'}, optional
+        Implementation of the counting routines. If None (default), the numba
+        compiled backend is used if numba is installed
+
     Returns
     -------
     ampl : array-like
@@ -64,18 +95,17 @@ def rainflow_windap(signal, levels=255., thresshold=(255 / 50)):
     if np.nanmax(signal) > 0:
         gain = np.nanmax(signal) / levels
         signal = signal / gain
-        signal = np.round(signal).astype(np.int)
-
-
-        # If possible the module is compiled using cython otherwise the python implementation is used
+        signal = np.round(signal).astype(int)
 
+        # If possible the numba compiled backend is used otherwise the python implementation is used
+        routines = get_backend(backend)
 
         # Convert to list of local minima/maxima where difference > thresshold
-        sig_ext = peak_trough.peak_trough(signal, thresshold)
+        sig_ext = routines['peak_trough'](signal, thresshold)
 
 
         # rainflow count
-        ampl_mean = pair_range.pair_range_amplitude_mean(sig_ext)
+        ampl_mean = routines['pair_range_amplitude_mean'](sig_ext)
 
         ampl_mean = np.array(ampl_mean)
         ampl_mean = np.round(ampl_mean / thresshold) * gain * thresshold
@@ -84,7 +114,7 @@ def rainflow_windap(signal, levels=255., thresshold=(255 / 50)):
 
 
 
-def rainflow_astm(signal):
+def rainflow_astm(signal, backend=None):
     """Matlab equivalent rainflow counting
 
     Calculate the amplitude and mean values of half cycles in signal
@@ -97,6 +127,10 @@ def rainflow_astm(signal):
     Signal : array-like
         The raw signal
 
+    backend : {None, 'python', 'numba'}, optional
+        Implementation of the counting routines. If None (default), the numba
+        compiled backend is used if numba is installed
+
     Returns
     -------
     ampl : array-like
@@ -117,15 +151,14 @@ def rainflow_astm(signal):
     # type <double> is reuqired by <find_extreme> and <rainflow>
     signal = signal.astype(np.double)
 
-    # Import find extremes and rainflow.
-    # If possible the module is compiled using cython otherwise the python implementation is used
-
-    from wetb.fatigue_tools.rainflowcounting.rainflowcount_astm import find_extremes, rainflowcount
+    # Find extremes and rainflow.
+    # If possible the numba compiled backend is used otherwise the python implementation is used
+    routines = get_backend(backend)
 
     # Remove points which is not local minimum/maximum
-    sig_ext = find_extremes(signal)
+    sig_ext = routines['find_extremes'](signal)
 
     # rainflow count
-    ampl_mean = np.array(rainflowcount(sig_ext))
+    ampl_mean = np.array(routines['rainflowcount'](sig_ext))
 
     return np.array(ampl_mean).T
@@ -0,0 +1,248 @@
+'''
+Numba compiled versions of the rainflow counting routines
+
+The functions are line by line ports of the Cython compilable Python implementations in
+peak_trough.py, pair_range.py and rainflowcount_astm.py, compiled just in time by numba
+and cached locally, so the compilation is only done at first use.
+
+Importing this module raises ImportError if numba is not installed. Use the functions through
+rainflowcount.rainflow_windap and rainflowcount.rainflow_astm, which select this backend
+automatically when it is available and fall back to the Python implementations otherwise.
+
+Differences to the Python implementations:
+- pair_range_amplitude_mean and rainflowcount return (n, 2) arrays of (amplitude, mean) instead of lists of tuples
+'''
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def peak_trough(x, R):
+    """
+    Returns list of local maxima/minima.
+
+    x: 1-dimensional numpy array containing signal
+    R: Thresshold (minimum difference between succeeding min and max
+
+    This routine is implemented directly as described in
+    "Recommended Practices for Wind Turbine Testing - 3. Fatigue Loads", 2. edition 1990, Appendix A
+    """
+    BEGIN = 0
+    MINZO = 1
+    MAXZO = 2
+    ENDZO = 3
+    S = np.zeros(x.shape[0] + 1, dtype=np.int64)
+
+    L = x.shape[0]
+    goto = BEGIN
+
+    trough = x[0]
+    peak = x[0]
+    i = 0
+    p = 1
+    f = 0
+    while True:
+        if goto == BEGIN:
+            while goto == BEGIN:
+                i += 1
+                if i == L:
+                    goto = ENDZO
+                else:
+                    if x[i] > peak:
+                        peak = x[i]
+                        if peak - trough >= R:
+                            S[p] = trough
+                            goto = MAXZO
+                    elif x[i] < trough:
+                        trough = x[i]
+                        if peak - trough >= R:
+                            S[p] = peak
+                            goto = MINZO
+
+        elif goto == MINZO:
+            f = -1
+            while goto == MINZO:
+                i += 1
+                if i == L:
+                    goto = ENDZO
+                else:
+                    if x[i] < trough:
+                        trough = x[i]
+                    else:
+                        if x[i] - trough >= R:
+                            p += 1
+                            S[p] = trough
+                            peak = x[i]
+                            goto = MAXZO
+
+        elif goto == MAXZO:
+            f = 1
+            while goto == MAXZO:
+                i += 1
+                if i == L:
+                    goto = ENDZO
+                else:
+                    if x[i] > peak:
+                        peak = x[i]
+                    else:
+                        if peak - x[i] >= R:
+                            p += 1
+                            S[p] = peak
+                            trough = x[i]
+                            goto = MINZO
+
+        else:  # ENDZO
+            n = p + 1
+            if f == 1:
+                S[n] = peak
+            elif f == -1:
+                S[n] = trough
+            else:
+                S[n] = int((trough + peak) / 2)  # truncated like the assignment into the integer array of the Python version
+            return S[1:n + 1]
+
+
+@njit(cache=True)
+def pair_range_amplitude_mean(x):
+    """
+    Returns a (n, 2) array of half-cycle (amplitude, mean)
+    x: Peak-Trough sequence (integer list of local minima and maxima)
+
+    This routine is implemented according to
+    "Recommended Practices for Wind Turbine Testing - 3. Fatigue Loads", 2. edition 1990, Appendix A
+    except that a list of half-cycle-amplitudes are returned instead of a from_level-to_level-matrix
+    """
+    x = x - np.min(x)
+    n = x.shape[0]
+    S = np.zeros(n + 1)
+    ampl_mean = np.zeros((2 * n, 2))  # each point gives at most two half cycles
+    m = 0
+    S[1] = x[0]
+    ptr = 1
+    p = 1
+    q = 1
+    f = 0
+    # phase 1
+    while True:
+        p += 1
+        q += 1
+
+        # read
+        S[p] = x[ptr]
+        ptr += 1
+
+        if q == n:
+            f = 1
+        while p >= 4:
+            if (S[p - 2] > S[p - 3] and S[p - 1] >= S[p - 3] and S[p] >= S[p - 2]) \
+                    or \
+                    (S[p - 2] < S[p - 3] and S[p - 1] <= S[p - 3] and S[p] <= S[p - 2]):
+                # Extract two intermediate half cycles
+                ampl = abs(S[p - 2] - S[p - 1])
+                mean = (S[p - 2] + S[p - 1]) / 2
+                ampl_mean[m, 0] = ampl
+                ampl_mean[m, 1] = mean
+                ampl_mean[m + 1, 0] = ampl
+                ampl_mean[m + 1, 1] = mean
+                m += 2
+
+                S[p - 2] = S[p]
+
+                p -= 2
+            else:
+                break
+
+        if f == 1:
+            break
+    # phase 2
+    q = 0
+    while True:
+        q += 1
+        if p == q:
+            break
+        else:
+            ampl_mean[m, 0] = abs(S[q + 1] - S[q])
+            ampl_mean[m, 1] = (S[q + 1] + S[q]) / 2
+            m += 1
+    return ampl_mean[:m]
+
+
+@njit(cache=True)
+def find_extremes(signal):
+    """return local minima and maxima plus first and last element of signal"""
+    n = signal.shape[0]
+    # sign of gradient
+    sign_grad = np.sign(signal[1:] - signal[:-1]).astype(np.int8)
+
+    # remove plateaus(sign_grad==0) by sign_grad[plateau_index]=sign_grad[plateau_index-1]
+    if sign_grad[0] == 0:
+        # first element is a plateau
+        i = 0
+        while i < n - 1 and sign_grad[i] == 0:
+            i += 1
+        if i == n - 1:
+            # All values are equal to crossing level!
+            return np.zeros(1)
+        # set first element = first element which is not a plateau
+        sign_grad[0] = sign_grad[i]
+
+    for i in range(1, n - 1):
+        if sign_grad[i] == 0:
+            sign_grad[i] = sign_grad[i - 1]
+
+    extremes = np.empty(n)
+    extremes[0] = signal[0]
+    m = 1
+    for i in range(1, n - 1):
+        if sign_grad[i] * sign_grad[i - 1] < 0:
+            extremes[m] = signal[i]
+            m += 1
+    extremes[m] = signal[n - 1]
+    return extremes[:m + 1]
+
+
+@njit(cache=True)
+def rainflowcount(sig):
+    """Compiled rain ampl_mean count without time analysis
+
+    This implemementation is based on the c-implementation by Adam Nieslony found at
+    the MATLAB Central File Exchange http://www.mathworks.com/matlabcentral/fileexchange/3026
+
+    Returns a (n, 2) array of half cycle (peak to peak amplitude, mean)
+    """
+    n = sig.shape[0]
+    a = np.zeros(n)  # stack of points, a[first:top]
+    first = 0
+    top = 0
+    ampl_mean = np.zeros((2 * n, 2))
+    m = 0
+    for sig_ptr in range(n):
+        a[top] = sig[sig_ptr]
+        top += 1
+        while top - first > 2 and abs(a[top - 3] - a[top - 2]) <= abs(a[top - 2] - a[top - 1]):
+            ampl = abs(a[top - 3] - a[top - 2])
+            mean = (a[top - 3] + a[top - 2]) / 2
+            if top - first == 3:
+                first += 1
+                if ampl > 0:
+                    ampl_mean[m, 0] = ampl
+                    ampl_mean[m, 1] = mean
+                    m += 1
+            else:
+                a[top - 3] = a[top - 1]
+                top -= 2
+                if ampl > 0:
+                    ampl_mean[m, 0] = ampl
+                    ampl_mean[m, 1] = mean
+                    ampl_mean[m + 1, 0] = ampl
+                    ampl_mean[m + 1, 1] = mean
+                    m += 2
+    for index in range(first, top - 1):
+        ampl = abs(a[index] - a[index + 1])
+        mean = (a[index] + a[index + 1]) / 2
+        if ampl > 0:
+            ampl_mean[m, 0] = ampl
+            ampl_mean[m, 1] = mean
+            m += 1
+    return ampl_mean[:m]
@@ -10,6 +10,7 @@ import unittest
 
 import numpy as np
 from wetb.hawc2 import Hawc2io
+from wetb.fatigue_tools import bearing_damage as bearing_damage_module
 from wetb.fatigue_tools.bearing_damage import bearing_damage
 import os
 
@@ -23,6 +24,8 @@ class TestBearingDamage(unittest.TestCase):
     def test_bearing_damage_swp(self):
         data = Hawc2io.ReadHawc2(self.tfp + "test_bearing_damage").ReadBinary((np.array([1, 4, 2, 5, 3, 6]) ).tolist())
         self.assertAlmostEqual(bearing_damage([(data[:, i], data[:, i + 1]) for i in [0,2,4]]), 7.755595081475002e+13)
+        for backend in bearing_damage_module.backends:
+            self.assertEqual(bearing_damage([(data[:, i], data[:, i + 1]) for i in [0,2,4]], backend=backend), 7.755595081475002e+13)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+'''
+Parity tests of the numba compiled bearing damage against the python implementation
+'''
+import unittest
+
+import numpy as np
+from wetb.fatigue_tools import bearing_damage as bearing_damage_module
+from wetb.fatigue_tools.bearing_damage import bearing_damage
+
+
+def angle_moment_lsts(n=20):
+    """Blades of different lengths, with pitch steps around the thresshold"""
+    rng = np.random.default_rng(1)
+    for _ in range(n):
+        yield [(np.cumsum(rng.standard_normal(length) * rng.uniform(0.01, 0.3)), rng.standard_normal(length) * 1e3 + 5e3)
+               for length in rng.integers(2, 3000, 3)]
+
+
+class TestBearingDamageBackends(unittest.TestCase):
+
+    @unittest.skipIf('numba' not in bearing_damage_module.backends, "numba not installed")
+    def test_numba_equals_python(self):
+        for angle_moment_lst in angle_moment_lsts():
+            for m, thresshold in [(3, 0.1), (5, 0.05), (2.5, 0)]:
+                self.assertEqual(bearing_damage(angle_moment_lst, m, thresshold, backend='numba'),
+                                 bearing_damage(angle_moment_lst, m, thresshold, backend='python'))
+
+    def test_unknown_backend(self):
+        angle_moment_lst = next(angle_moment_lsts(1))
+        self.assertRaises(ValueError, bearing_damage, angle_moment_lst, backend='cython')
+
+
+if __name__ == "__main__":
+    unittest.main()
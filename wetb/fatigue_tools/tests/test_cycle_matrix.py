@@ -0,0 +1,140 @@
+'''
+Tests of the streaming weighted cycle matrix against np.histogram2d of all cycles at once
+'''
+import unittest
+import warnings
+
+import numpy as np
+import os
+import pickle
+import tempfile
+from wetb.fatigue_tools.fatigue import (cycle_matrix, CycleMatrix, ampl_bin_edges, damage_sums, eq_load_and_cycles, eq_loads_from_cycles,
+                                        fine_ampl_bin_edges, rainflow_astm, rainflow_windap)
+
+
+def weighted_signals(n=5):
+    rng = np.random.default_rng(7)
+    return [(rng.uniform(0.1, 2), np.cumsum(rng.standard_normal(rng.integers(100, 2000)))) for _ in range(n)]
+
+
+def histogram2d_cycle_matrix(signals, ampl_edges, mean_bins, rainflow_func):
+    """Reference: all half cycles of all signals binned with three calls to np.histogram2d"""
+    weights, ampls, means = [np.concatenate(v) for v in zip(*[(np.zeros(c.shape[1]) + w, c[0], c[1])
+                                                              for w, c in [(w, rainflow_func(s)) for w, s in signals]])]
+    cycles, ampl_edges, mean_edges = np.histogram2d(ampls, means, [ampl_edges, mean_bins], weights=weights)
+    ampl_bin_sum = np.histogram2d(ampls, means, [ampl_edges, mean_bins], weights=weights * ampls)[0]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        ampl_bin_mean = np.nanmean(ampl_bin_sum / np.where(cycles, cycles, np.nan), 1)
+    return cycles / 2, ampl_bin_mean, ampl_edges, mean_edges
+
+
+class TestCycleMatrix(unittest.TestCase):
+
+    def test_cycle_matrix_weighted(self):
+        signals = weighted_signals()
+        for rainflow_func in [rainflow_windap, rainflow_astm]:
+            for mean_bins in [1, 4, np.linspace(-50, 50, 6)]:
+                cycles, ampl_bin_mean, ampl_edges, _, mean_edges = cycle_matrix(signals, 10, mean_bins, rainflow_func)
+                cycles_ref, ampl_bin_mean_ref, ampl_edges_ref, mean_edges_ref = histogram2d_cycle_matrix(signals, ampl_edges, mean_bins, rainflow_func)
+                np.testing.assert_array_equal(cycles, cycles_ref)
+                np.testing.assert_array_equal(ampl_edges, ampl_edges_ref)
+                np.testing.assert_array_equal(mean_edges, mean_edges_ref)
+                np.testing.assert_array_equal(ampl_bin_mean, ampl_bin_mean_ref)
+
+    def test_streaming_equals_cycle_matrix(self):
+        signals = weighted_signals()
+        ampl_edges = ampl_bin_edges(46, 60.)
+        cycle_mat = CycleMatrix(ampl_edges)
+        for weight, signal in signals:
+            cycle_mat.add_signal(signal, weight, rainflow_func=rainflow_astm)
+        for streamed, at_once in zip(cycle_mat.cycle_matrix(), cycle_matrix(signals, ampl_edges, 1, rainflow_astm)):
+            np.testing.assert_array_equal(streamed, at_once)
+
+    def test_add_cycles_in_chunks(self):
+        rng = np.random.default_rng(3)
+        ampls, means, weights = rng.uniform(0, 10, 1000), rng.uniform(-5, 5, 1000), rng.uniform(0, 1, 1000)
+        ampls[:3] = [0., 10., 11.]  # on the first and last edge, and outside
+        cycle_mat = CycleMatrix(ampl_bin_edges(8, 10.), np.linspace(-5, 5, 3))
+        for chunk in np.array_split(np.arange(1000), 7):
+            cycle_mat.add_cycles(ampls[chunk], means[chunk], weights[chunk])
+        cycles = np.histogram2d(ampls, means, [ampl_bin_edges(8, 10.), np.linspace(-5, 5, 3)], weights=weights)[0] / 2
+        np.testing.assert_array_equal(cycle_mat.cycle_matrix()[0], cycles)
+
+    def test_no_cycles(self):
+        cycle_mat = CycleMatrix(ampl_bin_edges(4, 1.), [0, 1])
+        cycle_mat.add_cycles([], [])
+        np.testing.assert_array_equal(cycle_mat.cycle_matrix()[0], np.zeros((4, 1)))
+
+    def test_merge_partial_results(self):
+        signals = weighted_signals(8)
+        max_ampl = max(rainflow_astm(signal)[0].max() for _, signal in signals)
+        partials = []
+        for weight, signal in signals:  # e.g. one partial result per case from worker processes
+            partial = CycleMatrix(ampl_bin_edges(46, max_ampl))
+            partial.add_signal(signal, weight, rainflow_func=rainflow_astm)
+            partials.append(pickle.loads(pickle.dumps(partial)))
+        merged = sum(partials[4:], sum(partials[:4], CycleMatrix(ampl_bin_edges(46, max_ampl))))
+        self.assertEqual(merged.max_ampl, max_ampl)
+        eq_loads, cycles, _, _ = eq_load_and_cycles(signals, 46, [3, 4, 5], [10 ** 6, 10 ** 7], rainflow_astm)
+        np.testing.assert_allclose(merged.cycle_matrix()[0].flatten(), cycles, rtol=1e-12)
+        np.testing.assert_allclose(merged.eq_loads([3, 4, 5], [10 ** 6, 10 ** 7]), eq_loads, rtol=1e-12)
+        self.assertRaises(ValueError, merged.merge, CycleMatrix(ampl_bin_edges(45, max_ampl)))
+
+    def test_rebin_fine_edges(self):
+        signals = weighted_signals(8)
+        max_ampl = max(rainflow_astm(signal)[0].max() for _, signal in signals)
+        fine = CycleMatrix(fine_ampl_bin_edges(0, 4096))
+        for weight, signal in signals:  # binned before the largest amplitude of all signals is known
+            ampls, means = rainflow_astm(signal)
+            ampl_edges = fine_ampl_bin_edges(max(fine.max_ampl, ampls.max()), 4096)
+            if not np.array_equal(ampl_edges, fine.ampl_edges):
+                if fine.max_ampl > 0:  # nested grids
+                    self.assertTrue(np.all(np.isin(ampl_edges[ampl_edges <= fine.ampl_edges[-1]], fine.ampl_edges)))
+                fine = fine.rebin(ampl_edges)
+            fine.add_cycles(ampls, means, weight)
+        self.assertEqual(fine.max_ampl, max_ampl)
+        direct = CycleMatrix(fine.ampl_edges)
+        for weight, signal in signals:
+            direct.add_signal(signal, weight, rainflow_func=rainflow_astm)
+        np.testing.assert_allclose(fine.bin_sums, direct.bin_sums, rtol=1e-12)
+
+        # rebinned to the final edges, only the cycles close to the edges can differ
+        eq_loads = eq_load_and_cycles(signals, 46, [3, 4, 5], [10 ** 6, 10 ** 7], rainflow_astm)[0]
+        rebinned = fine.rebin(ampl_bin_edges(46, fine.max_ampl))
+        np.testing.assert_array_equal(rebinned.ampl_edges, ampl_bin_edges(46, max_ampl))
+        np.testing.assert_allclose(rebinned.bin_sums.sum((1, 2)), fine.bin_sums.sum((1, 2)), rtol=1e-12)
+        np.testing.assert_allclose(rebinned.eq_loads([3, 4, 5], [10 ** 6, 10 ** 7]), eq_loads, rtol=1e-4)
+
+    def test_serialization(self):
+        cycle_mat = CycleMatrix(ampl_bin_edges(10, 20.), np.linspace(-30, 30, 4))
+        for weight, signal in weighted_signals(3):
+            cycle_mat.add_signal(signal, weight)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cycle_mat.save(os.path.join(tmp_dir, 'cycle_matrix.npz'))
+            loaded = CycleMatrix.load(os.path.join(tmp_dir, 'cycle_matrix.npz'))
+        for cycle_mat_copy in [loaded, CycleMatrix.from_dict(cycle_mat.to_dict())]:
+            for a, b in zip(cycle_mat_copy.cycle_matrix(), cycle_mat.cycle_matrix()):
+                np.testing.assert_array_equal(a, b)
+            self.assertEqual(cycle_mat_copy.max_ampl, cycle_mat.max_ampl)
+        with self.assertWarns(UserWarning):
+            cycle_mat.eq_loads([4], [1])
+
+    def test_eq_loads_from_cycles(self):
+        signals = [[(1, signal)] for _, signal in weighted_signals(3)]
+        m, neq = [3, 4, 5], [10 ** 6, 10 ** 7]
+        results = [eq_load_and_cycles(signal, 46, m, neq, rainflow_astm) for signal in signals]
+        eq_loads = eq_loads_from_cycles(25 * np.array([r[1] for r in results]), np.array([r[2] for r in results]), m, neq)
+        self.assertEqual(eq_loads.shape, (3, 2, 3))
+        np.testing.assert_array_equal(eq_loads, [r[0] for r in results])
+        # broadcasting of a single set of bins and scalar exponent and equivalent number
+        np.testing.assert_array_equal(eq_loads_from_cycles(25 * results[0][1], results[0][2], 4, 10 ** 7), [[results[0][0][1][1]]])
+        # damage sums of the exponents, e.g. of (sector, bin) stacks of moment cycles
+        cycles, ampl_bin_mean = np.array([r[1] for r in results]), np.array([r[2] for r in results])
+        sums = damage_sums(cycles, ampl_bin_mean, m)
+        self.assertEqual(sums.shape, (3, 3))
+        np.testing.assert_allclose(sums[:, 2], np.nansum(cycles * ampl_bin_mean ** 5, -1), rtol=1e-14)
+
+
+if __name__ == "__main__":
+    unittest.main()
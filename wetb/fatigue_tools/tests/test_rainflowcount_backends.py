@@ -0,0 +1,68 @@
+'''
+Parity tests of the numba compiled rainflow counting routines against the python implementations
+'''
+import unittest
+
+import numpy as np
+from wetb.fatigue_tools.rainflowcounting import rainflowcount
+from wetb.fatigue_tools.rainflowcounting.rainflowcount import rainflow_astm, rainflow_windap, get_backend
+
+
+def signals(n=20):
+    """Random walks of various lengths, every other rounded to give plateaus and repeated levels"""
+    rng = np.random.default_rng(42)
+    for i in range(n):
+        signal = np.cumsum(rng.standard_normal(rng.integers(10, 5000)))
+        if i % 2:
+            signal = np.round(signal)
+        if i % 3 == 0:
+            signal[:5] = signal[0]  # leading plateau
+        yield signal
+
+
+@unittest.skipIf('numba' not in rainflowcount.backends, "numba not installed")
+class TestRainflowcountBackends(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.py = get_backend('python')
+        self.nb = get_backend('numba')
+        self.signal = np.array([-2.0, 0.0, 1.0, 0.0, -3.0, 0.0, 5.0, 0.0, -1.0, 0.0, 3.0, 0.0, -4.0, 0.0, 4.0, 0.0, -2.0])
+
+    def test_default_backend(self):
+        self.assertEqual(rainflowcount.default_backend, 'numba')
+        self.assertRaises(ValueError, get_backend, 'cython')
+
+    def test_peak_trough(self):
+        for signal in signals():
+            signal = np.round((signal - signal.min()) / np.ptp(signal) * 255).astype(int)
+            np.testing.assert_array_equal(self.nb['peak_trough'](signal, 255 / 50),
+                                          self.py['peak_trough'](signal, 255 / 50))
+
+    def test_pair_range_amplitude_mean(self):
+        for signal in signals():
+            signal = np.round((signal - signal.min()) / np.ptp(signal) * 255).astype(int)
+            sig_ext = self.py['peak_trough'](signal, 255 / 50)
+            np.testing.assert_array_equal(self.nb['pair_range_amplitude_mean'](sig_ext),
+                                          np.array(self.py['pair_range_amplitude_mean'](sig_ext)))
+
+    def test_find_extremes(self):
+        for signal in signals():
+            np.testing.assert_array_equal(self.nb['find_extremes'](signal), self.py['find_extremes'](signal))
+
+    def test_rainflowcount(self):
+        for signal in signals():
+            sig_ext = self.py['find_extremes'](signal)
+            np.testing.assert_array_equal(self.nb['rainflowcount'](sig_ext), np.array(self.py['rainflowcount'](sig_ext)))
+
+    def test_rainflow_windap(self):
+        for signal in [self.signal] + list(signals()):
+            np.testing.assert_array_equal(rainflow_windap(signal, backend='numba'), rainflow_windap(signal, backend='python'))
+
+    def test_rainflow_astm(self):
+        for signal in [self.signal] + list(signals()):
+            np.testing.assert_array_equal(rainflow_astm(signal, backend='numba'), rainflow_astm(signal, backend='python'))
+
+
+if __name__ == "__main__":
+    unittest.main()